@@ -57,10 +57,10 @@ def create_app(config_class=Config):
     from app.api import bp as api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
     
-    # Initialize metrics
+    # Initialize metrics (one sample per request, labelled by route) and /metrics
     if app.config.get('ENABLE_METRICS'):
-        from utils.metrics import MetricsMiddleware
-        app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+        from utils.metrics import init_metrics
+        init_metrics(app)
     
     # Initialize logging
     config_class.init_app(app)
@@ -0,0 +1,66 @@
+import logging
+from concurrent.futures import Future
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+def canonical_key(username):
+    """Key under which a cleaned username is cached and deduplicated"""
+    return username.strip().lstrip('@').lower()
+
+def normalize_usernames(usernames, clean_username):
+    """Clean a submitted batch and collapse duplicates, keeping first-seen order.
+
+    clean_username is the scraper's cleaner (InstagramScraper.clean_username),
+    so '@Foo', 'foo' and 'https://instagram.com/foo/?hl=en' all map to 'foo'.
+    Returns (unique usernames, number of duplicates dropped).
+    """
+    seen = set()
+    unique = []
+    duplicates = 0
+    for username in usernames:
+        try:
+            cleaned = clean_username(username)
+        except ValueError:
+            continue
+        if not cleaned:
+            continue
+        key = canonical_key(cleaned)
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        unique.append(key)
+    return unique, duplicates
+
+class InFlightRegistry:
+    """Single-flight map from canonical username to the fetch currently running for it.
+
+    The first batch to claim a username does the fetch; every other batch in
+    the process that asks for it meanwhile waits on the same Future.
+    """
+    def __init__(self):
+        self.pending = {}
+        self.lock = Lock()
+        self.shared = 0
+
+    def claim(self, username):
+        """Return (future, owner); the owner must call resolve() when done"""
+        key = canonical_key(username)
+        with self.lock:
+            future = self.pending.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = Future()
+            self.pending[key] = future
+            return future, True
+
+    def resolve(self, username, result):
+        with self.lock:
+            future = self.pending.pop(canonical_key(username), None)
+        if future is not None:
+            future.set_result(result)
+
+# Shared by every FetchEngine in this process
+inflight = InFlightRegistry()
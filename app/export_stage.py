@@ -0,0 +1,221 @@
+import time
+import logging
+import multiprocessing
+import queue as queue_module
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from config import Config
+from app.exporter import BatchExporter
+from app.jobs import JobStore
+from app.result_store import open_result_writer
+from app.tracing import EXPORT, RENDER, StageTimes, flush, record_stage, stage
+from app.utils.file_index import FileIndex
+
+logger = logging.getLogger(__name__)
+
+class JobOutputs:
+    """Every output of one job: the TXT/XLSX batch files and the Parquet copy.
+
+    data_dir None skips the TXT/XLSX files (the Celery task only keeps the
+    Parquet copy). The time spent serializing is added to the job's stage
+    breakdown in the job store at job_store_path when it closes.
+    """
+    def __init__(self, job_id, stamp, total, data_dir=None, file_index=None, job_store_path=None):
+        self.job_id = job_id
+        self.job_store_path = job_store_path
+        self.seconds = 0.0
+        self.exporter = None
+        if data_dir:
+            self.exporter = BatchExporter(data_dir, stamp, total, file_index=file_index, job_id=job_id)
+        # Typed columnar copy of the results for analytics across jobs (None without pyarrow)
+        self.results = open_result_writer(job_id, stamp)
+
+    def add(self, index, username, result):
+        started = time.perf_counter()
+        if self.exporter:
+            self.exporter.add(index, username, result)
+        if self.results:
+            self.results.add(index, username, result)
+        self.seconds += time.perf_counter() - started
+
+    def close(self):
+        started = time.perf_counter()
+        try:
+            if self.exporter:
+                self.exporter.close()
+        finally:
+            if self.results:
+                self.results.close()
+            # One export pass per job in the histogram, however many results it had
+            times = StageTimes()
+            record_stage(EXPORT, self.seconds + time.perf_counter() - started, times)
+            if self.job_store_path:
+                flush(JobStore(self.job_store_path), self.job_id, times)
+
+def _render_job(items, job_id, stamp, total, data_dir, index_path, idle_timeout, job_store_path=None):
+    """Pool worker: write a job's outputs from the chunks arriving on items until the None sentinel"""
+    file_index = FileIndex(index_path, data_dir) if data_dir and index_path else None
+    outputs = JobOutputs(job_id, stamp, total, data_dir, file_index, job_store_path)
+    count = 0
+    try:
+        while True:
+            try:
+                chunk = items.get(timeout=idle_timeout)
+            except queue_module.Empty:
+                logger.warning(f"Export of job {job_id} got no results for {idle_timeout}s; finalizing")
+                break
+            if chunk is None:
+                break
+            for index, username, result in chunk:
+                outputs.add(index, username, result)
+            count += len(chunk)
+    finally:
+        outputs.close()
+    return count
+
+def render_view(filename, job_id, stamp, total, data_dir, job_store_path):
+    """Write one result file of a job into data_dir from its checkpointed results"""
+    store = JobStore(job_store_path)
+    times = StageTimes()
+    count = 0
+    with stage(RENDER, times=times, filename=filename):
+        exporter = BatchExporter(data_dir, stamp, total, job_id=job_id, only=filename)
+        try:
+            for position, username, result in store.completed_items(job_id):
+                exporter.add(position, username, result)
+                count += 1
+        finally:
+            exporter.close()
+    flush(store, job_id, times)
+    return count
+
+class InlineExportSink:
+    """Writes results in the calling thread; used when the stage has no worker processes"""
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def add(self, index, username, result):
+        self.outputs.add(index, username, result)
+
+    def close(self):
+        self.outputs.close()
+
+class QueuedExportSink:
+    """Hands results to an export worker process in chunks of chunk_size.
+
+    add() only appends to a list, so it is cheap enough to run on the fetch
+    engine's event loop; close() sends the rest and returns without waiting
+    for the files to be written.
+    """
+    def __init__(self, job_id, items, future, chunk_size):
+        self.job_id = job_id
+        self.items = items
+        self.future = future
+        self.chunk_size = chunk_size
+        self.pending = []
+
+    def add(self, index, username, result):
+        self.pending.append((index, username, result))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.items.put(self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.items.put(None)
+
+class ExportStage:
+    """Process pool that renders job outputs while the scraping threads move on.
+
+    Spreadsheet serialization is CPU-bound and holds the GIL, so doing it in
+    the scraping process slows the fetch workers and delays the next job.
+    Each job gets a long-running task in the pool that reads its results from
+    a queue; with EXPORT_WORKERS = 0, or where child processes cannot be
+    started (e.g. inside a daemonic Celery worker), outputs are written inline.
+    Downloads are rendered in a pool of their own (RENDER_WORKERS), so they
+    never queue behind the jobs holding the export workers.
+    """
+    def __init__(self, workers=None, chunk_size=None, idle_timeout=None, render_workers=None):
+        self.workers = Config.EXPORT_WORKERS if workers is None else workers
+        self.render_workers = Config.RENDER_WORKERS if render_workers is None else render_workers
+        self.chunk_size = chunk_size or Config.EXPORT_CHUNK_SIZE
+        self.idle_timeout = idle_timeout or Config.EXPORT_IDLE_TIMEOUT
+        self.pool = None
+        self.render_pool = None
+        self.manager = None
+        self.lock = Lock()
+
+    def _start(self):
+        # spawn: forking a process that runs Flask and fetch threads is not safe
+        context = multiprocessing.get_context('spawn')
+        if self.manager is None:
+            self.manager = context.Manager()
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    def _start_render(self):
+        if self.render_pool is None:
+            context = multiprocessing.get_context('spawn')
+            self.render_pool = ProcessPoolExecutor(max_workers=self.render_workers, mp_context=context)
+
+    def open(self, job_id, stamp, total, data_dir=None, file_index=None, job_store_path=None):
+        """Sink with add(index, username, result)/close() for a job's results.
+
+        With job_store_path the export time is added to the job's stage breakdown there.
+        """
+        if self.workers:
+            try:
+                with self.lock:
+                    self._start()
+                    items = self.manager.Queue()
+                    future = self.pool.submit(
+                        _render_job, items, job_id, stamp, total, data_dir,
+                        file_index.path if file_index else None, self.idle_timeout, job_store_path
+                    )
+                future.add_done_callback(lambda f: self._finished(job_id, f))
+                return QueuedExportSink(job_id, items, future, self.chunk_size)
+            except Exception as e:
+                logger.warning(f"Export workers unavailable ({str(e)}); writing job {job_id} inline")
+                self.workers = 0
+        return InlineExportSink(JobOutputs(job_id, stamp, total, data_dir, file_index, job_store_path))
+
+    def render(self, filename, job_id, stamp, total, data_dir, job_store_path):
+        """Render one result file in the render pool and wait for it (see render_view)"""
+        args = (filename, job_id, stamp, total, data_dir, job_store_path)
+        if self.render_workers:
+            try:
+                with self.lock:
+                    self._start_render()
+                    future = self.render_pool.submit(render_view, *args)
+            except Exception as e:
+                logger.warning(f"Render workers unavailable ({str(e)}); rendering {filename} inline")
+                self.render_workers = 0
+            else:
+                return future.result()
+        return render_view(*args)
+
+    def _finished(self, job_id, future):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Export of job {job_id} failed: {str(error)}")
+        else:
+            logger.info(f"Exported {future.result()} result(s) of job {job_id}")
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=wait)
+                self.pool = None
+            if self.render_pool is not None:
+                self.render_pool.shutdown(wait=wait)
+                self.render_pool = None
+            if self.manager is not None:
+                self.manager.shutdown()
+                self.manager = None
+
+# Shared by every job in this process
+export_stage = ExportStage()
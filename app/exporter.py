@@ -0,0 +1,275 @@
+import os
+import logging
+from datetime import datetime
+from openpyxl import Workbook
+from app.segments import configured_segments
+
+logger = logging.getLogger(__name__)
+
+EXCEL_COLUMNS = [
+    'Username', 'Full Name', 'Biography', 'Followers', 'Following', 'Posts Count',
+    'Verified', 'Private', 'External URL', 'Profile Picture URL', 'Scraped At',
+    'Status', 'Note', 'Posts Error'
+]
+
+# Result files of a batch are <kind>_<stamp>.<ext>: all_profiles and one kind per segment
+VIEW_EXTENSIONS = ('txt', 'xlsx')
+
+def view_names(kind, stamp):
+    return [f'{kind}_{stamp}.{ext}' for ext in VIEW_EXTENSIONS]
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _show(value):
+    return 'N/A' if value is None else value
+
+def build_row(record):
+    """Encode a scraped profile once as an Excel row shared by every output"""
+    return (
+        record.username,
+        _show(record.full_name),
+        _show(record.biography),
+        _show(record.followers),
+        _show(record.following),
+        _show(record.posts_count),
+        'Yes' if record.is_verified else 'No',
+        'Yes' if record.is_private else 'No',
+        _show(record.external_url),
+        _show(record.profile_pic_url),
+        _show(record.scraped_at),
+        'Success',
+        record.note or '',
+        record.posts_error or ''
+    )
+
+class XlsxStreamWriter:
+    """Append-only XLSX writer backed by openpyxl's write-only mode.
+
+    Rows are streamed to a temporary file as they are appended, so memory
+    stays flat however many rows the sheet ends up with.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet('Sheet1')
+        self.sheet.append(EXCEL_COLUMNS)
+
+    def append(self, row):
+        self.sheet.append(row)
+        self.rows += 1
+
+    def close(self):
+        self.workbook.save(self.path)
+
+class TxtGroupWriter:
+    """Text summary of one segment, flushed after every profile"""
+    def __init__(self, path, title):
+        self.path = path
+        self.rows = 0
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write(f"{title}\n")
+        self.file.write("=" * 50 + "\n\n")
+        self.file.write(f"Generated: {_now()}\n\n")
+        self.file.write("-" * 50 + "\n\n")
+
+    def append(self, row):
+        self.file.write(f"Username: {row[0]}\n")
+        self.file.write(f"Posts Count: {row[5]}\n")
+        self.file.write(f"Full Name: {row[1]}\n")
+        self.file.write(f"Followers: {row[3]}\n")
+        self.file.write(f"Following: {row[4]}\n")
+        self.file.write("-" * 30 + "\n")
+        self.file.flush()
+        self.rows += 1
+
+    def close(self):
+        self.file.write(f"\nTotal Profiles: {self.rows}\n")
+        self.file.close()
+
+class ProfileGroup:
+    """Lazily opened TXT + XLSX pair for one segment; a None path skips that file"""
+    def __init__(self, txt_path, excel_path, title):
+        self.txt_path = txt_path
+        self.excel_path = excel_path
+        self.title = title
+        self.txt = None
+        self.excel = None
+        self.rows = 0
+
+    @property
+    def opened(self):
+        return self.rows > 0
+
+    def append(self, row):
+        if not self.opened:
+            if self.excel_path:
+                self.excel = XlsxStreamWriter(self.excel_path)
+            if self.txt_path:
+                self.txt = TxtGroupWriter(self.txt_path, self.title)
+        if self.excel:
+            self.excel.append(row)
+        if self.txt:
+            self.txt.append(row)
+        self.rows += 1
+
+    def close(self):
+        if self.excel:
+            self.excel.close()
+        if self.txt:
+            self.txt.close()
+
+class BatchExporter:
+    """Writes each scraped profile to the batch's result files as soon as it arrives.
+
+    Produces the full TXT log, the all-profiles XLSX and a TXT/XLSX pair for
+    each segment with at least one profile (by default 1-5 and more than 5
+    posts). Every file is registered with file_index as it is created and
+    again once finalized. With only set to one of those file names, just that
+    file is written.
+    """
+    def __init__(self, data_dir, timestamp, total, file_index=None, job_id=None, only=None, segments=None):
+        self.total = total
+        self.file_index = file_index
+        self.job_id = job_id
+        self.successful = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.unknown_posts = 0
+
+        def path(kind, ext):
+            name = f'{kind}_{timestamp}.{ext}'
+            if only is not None and name != only:
+                return None
+            return os.path.join(data_dir, name)
+
+        self.main_txt = path('all_profiles', 'txt')
+        excel_path = path('all_profiles', 'xlsx')
+        self.main_excel = XlsxStreamWriter(excel_path) if excel_path else None
+        segments = configured_segments if segments is None else segments
+        self.groups = [
+            (segment, ProfileGroup(path(segment.name, 'txt'), path(segment.name, 'xlsx'), segment.title))
+            for segment in segments
+        ]
+
+        # The log text is cheap next to the spreadsheets; without its file it goes nowhere
+        self.log = open(self.main_txt or os.devnull, 'w', encoding='utf-8')
+        self.log.write(f"Instagram Profile Data Scraping Results\n")
+        self.log.write(f"Generated: {_now()}\n")
+        self.log.write(f"Powered by: insta-scrape \n")
+        self.log.write("=" * 80 + "\n\n")
+
+        self.log.write("IMPORTANT NOTES:\n")
+        self.log.write("- Instagram heavily restricts automated data access\n")
+        self.log.write("- This tool provides basic public profile information only\n")
+        self.log.write("- For detailed analytics, use Instagram Business API\n")
+        self.log.write("- Respect Instagram's Terms of Service and rate limits\n")
+        self.log.write("=" * 80 + "\n\n")
+        self.log.flush()
+        self._register(self.main_txt)
+
+    def add(self, index, username, profile_data):
+        """Record one result; usable directly as a FetchEngine on_result callback"""
+        try:
+            self._write_profile(index, username, profile_data)
+        finally:
+            self.log.flush()
+
+    def _write_profile(self, index, username, profile_data):
+        f = self.log
+        f.write(f"PROFILE {index + 1}/{self.total}: @{username}\n")
+        f.write("-" * 50 + "\n")
+
+        if 'error' in profile_data:
+            f.write(f"❌ ERROR: {profile_data['error']}\n")
+
+            if profile_data.get('scraping_status') == 'rate_limited':
+                self.rate_limited += 1
+                f.write("💡 TIP: Try again later when rate limits reset\n")
+            else:
+                self.failed += 1
+
+            f.write("\n")
+            return
+
+        self.successful += 1
+        record = profile_data
+
+        # Write profile information
+        f.write(f"✅ Successfully scraped: @{record.username}\n")
+        f.write(f"📁 Profile URL: {_show(record.profile_url)}\n")
+        f.write(f"👤 Full Name: {_show(record.full_name)}\n")
+        f.write(f"📝 Biography: {_show(record.biography)}\n")
+        f.write(f"👥 Followers: {_show(record.followers)}\n")
+        f.write(f"➡️ Following: {_show(record.following)}\n")
+        f.write(f"📸 Posts Count: {_show(record.posts_count)}\n")
+        f.write(f"✔️ Verified: {'Yes' if record.is_verified else 'No'}\n")
+        f.write(f"🔒 Private: {'Yes' if record.is_private else 'No'}\n")
+        f.write(f"🔗 External URL: {_show(record.external_url)}\n")
+        f.write(f"🖼️ Profile Picture: {_show(record.profile_pic_url)}\n")
+        f.write(f"⏰ Scraped At: {record.scraped_at}\n")
+
+        # Add notes if any
+        if record.note:
+            f.write(f"📋 Note: {record.note}\n")
+
+        if record.posts_error:
+            f.write(f"⚠️ Posts Info: {record.posts_error}\n")
+
+        row = build_row(record)
+        # The all-profiles sheet lists profiles with posts; a count that could not be read is reported
+        if record.posts_count is None:
+            self.unknown_posts += 1
+        elif record.posts_count and self.main_excel:
+            self.main_excel.append(row)
+
+        for segment, group in self.groups:
+            if not segment.matches(record):
+                continue
+            opened = group.opened
+            group.append(row)
+            if not opened:
+                self._register(group.txt_path)
+
+        f.write("\n" + "=" * 80 + "\n\n")
+
+    def close(self):
+        """Write the summary and finalize the spreadsheets"""
+        f = self.log
+        f.write("SCRAPING SUMMARY:\n")
+        f.write("-" * 30 + "\n")
+        f.write(f"✅ Successful: {self.successful}\n")
+        f.write(f"❌ Failed: {self.failed}\n")
+        f.write(f"⏱️ Rate Limited: {self.rate_limited}\n")
+        f.write(f"📊 Total Processed: {self.total}\n")
+        for segment, group in self.groups:
+            f.write(f"👥 {segment.label}: {group.rows}\n")
+        if self.unknown_posts:
+            f.write(f"❔ Post Count Unavailable: {self.unknown_posts}\n")
+        f.write(f"⏰ Completed At: {_now()}\n")
+        f.close()
+
+        try:
+            for _, group in self.groups:
+                group.close()
+            if self.main_excel:
+                self.main_excel.close()
+        except Exception as e:
+            logger.error(f"Error creating Excel files: {str(e)}")
+
+        self._register(self.main_txt)
+        if self.main_excel:
+            self._register(self.main_excel.path)
+        for _, group in self.groups:
+            if group.opened:
+                self._register(group.txt_path)
+                self._register(group.excel_path)
+
+    def _register(self, path):
+        if self.file_index is None or path is None:
+            return
+        try:
+            self.file_index.register(path, job_id=self.job_id)
+        except Exception as e:
+            logger.error(f"Error indexing {os.path.basename(path)}: {str(e)}")
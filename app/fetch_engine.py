@@ -0,0 +1,143 @@
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from app.session_pool import SessionPool
+from app.dedup import inflight
+from app.tracing import RATE_LIMIT_WAIT, stage
+from app.profiler import current_profiler
+
+logger = logging.getLogger(__name__)
+
+class FetchEngine:
+    """Scrape a batch of usernames concurrently across a pool of sessions.
+
+    Pacing comes only from the per-session token buckets, so batch time is
+    bounded by the real rate budget instead of fixed sleeps between profiles.
+    """
+    def __init__(self, sessions, concurrency=None, requests_per_minute=None, burst=None,
+                 cache=None, refresh=False):
+        if isinstance(sessions, SessionPool):
+            self.pool = sessions
+        else:
+            if not isinstance(sessions, (list, tuple)):
+                sessions = [sessions]
+            if not sessions:
+                raise ValueError("At least one scraper is required")
+            self.pool = SessionPool.from_scrapers(
+                sessions, requests_per_minute=requests_per_minute, burst=burst
+            )
+
+        self.concurrency = concurrency or Config.SCRAPE_CONCURRENCY
+        # Fresh cache hits skip the network and the session budget; refresh forces a re-fetch
+        self.cache = cache
+        self.refresh = refresh
+
+    def run(self, usernames, on_result=None):
+        """Blocking wrapper around run_async, safe to call from a worker thread"""
+        return asyncio.run(self.run_async(usernames, on_result))
+
+    async def run_async(self, usernames, on_result=None):
+        """Scrape all usernames and return results in input order.
+
+        on_result(index, username, result) is called on the event loop thread as
+        each profile finishes, so callers can write output without extra locking.
+        """
+        usernames = list(usernames)
+        results = [None] * len(usernames)
+        if not usernames:
+            return results
+
+        queue = asyncio.Queue()
+        for item in enumerate(usernames):
+            queue.put_nowait(item)
+
+        loop = asyncio.get_running_loop()
+        workers = min(self.concurrency, len(usernames))
+        started = time.monotonic()
+
+        # A profiled job samples its fetch threads as well
+        profiler = current_profiler()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch',
+                                initializer=profiler.attach if profiler else None) as executor:
+            async def worker():
+                while True:
+                    try:
+                        index, username = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+
+                    result = await self._lookup(loop, executor, username)
+                    results[index] = result
+                    if on_result:
+                        on_result(index, username, result)
+
+            await asyncio.gather(*(worker() for _ in range(workers)))
+
+        elapsed = time.monotonic() - started
+        logger.info(f"Fetched {len(usernames)} profiles in {elapsed:.1f}s "
+                    f"({len(usernames) / elapsed if elapsed else 0:.2f} profiles/s)")
+        return results
+
+    async def _lookup(self, loop, executor, username):
+        """Resolve a username from the cache, a fetch already in flight, or the network"""
+        if self.cache and not self.refresh:
+            result = self.cache.get(username)
+            if result is not None:
+                result.from_cache = True
+                return result
+
+        future, owner = inflight.claim(username)
+        if not owner:
+            # Another batch (or a duplicate in this one) is already fetching this profile
+            return await asyncio.wrap_future(future)
+
+        result = None
+        try:
+            result = await self._fetch(loop, executor, username)
+            if self.cache:
+                self.cache.set(username, result)
+        finally:
+            inflight.resolve(username, result or {
+                'error': f'Fetch for {username} was interrupted',
+                'username': username,
+                'scraping_status': 'error'
+            })
+        return result
+
+    async def _fetch(self, loop, executor, username):
+        """Fetch one profile, retrying on the next available session after throttling or logout"""
+        result = None
+        for _ in range(max(len(self.pool), Config.MAX_RETRIES)):
+            pooled, delay = self.pool.reserve()
+            if pooled is None:
+                # Whatever the last session answered (e.g. auth_failed), the profile itself
+                # was never fetched: auth_required keeps it pending for a resume
+                return {
+                    'error': 'No healthy Instagram sessions available. Please login again.',
+                    'username': username,
+                    'scraping_status': 'auth_required'
+                }
+
+            try:
+                if delay:
+                    with stage(RATE_LIMIT_WAIT):
+                        await asyncio.sleep(delay)
+                # Copy the context so Flask's app context follows the call into the thread
+                ctx = contextvars.copy_context()
+                result = await loop.run_in_executor(
+                    executor, ctx.run, pooled.scraper.scrape_profile, username
+                )
+            except Exception as e:
+                logger.error(f"Error scraping {username}: {str(e)}")
+                result = {
+                    'error': f'Unexpected error scraping {username}: {str(e)}',
+                    'username': username,
+                    'scraping_status': 'error'
+                }
+
+            if not self.pool.release(pooled, result):
+                return result
+        return result
@@ -0,0 +1,160 @@
+import time
+import logging
+from threading import Lock
+from config import Config
+from utils.metrics import track_fetch_strategy
+
+logger = logging.getLogger(__name__)
+
+# Configured strategy orders; 'adaptive' starts from the JSON-first order and re-ranks as it learns
+ORDERS = {
+    'json-first': ('json', 'html'),
+    'html-first': ('html', 'json'),
+    'adaptive': ('json', 'html')
+}
+
+# Below this moving success rate a strategy counts as not working and ranks after those that do
+WORKING_RATE = 0.5
+
+class FetchStrategy:
+    """One way of turning a username into profile data.
+
+    fetch(scraper, username) returns a result dict when it has an answer (a
+    profile, a throttle/login result or a not-found result) and None, or
+    raises, when this strategy could not produce one.
+    """
+    name = None
+
+    def fetch(self, scraper, username):
+        raise NotImplementedError
+
+class JsonApiStrategy(FetchStrategy):
+    """web_profile_info JSON endpoint: a few KB and a json.loads"""
+    name = 'json'
+
+    def fetch(self, scraper, username):
+        return scraper.scrape_profile_api(username)
+
+class HtmlProfileStrategy(FetchStrategy):
+    """Profile page HTML parsed by instascrape: the full page plus BeautifulSoup"""
+    name = 'html'
+
+    def fetch(self, scraper, username):
+        return scraper.scrape_profile_html(username)
+
+STRATEGIES = {
+    JsonApiStrategy.name: JsonApiStrategy,
+    HtmlProfileStrategy.name: HtmlProfileStrategy
+}
+
+class StrategyStats:
+    """Moving success rate and latency of one strategy"""
+    def __init__(self, name, alpha):
+        self.name = name
+        self.alpha = alpha
+        self.attempts = 0
+        self.successes = 0
+        self.success_rate = 1.0  # optimistic until measured
+        self.latency = None
+
+    def record(self, ok, seconds):
+        self.attempts += 1
+        if ok:
+            self.successes += 1
+        self.success_rate += self.alpha * ((1.0 if ok else 0.0) - self.success_rate)
+        self.latency = seconds if self.latency is None else self.latency + self.alpha * (seconds - self.latency)
+
+    def cost(self):
+        """Expected seconds per successful fetch; 0 while unmeasured so it gets tried"""
+        if self.latency is None:
+            return 0.0
+        return self.latency / max(self.success_rate, 0.01)
+
+    def rank(self):
+        # A failing strategy still spends a request from the session budget, however fast it fails
+        return (self.success_rate < WORKING_RATE, self.cost())
+
+    def to_dict(self):
+        return {
+            'strategy': self.name,
+            'attempts': self.attempts,
+            'successes': self.successes,
+            'success_rate': round(self.success_rate, 3),
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None
+        }
+
+class StrategyRouter:
+    """Tries fetch strategies in order until one answers, and records how each one does.
+
+    With mode 'adaptive' the order is re-ranked by expected cost per success
+    (latency / success rate) among the strategies that currently work, so the
+    cheapest working one goes first. Every probe_every fetches the last-ranked
+    one is tried first instead, so a strategy that recovers is noticed.
+    """
+    def __init__(self, mode=None, probe_every=None, alpha=0.2):
+        self.mode = mode or Config.FETCH_STRATEGY
+        if self.mode not in ORDERS:
+            raise ValueError(f"Unknown fetch strategy order: {self.mode}")
+        self.probe_every = probe_every or Config.FETCH_STRATEGY_PROBE_EVERY
+        self.strategies = [STRATEGIES[name]() for name in ORDERS[self.mode]]
+        self.stats = {s.name: StrategyStats(s.name, alpha) for s in self.strategies}
+        self.fetches = 0
+        self.lock = Lock()
+
+    def order(self):
+        """Strategies in the order the next fetch should try them"""
+        with self.lock:
+            self.fetches += 1
+            if self.mode != 'adaptive':
+                return list(self.strategies)
+            ranked = sorted(self.strategies, key=lambda s: self.stats[s.name].rank())
+            if len(ranked) > 1 and self.fetches % self.probe_every == 0:
+                ranked.insert(0, ranked.pop())
+            return ranked
+
+    def record(self, name, ok, seconds):
+        with self.lock:
+            self.stats[name].record(ok, seconds)
+        track_fetch_strategy(name, 'success' if ok else 'failure', seconds)
+
+    def fetch(self, scraper, username):
+        """First answer from the strategies in order, or None if none produced one.
+
+        If every strategy failed and at least one raised, the last exception is
+        re-raised so the caller can still tell auth failures and 429s apart.
+        """
+        error = None
+        for strategy in self.order():
+            started = time.monotonic()
+            try:
+                result = strategy.fetch(scraper, username)
+            except Exception as e:
+                self.record(strategy.name, False, time.monotonic() - started)
+                logger.warning(f"{strategy.name} fetch failed for {username}: {str(e)}")
+                error = e
+                continue
+
+            elapsed = time.monotonic() - started
+            status = (result or {}).get('scraping_status')
+            if result is not None and status in ('rate_limited', 'login_redirect', 'auth_failed'):
+                # Throttling and rejected sessions are about the session, not the strategy
+                return result
+            self.record(strategy.name, result is not None, elapsed)
+            if result is not None:
+                return result
+        if error is not None:
+            raise error
+        return None
+
+    def status(self):
+        with self.lock:
+            ranked = sorted(self.strategies, key=lambda s: self.stats[s.name].rank()) \
+                if self.mode == 'adaptive' else self.strategies
+            return {
+                'mode': self.mode,
+                'order': [s.name for s in ranked],
+                'strategies': [self.stats[s.name].to_dict() for s in ranked]
+            }
+
+# Shared by every scraper in this process, so what one session learns routes the others
+strategy_router = StrategyRouter()
@@ -0,0 +1,402 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+from config import Config
+from app.utils.db import connect, ensure_parent_dir
+from app.profile_record import dump_result, load_result
+from app.tracing import QUEUE_WAIT, job_timing, flush, record_stage
+from app.profiler import profile_job
+
+logger = logging.getLogger(__name__)
+
+# Job states; queued and running jobs are picked up again after a restart
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'  # stopped because no healthy session was left
+COMPLETED = 'completed'
+FAILED = 'failed'
+UNFINISHED = (QUEUED, RUNNING, PAUSED)
+
+PENDING = 'pending'
+
+# Results that mean "try again later" rather than an answer for the profile
+RETRYABLE_STATUSES = ('auth_required',)
+
+class JobEvents:
+    """Wakes progress streams when a job running in this process checkpoints.
+
+    Streams for jobs running in another process (Celery) fall back to
+    re-reading the store every JOB_EVENTS_TIMEOUT seconds. A job is only
+    tracked while it runs or a stream waits on it.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.versions = {}
+        self.waiters = {}
+        self.closed = set()  # finished jobs forgotten once their last stream stops waiting
+
+    def notify(self, job_id):
+        with self.condition:
+            self.versions[job_id] = self.versions.get(job_id, 0) + 1
+            self.condition.notify_all()
+
+    def close(self, job_id):
+        """Wake the job's streams one last time and forget the job"""
+        with self.condition:
+            self.versions[job_id] = self.versions.get(job_id, 0) + 1
+            self.condition.notify_all()
+            if self.waiters.get(job_id):
+                self.closed.add(job_id)
+            else:
+                self.versions.pop(job_id, None)
+
+    def wait(self, job_id, version, timeout):
+        """Block until the job's version differs from `version` or timeout; returns the current version"""
+        with self.condition:
+            self.waiters[job_id] = self.waiters.get(job_id, 0) + 1
+            try:
+                self.condition.wait_for(lambda: self.versions.get(job_id, 0) != version, timeout)
+                return self.versions.get(job_id, 0)
+            finally:
+                self.waiters[job_id] -= 1
+                if not self.waiters[job_id]:
+                    del self.waiters[job_id]
+                    if job_id in self.closed:
+                        self.closed.discard(job_id)
+                        self.versions.pop(job_id, None)
+
+job_events = JobEvents()
+
+class JobStore:
+    """Durable record of scrape batches and the status of every username in them.
+
+    Each finished profile is checkpointed with its result, so a job interrupted
+    by a restart resumes with only the usernames that are still pending.
+    """
+    def __init__(self, path=None, stale_after=None):
+        self.path = path or Config.JOB_STORE_PATH
+        self.stale_after = stale_after or Config.JOB_STALE_AFTER
+        ensure_parent_dir(self.path)
+        with connect(self.path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    stamp TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    heartbeat_at REAL,
+                    owner TEXT
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_items (
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    username TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    updated_at REAL,
+                    PRIMARY KEY (job_id, position)
+                )
+            ''')
+            # Per-job breakdown of where the time went, added to by every process working on the job
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_stages (
+                    job_id TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    seconds REAL NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (job_id, stage)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)')
+
+    def create(self, usernames, options=None):
+        """Register a new batch and return its id"""
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with connect(self.path) as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, stamp, options, total, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, QUEUED, datetime.now().strftime('%Y%m%d_%H%M%S'),
+                 json.dumps(options or {}), len(usernames), now)
+            )
+            conn.executemany(
+                'INSERT INTO job_items (job_id, position, username, status, updated_at) VALUES (?, ?, ?, ?, ?)',
+                [(job_id, i, username, PENDING, now) for i, username in enumerate(usernames)]
+            )
+        return job_id
+
+    def claim(self, job_id, owner=None):
+        """Mark a job as running for this process.
+
+        Fails if another live process is already running it, i.e. its heartbeat
+        is newer than JOB_STALE_AFTER seconds. The owner that holds a running
+        job under an explicit owner id may claim it again (e.g. a retried Celery
+        task, which keeps its id); the default per-process owner may not, so a
+        process never starts a second run of its own job.
+        """
+        reclaim = owner  # NULL never matches, so no re-claim without an explicit owner
+        owner = owner or f'{os.getpid()}'
+        now = time.time()
+        with connect(self.path) as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, owner = ?, heartbeat_at = ?, '
+                'started_at = COALESCE(started_at, ?) '
+                'WHERE id = ? AND (status IN (?, ?) OR (status = ? AND '
+                '(owner = ? OR heartbeat_at IS NULL OR heartbeat_at < ?)))',
+                (RUNNING, owner, now, now, job_id, QUEUED, PAUSED, RUNNING, reclaim, now - self.stale_after)
+            )
+            if cursor.rowcount != 1:
+                return False
+            created_at, started_at = conn.execute(
+                'SELECT created_at, started_at FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if started_at == now:
+            # First run of the job: how long it sat in the queue
+            waited = now - created_at
+            record_stage(QUEUE_WAIT, waited)
+            self.add_stage_times(job_id, {QUEUE_WAIT: (waited, 1)})
+        return True
+
+    def add_stage_times(self, job_id, totals):
+        """Add {stage: (seconds, count)} to a job's stage breakdown"""
+        with connect(self.path) as conn:
+            conn.executemany(
+                'INSERT INTO job_stages (job_id, stage, seconds, count) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (job_id, stage) DO UPDATE SET '
+                'seconds = seconds + excluded.seconds, count = count + excluded.count',
+                [(job_id, stage, seconds, count) for stage, (seconds, count) in totals.items()]
+            )
+
+    def stage_times(self, job_id):
+        """{stage: {'seconds', 'count', 'mean_ms'}} of a job so far; seconds add up across concurrent fetches"""
+        with connect(self.path) as conn:
+            rows = conn.execute(
+                'SELECT stage, seconds, count FROM job_stages WHERE job_id = ? ORDER BY seconds DESC', (job_id,)
+            ).fetchall()
+        return {
+            stage: {'seconds': round(seconds, 3), 'count': count, 'mean_ms': round(seconds / count * 1000, 1)}
+            for stage, seconds, count in rows
+        }
+
+    def record(self, job_id, position, result):
+        """Checkpoint one username's result"""
+        status = (result or {}).get('scraping_status') or ('error' if 'error' in (result or {}) else 'success')
+        if status in RETRYABLE_STATUSES:
+            status = PENDING
+        now = time.time()
+        with connect(self.path) as conn:
+            conn.execute(
+                'UPDATE job_items SET status = ?, result = ?, updated_at = ? WHERE job_id = ? AND position = ?',
+                (status, json.dumps(dump_result(result)) if status != PENDING else None, now, job_id, position)
+            )
+            conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE id = ?', (now, job_id))
+        job_events.notify(job_id)
+
+    def heartbeat(self, job_id):
+        with connect(self.path) as conn:
+            conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE id = ?', (time.time(), job_id))
+
+    def finish(self, job_id, status=None):
+        """Close a run: completed when nothing is pending, paused otherwise"""
+        with connect(self.path) as conn:
+            if status is None:
+                pending = conn.execute(
+                    'SELECT COUNT(*) FROM job_items WHERE job_id = ? AND status = ?', (job_id, PENDING)
+                ).fetchone()[0]
+                status = PAUSED if pending else COMPLETED
+            conn.execute(
+                'UPDATE jobs SET status = ?, finished_at = ?, owner = NULL WHERE id = ?',
+                (status, time.time() if status == COMPLETED else None, job_id)
+            )
+        job_events.close(job_id)
+        return status
+
+    def pending_items(self, job_id, start=0, stop=None):
+        """(position, username) pairs that still need scraping, optionally only positions [start, stop)"""
+        query = 'SELECT position, username FROM job_items WHERE job_id = ? AND status = ? AND position >= ?'
+        params = [job_id, PENDING, start]
+        if stop is not None:
+            query += ' AND position < ?'
+            params.append(stop)
+        with connect(self.path) as conn:
+            return conn.execute(query + ' ORDER BY position', params).fetchall()
+
+    def completed_items(self, job_id):
+        """Yield (position, username, result) for every checkpointed username"""
+        with connect(self.path) as conn:
+            cursor = conn.execute(
+                'SELECT position, username, result FROM job_items '
+                'WHERE job_id = ? AND status != ? ORDER BY position',
+                (job_id, PENDING)
+            )
+            for position, username, result in cursor:
+                yield position, username, load_result(json.loads(result))
+
+    def results_between(self, start=None, end=None):
+        """Yield every checkpointed result of the jobs started between start and end (inclusive 'YYYY-MM-DD')"""
+        query = ('SELECT i.result FROM job_items i JOIN jobs j ON j.id = i.job_id '
+                 'WHERE i.status != ? AND i.result IS NOT NULL')
+        params = [PENDING]
+        # stamp is YYYYmmdd_HHMMSS, so its first 8 characters compare like the date
+        if start:
+            query += ' AND substr(j.stamp, 1, 8) >= ?'
+            params.append(start.replace('-', ''))
+        if end:
+            query += ' AND substr(j.stamp, 1, 8) <= ?'
+            params.append(end.replace('-', ''))
+        with connect(self.path) as conn:
+            for (result,) in conn.execute(query, params):
+                yield load_result(json.loads(result))
+
+    def get(self, job_id):
+        """Job metadata plus per-status username counts and the stage breakdown, or None"""
+        with connect(self.path) as conn:
+            row = conn.execute(
+                'SELECT id, status, stamp, options, total, created_at, started_at, finished_at, heartbeat_at '
+                'FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            counts = dict(conn.execute(
+                'SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status', (job_id,)
+            ).fetchall())
+        return {
+            'id': row[0],
+            'status': row[1],
+            'stamp': row[2],
+            'options': json.loads(row[3]),
+            'total': row[4],
+            'created_at': row[5],
+            'started_at': row[6],
+            'finished_at': row[7],
+            'heartbeat_at': row[8],
+            'counts': counts,
+            'stages': self.stage_times(job_id)
+        }
+
+    def progress(self, job_id):
+        """Counts, current throughput (profiles/s) and ETA for a job, or None"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        now = time.time()
+        counts = job['counts']
+        pending = counts.get(PENDING, 0)
+        done = counts.get('success', 0)
+        rate_limited = counts.get('rate_limited', 0)
+        processed = job['total'] - pending
+
+        throughput = 0.0
+        if job['status'] == RUNNING and job['started_at']:
+            window = min(Config.JOB_THROUGHPUT_WINDOW, max(now - job['started_at'], 1.0))
+            with connect(self.path) as conn:
+                recent = conn.execute(
+                    'SELECT COUNT(*) FROM job_items WHERE job_id = ? AND status != ? AND updated_at >= ?',
+                    (job_id, PENDING, now - window)
+                ).fetchone()[0]
+            throughput = recent / window
+
+        return {
+            'id': job_id,
+            'status': job['status'],
+            'total': job['total'],
+            'processed': processed,
+            'done': done,
+            'failed': processed - done - rate_limited,
+            'rate_limited': rate_limited,
+            'pending': pending,
+            'throughput': round(throughput, 3),
+            'eta_seconds': round(pending / throughput) if throughput else None
+        }
+
+    def unfinished(self):
+        """Ids of jobs that were queued, paused or running, oldest first"""
+        with connect(self.path) as conn:
+            rows = conn.execute(
+                f'SELECT id FROM jobs WHERE status IN ({",".join("?" * len(UNFINISHED))}) ORDER BY created_at',
+                UNFINISHED
+            ).fetchall()
+        return [row[0] for row in rows]
+
+def progress_events(store, job_id):
+    """Server-Sent Events stream of a job's progress, ending once it stops running"""
+    version = job_events.wait(job_id, None, 0)
+    while True:
+        progress = store.progress(job_id)
+        if progress is None:
+            return
+        finished = progress['status'] not in (QUEUED, RUNNING)
+        event = 'done' if finished else 'progress'
+        yield f"event: {event}\ndata: {json.dumps(progress)}\n\n"
+        if finished:
+            return
+        version = job_events.wait(job_id, version, Config.JOB_EVENTS_TIMEOUT)
+        # Coalesce bursts of checkpoints into one update
+        time.sleep(Config.JOB_EVENTS_MIN_INTERVAL)
+
+def _scrape(store, job_id, engine, pending, on_result, profile=False):
+    """Run engine over pending (position, username) pairs, checkpointing every result"""
+    if pending:
+        logger.info(f"Job {job_id}: {len(pending)} username(s) pending")
+
+    def checkpoint(index, username, result):
+        position = pending[index][0]
+        store.record(job_id, position, result)
+        if on_result:
+            on_result(position, username, result)
+
+    with job_timing(store, job_id) as times, profile_job(job_id, profile):
+        # Keep the heartbeat fresh through long rate-limit pauses so no other process steals the job,
+        # and bring the stage breakdown up to date while it runs
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(Config.JOB_HEARTBEAT_INTERVAL):
+                store.heartbeat(job_id)
+                flush(store, job_id, times)
+        threading.Thread(target=beat, daemon=True).start()
+
+        try:
+            engine.run([username for _, username in pending], on_result=checkpoint)
+        finally:
+            stop.set()
+
+def run_job(store, job_id, engine, on_result=None, on_replay=None, profile=False):
+    """Scrape a job's pending usernames with engine, checkpointing after every profile.
+
+    on_replay(position, username, result) is first called for the usernames
+    finished by an earlier run, so exports can be rebuilt without refetching;
+    on_result receives the new results. With profile the run's stacks are
+    sampled into PROFILE_DIR. Returns the job's final status.
+    """
+    if on_replay:
+        for position, username, result in store.completed_items(job_id):
+            on_replay(position, username, result)
+
+    try:
+        _scrape(store, job_id, engine, store.pending_items(job_id), on_result, profile)
+    except Exception as e:
+        logger.error(f"Job {job_id} stopped: {str(e)}")
+        store.finish(job_id, PAUSED)
+        raise
+    return store.finish(job_id)
+
+def run_chunk(store, job_id, engine, start, stop, on_result=None, profile=False):
+    """Scrape the pending usernames at positions [start, stop) of a job.
+
+    For jobs split across workers: the job is left running and finished once
+    every chunk is done. Returns the number of usernames that were pending.
+    """
+    pending = store.pending_items(job_id, start, stop)
+    _scrape(store, job_id, engine, pending, on_result, profile)
+    return len(pending)
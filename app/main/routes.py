@@ -1,6 +1,6 @@
-from flask import render_template, request, jsonify, session, current_app
+from flask import Response, render_template, request, jsonify, session, current_app
 from app.main import bp
-from app.utils.security import login_required, csrf_protect, validate_username
+from app.utils.security import login_required, csrf_protect
 from app.utils.rate_limiter import rate_limit
 from app.utils.metrics import track_metrics, track_scrape
 from app import limiter
@@ -29,26 +29,31 @@ def scrape_usernames():
         if not usernames:
             return jsonify({'error': 'Empty username list'}), 400
         
-        # Validate usernames
-        valid_usernames = []
-        for username in usernames:
-            if validate_username(username):
-                valid_usernames.append(username)
-            else:
-                logger.warning(f"Invalid username format: {username}")
+        # Clean, validate and collapse near-duplicate usernames
+        from app.dedup import normalize_usernames
+        from app.scraper import InstagramScraper
+        valid_usernames, duplicates = normalize_usernames(usernames, InstagramScraper.clean_username)
         
         if not valid_usernames:
             return jsonify({'error': 'No valid usernames provided'}), 400
         
-        # Process usernames in background
+        # Record the batch durably, then process it in background
+        from app.jobs import JobStore
+        from app.profiler import wants_profile
         from app.tasks import process_scraping
-        process_scraping.delay(valid_usernames)
+        job_id = JobStore().create(valid_usernames, {
+            'refresh': bool(data.get('refresh', False)),
+            'profile': wants_profile(data.get('profile', False))
+        })
+        process_scraping.delay(job_id)
         
         track_scrape('started')
         return jsonify({
             'message': f'Started scraping {len(valid_usernames)} username(s)',
             'status': 'processing',
-            'usernames': valid_usernames
+            'job_id': job_id,
+            'usernames': valid_usernames,
+            'duplicates_removed': duplicates
         })
         
     except Exception as e:
@@ -56,14 +61,66 @@ def scrape_usernames():
         track_scrape('error')
         return jsonify({'error': 'Internal server error'}), 500
 
+@bp.route('/jobs/<job_id>')
+@login_required
+@track_metrics('job_status')
+def job_status(job_id):
+    try:
+        from app.jobs import JobStore
+        job = JobStore().get(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job)
+    except Exception as e:
+        logger.error(f"Error getting job status: {str(e)}")
+        return jsonify({'error': 'Error getting job status'}), 500
+
+@bp.route('/jobs/<job_id>/profile')
+@login_required
+def job_profile(job_id):
+    """Sampled stacks of a profiled job as folded text, for flamegraph.pl or speedscope"""
+    from app.jobs import JobStore
+    from app.profiler import read_profile
+    if not JobStore().get(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    folded = read_profile(job_id)
+    if folded is None:
+        return jsonify({'error': 'Job was not profiled'}), 404
+    return Response(folded, mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=profile_{job_id}.folded'})
+
+@bp.route('/jobs/<job_id>/events')
+@login_required
+def job_events_stream(job_id):
+    from app.jobs import JobStore, progress_events
+    store = JobStore()
+    if not store.get(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    return Response(
+        progress_events(store, job_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @bp.route('/files')
 @login_required
 @track_metrics('files')
 def list_files():
     try:
         from app.utils.file_manager import get_file_list
-        files = get_file_list()
-        return jsonify({'files': files})
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = request.args.get('per_page', current_app.config['FILES_PAGE_SIZE'], type=int)
+        per_page = min(max(per_page, 1), current_app.config['FILES_MAX_PAGE_SIZE'])
+        files, total = get_file_list(
+            page=page,
+            per_page=per_page,
+            job_id=request.args.get('job'),
+            file_type=request.args.get('type'),
+            kind=request.args.get('kind'),
+            sort=request.args.get('sort', 'modified'),
+            descending=request.args.get('order', 'desc') != 'asc'
+        )
+        return jsonify({'files': files, 'total': total, 'page': page, 'per_page': per_page})
     except Exception as e:
         logger.error(f"Error listing files: {str(e)}")
         return jsonify({'error': 'Error listing files'}), 500
@@ -0,0 +1,97 @@
+import json
+import time
+import sqlite3
+import logging
+from threading import Lock
+from config import Config
+from app.dedup import canonical_key
+from app.utils.db import connect, ensure_parent_dir
+from app.profile_record import dump_result, load_result
+
+logger = logging.getLogger(__name__)
+
+class ProfileCache:
+    """SQLite-backed cache of successful profile scrapes.
+
+    The database file is shared by every process using the same Config, so the
+    Flask app and the Celery workers reuse each other's results. Entries expire
+    after PROFILE_CACHE_TTL seconds and the least recently used ones are evicted
+    once the cache grows past PROFILE_CACHE_MAX_ENTRIES.
+    """
+    EVICT_EVERY = 100  # writes between size checks
+
+    def __init__(self, path=None, ttl=None, max_entries=None):
+        self.path = path or Config.PROFILE_CACHE_PATH
+        self.ttl = ttl if ttl is not None else Config.PROFILE_CACHE_TTL
+        self.max_entries = max_entries or Config.PROFILE_CACHE_MAX_ENTRIES
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+        ensure_parent_dir(self.path)
+        with connect(self.path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS profiles (
+                    key TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS profiles_accessed_at ON profiles (accessed_at)')
+
+    def get(self, username, max_age=None):
+        """Return the cached profile if it is younger than max_age (defaults to the TTL)"""
+        key = canonical_key(username)
+        max_age = self.ttl if max_age is None else max_age
+        now = time.time()
+        try:
+            with connect(self.path) as conn:
+                row = conn.execute(
+                    'SELECT data, stored_at FROM profiles WHERE key = ?', (key,)
+                ).fetchone()
+                if row is None or now - row[1] > max_age:
+                    self.misses += 1
+                    return None
+                conn.execute('UPDATE profiles SET accessed_at = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            return load_result(json.loads(row[0]))
+        except sqlite3.Error as e:
+            logger.error(f"Profile cache read failed for {username}: {str(e)}")
+            return None
+
+    def set(self, username, profile_data):
+        """Store a successful scrape; error results are never cached"""
+        if not profile_data or 'error' in profile_data:
+            return
+        now = time.time()
+        try:
+            with connect(self.path) as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO profiles (key, data, stored_at, accessed_at) VALUES (?, ?, ?, ?)',
+                    (canonical_key(username), json.dumps(dump_result(profile_data)), now, now)
+                )
+            with self.lock:
+                self.writes += 1
+                evict = self.writes % self.EVICT_EVERY == 0
+            if evict:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.error(f"Profile cache write failed for {username}: {str(e)}")
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones above the size limit"""
+        with connect(self.path) as conn:
+            conn.execute('DELETE FROM profiles WHERE stored_at < ?', (time.time() - self.ttl,))
+            count = conn.execute('SELECT COUNT(*) FROM profiles').fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    'DELETE FROM profiles WHERE key IN '
+                    '(SELECT key FROM profiles ORDER BY accessed_at LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'ttl': self.ttl}
@@ -0,0 +1,213 @@
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+
+try:
+    import msgspec
+except ImportError:  # optional: schema decoding that skips unused fields
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # optional: faster full parse when msgspec is missing
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+JSON_BACKEND = 'msgspec' if msgspec else 'orjson' if orjson else 'json'
+
+def loads(content):
+    """Parse JSON bytes or text with the fastest installed backend"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def to_int(value):
+    """Counts come back as ints, numeric strings or 'N/A'; anything unusable becomes None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        return int(str(value).replace(',', ''))
+    except (TypeError, ValueError):
+        return None
+
+def to_str(value):
+    return None if value in (None, '', 'N/A') else str(value)
+
+@dataclass(slots=True)
+class ProfileRecord:
+    """One successfully scraped profile, from the scraper through the cache, job store and writers.
+
+    Counts are ints and missing values are None rather than 'N/A'. Error
+    results stay plain dicts; get() and `in` read a record like a result dict
+    so status checks treat both alike.
+    """
+    username: str
+    profile_url: str = None
+    full_name: str = None
+    biography: str = None
+    followers: int = None
+    following: int = None
+    posts_count: int = None
+    is_verified: bool = False
+    is_private: bool = False
+    external_url: str = None
+    profile_pic_url: str = None
+    scraped_at: str = None
+    method: str = None
+    note: str = None
+    posts_error: str = None
+    from_cache: bool = False
+
+    scraping_status = 'success'
+    error = None
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return getattr(self, key, None) is not None
+
+    def to_dict(self):
+        """JSON-ready dict without the unset fields"""
+        data = {'scraping_status': self.scraping_status}
+        for name in FIELDS:
+            value = getattr(self, name)
+            if value is not None and value is not False:
+                data[name] = value
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Record from to_dict() output or from a result dict of an older version ('N/A', numeric strings)"""
+        return cls(
+            username=data.get('username'),
+            profile_url=to_str(data.get('profile_url')),
+            full_name=to_str(data.get('full_name')),
+            biography=to_str(data.get('biography')),
+            followers=to_int(data.get('followers')),
+            following=to_int(data.get('following')),
+            posts_count=to_int(data.get('posts_count')),
+            is_verified=bool(data.get('is_verified')),
+            is_private=bool(data.get('is_private')),
+            external_url=to_str(data.get('external_url')),
+            profile_pic_url=to_str(data.get('profile_pic_url')),
+            scraped_at=data.get('scraped_at'),
+            method=data.get('method'),
+            note=data.get('note') or None,
+            posts_error=data.get('posts_error') or None,
+            from_cache=bool(data.get('from_cache'))
+        )
+
+FIELDS = ProfileRecord.__dataclass_fields__.keys()
+
+def dump_result(result):
+    """JSON-ready form of a scrape result"""
+    return result.to_dict() if isinstance(result, ProfileRecord) else result
+
+def load_result(data):
+    """Scrape result read back from JSON: a ProfileRecord for a success, the error dict otherwise"""
+    if data is None or 'error' in data:
+        return data
+    return ProfileRecord.from_dict(data)
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+if msgspec is not None:
+    # Only the fields we export; msgspec skips everything else (timeline media, related
+    # profiles, ...) while scanning, without building objects for it
+    class _Count(msgspec.Struct):
+        count: int | None = None
+
+    class _User(msgspec.Struct):
+        username: str | None = None
+        full_name: str | None = None
+        biography: str | None = None
+        edge_followed_by: _Count | None = None
+        edge_follow: _Count | None = None
+        edge_owner_to_timeline_media: _Count | None = None
+        is_verified: bool = False
+        is_private: bool = False
+        external_url: str | None = None
+        profile_pic_url_hd: str | None = None
+
+    class _Data(msgspec.Struct):
+        user: _User | None | msgspec.UnsetType = msgspec.UNSET
+
+    class _Payload(msgspec.Struct):
+        data: _Data | None = None
+
+    _payload_decoder = msgspec.json.Decoder(_Payload)
+
+def _count(edge):
+    return edge.count if edge is not None else None
+
+def _decode_struct(content, username):
+    payload = _payload_decoder.decode(content)
+    if payload.data is None or payload.data.user is msgspec.UNSET:
+        raise ValueError('web_profile_info payload has no data')
+    user = payload.data.user
+    if user is None:
+        return None
+    return ProfileRecord(
+        username=username,
+        full_name=user.full_name,
+        biography=user.biography,
+        followers=_count(user.edge_followed_by),
+        following=_count(user.edge_follow),
+        posts_count=_count(user.edge_owner_to_timeline_media),
+        is_verified=user.is_verified,
+        is_private=user.is_private,
+        external_url=user.external_url,
+        profile_pic_url=user.profile_pic_url_hd,
+        scraped_at=_now()
+    )
+
+def _edge_count(user, key):
+    edge = user.get(key)
+    return to_int(edge.get('count')) if isinstance(edge, dict) else None
+
+def _decode_dict(content, username):
+    payload = loads(content)
+    data = payload.get('data') if isinstance(payload, dict) else None
+    if not isinstance(data, dict) or 'user' not in data:
+        raise ValueError('web_profile_info payload has no data')
+    user = data['user']
+    if user is None:
+        return None
+    if not isinstance(user, dict):
+        raise ValueError('web_profile_info user is not an object')
+    return ProfileRecord(
+        username=username,
+        full_name=user.get('full_name'),
+        biography=user.get('biography'),
+        followers=_edge_count(user, 'edge_followed_by'),
+        following=_edge_count(user, 'edge_follow'),
+        posts_count=_edge_count(user, 'edge_owner_to_timeline_media'),
+        is_verified=bool(user.get('is_verified')),
+        is_private=bool(user.get('is_private')),
+        external_url=user.get('external_url'),
+        profile_pic_url=user.get('profile_pic_url_hd'),
+        scraped_at=_now()
+    )
+
+def decode_web_profile_info(content, username):
+    """ProfileRecord from a web_profile_info response body.
+
+    Returns None when the payload says the user does not exist and raises
+    ValueError when it is not a profile payload at all.
+    """
+    if msgspec is not None:
+        try:
+            return _decode_struct(content, username)
+        except msgspec.ValidationError:
+            # Unexpected types (e.g. a count sent as a string): take the lenient path
+            pass
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e))
+    return _decode_dict(content, username)
@@ -0,0 +1,148 @@
+import os
+import re
+import sys
+import glob
+import time
+import random
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Fetch threads are named fetch_0, fetch_1, ...; their samples are merged under one root
+_THREAD_SUFFIX = re.compile(r'_\d+$')
+
+class StackSampler:
+    """Statistical profiler of a job's threads: every interval seconds a daemon
+    thread reads their current stacks with sys._current_frames().
+
+    Unlike cProfile it sees every thread of the job (the job thread running
+    the fetch loop and the fetch pool), costs nothing in the profiled code
+    itself and its overhead does not grow with the number of calls.
+    Samples are wall-clock, so time blocked on sockets or sleeps shows up
+    next to CPU work. They are kept in the folded-stack format
+    (root;...;leaf count) read by flamegraph.pl, speedscope and inferno.
+    """
+    def __init__(self, interval=None, max_depth=None):
+        self.interval = interval or Config.PROFILE_INTERVAL
+        self.max_depth = max_depth or Config.PROFILE_MAX_DEPTH
+        self.threads = {}  # Thread -> root frame name
+        self.stacks = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def attach(self, role=None):
+        """Profile the calling thread too; usable as a ThreadPoolExecutor initializer"""
+        thread = threading.current_thread()
+        with self.lock:
+            self.threads[thread] = role or _THREAD_SUFFIX.sub('', thread.name)
+
+    def start(self):
+        self.sampler = threading.Thread(target=self._run, name='job-profiler', daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                # A dead thread's ident may be handed to another job's thread
+                for thread in [t for t in self.threads if not t.is_alive()]:
+                    del self.threads[thread]
+                threads = list(self.threads.items())
+            for thread, root in threads:
+                frame = frames.get(thread.ident)
+                if frame is not None:
+                    self.stacks[self._fold(root, frame)] += 1
+            self.samples += 1
+
+    def _fold(self, root, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        names.append(root)
+        return ';'.join(reversed(names))
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+# The sampler of the job running in this context, so FetchEngine can attach its fetch threads
+_current = contextvars.ContextVar('job_profiler', default=None)
+
+def current_profiler():
+    return _current.get()
+
+def wants_profile(requested=False):
+    """Whether a new job should be profiled: asked for explicitly, or picked at PROFILE_SAMPLE_RATE"""
+    return bool(requested) or (Config.PROFILE_SAMPLE_RATE > 0 and random.random() < Config.PROFILE_SAMPLE_RATE)
+
+def profile_path(job_id, directory=None):
+    """A new file for one profiled run of a job; resumed runs and Celery chunks each get their own"""
+    directory = directory or Config.PROFILE_DIR
+    return os.path.join(directory, f'{job_id}-{os.getpid()}-{threading.get_ident()}-{int(time.time() * 1000)}.folded')
+
+def profile_files(job_id, directory=None):
+    return sorted(glob.glob(os.path.join(directory or Config.PROFILE_DIR, f'{glob.escape(job_id)}-*.folded')))
+
+def read_profile(job_id, directory=None):
+    """Every profiled run of a job as one folded-stack text (flamegraph tools sum repeated stacks), or None"""
+    files = profile_files(job_id, directory)
+    if not files:
+        return None
+    parts = []
+    for path in files:
+        with open(path, encoding='utf-8') as f:
+            parts.append(f.read())
+    return ''.join(parts)
+
+def prune_profiles(cutoff, directory=None):
+    """Remove profiles written before the cutoff timestamp; returns how many"""
+    removed = 0
+    for path in glob.glob(os.path.join(directory or Config.PROFILE_DIR, '*.folded')):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+@contextmanager
+def _profiling(job_id, directory):
+    sampler = StackSampler()
+    sampler.attach('job')
+    token = _current.set(sampler)
+    started = time.perf_counter()
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
+        _current.reset(token)
+        try:
+            directory = directory or Config.PROFILE_DIR
+            os.makedirs(directory, exist_ok=True)
+            with open(profile_path(job_id, directory), 'w', encoding='utf-8') as f:
+                f.write(sampler.folded())
+            logger.info(f"Profiled job {job_id}: {sampler.samples} samples over "
+                        f"{time.perf_counter() - started:.1f}s")
+        except OSError as e:
+            logger.error(f"Could not save the profile of job {job_id}: {str(e)}")
+
+def profile_job(job_id, enabled, directory=None):
+    """Sample the stacks of the enclosed job run when enabled; a no-op context otherwise"""
+    if not enabled:
+        return nullcontext()
+    return _profiling(job_id, directory)
@@ -0,0 +1,160 @@
+import os
+import shutil
+import logging
+import tempfile
+from threading import Lock
+from config import Config
+from app.exporter import view_names
+from app.jobs import COMPLETED, QUEUED, RUNNING
+from app.result_store import QUERY_ERRORS, partition_date, query_results
+from app.segments import SEGMENT_COLUMNS, configured_segments, count_records, count_segments, pc
+from app.utils.file_index import CACHED, DECLARED
+
+logger = logging.getLogger(__name__)
+
+class RenderCache:
+    """TXT/XLSX result files rendered from the job store on first download.
+
+    Each job's results are kept once, in the job store; while a job runs its
+    files are only declared in the file index, so listing them costs nothing.
+    A download of a completed job's file renders it in the export pool and
+    keeps it in the data dir, evicting the least recently downloaded renders
+    once they take more than max_bytes. Files of a job that is still running
+    are rendered to a scratch directory for that one download.
+    """
+    def __init__(self, job_store, file_index, stage, max_bytes=None, segments=None):
+        self.job_store = job_store
+        self.file_index = file_index
+        self.stage = stage
+        self.segments = configured_segments if segments is None else segments
+        self.max_bytes = Config.RENDER_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        # Guards the index lookup and insert of a finished render, never the render itself
+        self.lock = Lock()
+
+    def declaring(self, job_id, stamp, on_result):
+        """Wrap a result callback so the job's files are listed as soon as they would have content"""
+        self.file_index.declare(view_names('all_profiles', stamp), job_id)
+        declared = set()
+
+        def add(index, username, result):
+            on_result(index, username, result)
+            for segment in self.segments:
+                if segment.name not in declared and segment.matches(result):
+                    declared.add(segment.name)
+                    self.file_index.declare(view_names(segment.name, stamp), job_id)
+        return add
+
+    def segment_counts(self, job):
+        """{segment name: profiles} of a job, from its Parquet copy when there is one"""
+        if pc is not None:
+            # Only the job's own partition is opened
+            date = partition_date(job['stamp'])
+            try:
+                table = query_results(date, date, columns=SEGMENT_COLUMNS, filter=pc.field('job_id') == job['id'])
+            except QUERY_ERRORS as e:
+                logger.warning(f"Counting segments of job {job['id']} from the job store: {str(e)}")
+            else:
+                if table.num_rows:
+                    return count_segments(table, self.segments)
+        return count_records((result for _, _, result in self.job_store.completed_items(job['id'])), self.segments)
+
+    def resegment(self, job_id):
+        """List a stored job's files for the current segment rules, without scraping again.
+
+        Files of segments the job has profiles in are (re)declared and any
+        copy rendered under older rules is dropped, so the next download
+        renders it afresh; files of segments left empty are removed.
+        Returns the segment counts, or None for an unknown job; raises
+        ValueError while the job is still being scraped.
+        """
+        job = self.job_store.get(job_id)
+        if job is None:
+            return None
+        if job['status'] in (QUEUED, RUNNING):
+            raise ValueError(f"Job {job_id} is still {job['status']}")
+        counts = self.segment_counts(job)
+        with self.lock:
+            for segment in self.segments:
+                names = view_names(segment.name, job['stamp'])
+                for name in names:
+                    try:
+                        os.remove(os.path.join(self.file_index.data_dir, name))
+                    except FileNotFoundError:
+                        pass
+                    self.file_index.remove(name)
+                if counts[segment.name]:
+                    self.file_index.declare(names, job_id)
+        return counts
+
+    def open(self, filename):
+        """(path, scratch_dir) of a file ready to send, or None if there is no such file.
+
+        scratch_dir is set for a one-off render and should be removed once the
+        response has been sent.
+        """
+        path = os.path.abspath(os.path.join(self.file_index.data_dir, filename))
+        entry = self.file_index.get(filename)
+        if entry is None:
+            # Not indexed (e.g. copied in by hand): served if it is there
+            return (path, None) if os.path.isfile(path) else None
+        if entry['state'] != DECLARED and os.path.isfile(path):
+            self.file_index.touch(filename)
+            return path, None
+
+        job = self.job_store.get(entry['job_id']) if entry['job_id'] else None
+        if job is None:
+            return None
+
+        if job['status'] != COMPLETED:
+            scratch = tempfile.mkdtemp(prefix='render_')
+            try:
+                self._render(filename, job, scratch)
+            except Exception:
+                shutil.rmtree(scratch, ignore_errors=True)
+                raise
+            scratch_path = os.path.join(scratch, filename)
+            if not os.path.isfile(scratch_path):
+                shutil.rmtree(scratch, ignore_errors=True)
+                return None
+            return scratch_path, scratch
+
+        # Rendered next to the cache outside the lock, so other downloads go on meanwhile,
+        # then moved into place; a concurrent render of the same file that won keeps its copy
+        scratch = tempfile.mkdtemp(prefix='.render_', dir=self.file_index.data_dir)
+        try:
+            self._render(filename, job, scratch)
+            scratch_path = os.path.join(scratch, filename)
+            if not os.path.isfile(scratch_path):
+                return None
+            with self.lock:
+                entry = self.file_index.get(filename)
+                if entry is None or entry['state'] == DECLARED or not os.path.isfile(path):
+                    os.replace(scratch_path, path)
+                    self.file_index.register(path, job_id=job['id'], state=CACHED)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        self.file_index.touch(filename)
+        self.evict(keep=filename)
+        return path, None
+
+    def _render(self, filename, job, data_dir):
+        count = self.stage.render(filename, job['id'], job['stamp'], job['total'], data_dir, self.job_store.path)
+        logger.info(f"Rendered {filename} from {count} result(s) of job {job['id']}")
+
+    def evict(self, keep=None):
+        """Remove least recently downloaded renders until they fit in max_bytes"""
+        excess = self.file_index.cached_size() - self.max_bytes
+        for name, size in self.file_index.least_recently_used():
+            if excess <= 0:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.file_index.data_dir, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error evicting {name}: {str(e)}")
+                continue
+            self.file_index.evicted(name)
+            excess -= size
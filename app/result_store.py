@@ -0,0 +1,177 @@
+import os
+import logging
+from datetime import datetime
+from config import Config
+from app.profile_record import ProfileRecord
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional: the Parquet sink is skipped without pyarrow
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+PARTITION = 'scrape_date'
+
+# What query_results raises when the store cannot be read: pyarrow missing, or files it cannot parse
+QUERY_ERRORS = (RuntimeError, OSError) + ((pa.ArrowException,) if pa is not None else ())
+
+def _schema():
+    return pa.schema([
+        ('job_id', pa.string()),
+        ('username', pa.string()),
+        ('status', pa.string()),
+        ('full_name', pa.string()),
+        ('biography', pa.string()),
+        ('followers', pa.int64()),
+        ('following', pa.int64()),
+        ('posts_count', pa.int64()),
+        ('is_verified', pa.bool_()),
+        ('is_private', pa.bool_()),
+        ('external_url', pa.string()),
+        ('profile_pic_url', pa.string()),
+        ('scraped_at', pa.timestamp('s')),
+        ('error', pa.string())
+    ])
+
+def _to_time(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+def partition_date(stamp):
+    """The scrape_date partition (YYYY-MM-DD) of a job stamp (YYYYmmdd_HHMMSS)"""
+    return datetime.strptime(stamp, '%Y%m%d_%H%M%S').strftime('%Y-%m-%d')
+
+class ParquetResultWriter:
+    """Columnar copy of a job's results under RESULTS_DIR/scrape_date=YYYY-MM-DD/<job_id>.parquet.
+
+    Rows are buffered and written as row groups of RESULTS_ROW_GROUP_SIZE, so a
+    batch of any size is written with bounded memory. Re-running a resumed job
+    rewrites its file from the replayed results. Until close() the rows go to
+    a hidden file beside it, which queries skip, so an unfinished or crashed
+    writer never leaves a footerless file in a partition.
+    """
+    def __init__(self, job_id, stamp, root=None, row_group_size=None):
+        self.job_id = job_id
+        self.root = root or Config.RESULTS_DIR
+        self.row_group_size = row_group_size or Config.RESULTS_ROW_GROUP_SIZE
+        self.scrape_date = partition_date(stamp)
+        self.path = os.path.join(self.root, f'{PARTITION}={self.scrape_date}', f'{job_id}.parquet')
+        self.partial_path = os.path.join(os.path.dirname(self.path), f'.{job_id}.parquet.partial')
+        self.schema = _schema()
+        self.columns = {name: [] for name in self.schema.names}
+        self.buffered = 0
+        self.rows = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.writer = pq.ParquetWriter(self.partial_path, self.schema, compression='zstd')
+
+    def add(self, index, username, profile_data):
+        """Buffer one result; usable as a FetchEngine on_result callback"""
+        if isinstance(profile_data, ProfileRecord):
+            record = profile_data
+            values = {
+                'job_id': self.job_id,
+                'username': record.username,
+                'status': record.scraping_status,
+                'full_name': record.full_name,
+                'biography': record.biography,
+                'followers': record.followers,
+                'following': record.following,
+                'posts_count': record.posts_count,
+                'is_verified': record.is_verified,
+                'is_private': record.is_private,
+                'external_url': record.external_url,
+                'profile_pic_url': record.profile_pic_url,
+                'scraped_at': _to_time(record.scraped_at),
+                'error': None
+            }
+        else:
+            profile_data = profile_data or {}
+            values = dict.fromkeys(self.schema.names)
+            values.update({
+                'job_id': self.job_id,
+                'username': profile_data.get('username', username),
+                'status': profile_data.get('scraping_status') or 'error',
+                'error': profile_data.get('error')
+            })
+        for name, column in self.columns.items():
+            column.append(values[name])
+        self.buffered += 1
+        if self.buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        self.writer.write_table(pa.table(self.columns, schema=self.schema))
+        self.rows += self.buffered
+        self.buffered = 0
+        for column in self.columns.values():
+            column.clear()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.writer.close()
+        os.replace(self.partial_path, self.path)
+        logger.info(f"Wrote {self.rows} result(s) to {self.path}")
+
+def open_result_writer(job_id, stamp):
+    """A ParquetResultWriter for the job, or None when the sink is disabled or pyarrow is missing"""
+    if not Config.ENABLE_PARQUET_EXPORT:
+        return None
+    if pa is None:
+        logger.warning("pyarrow is not installed; skipping Parquet export")
+        return None
+    try:
+        return ParquetResultWriter(job_id, stamp)
+    except Exception as e:
+        logger.error(f"Error opening Parquet export for job {job_id}: {str(e)}")
+        return None
+
+def query_results(start=None, end=None, columns=None, filter=None, root=None):
+    """Read results scraped between start and end (inclusive 'YYYY-MM-DD' dates) as a pyarrow Table.
+
+    Partitions outside the date range are never opened and only the requested
+    columns are read. filter is an optional pyarrow.compute expression, e.g.
+    pc.field('followers') > 10000 or pc.field('status') == 'success'.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is required to query results")
+    root = root or Config.RESULTS_DIR
+    if not os.path.isdir(root):
+        return _schema().empty_table()
+    partitioning = ds.partitioning(pa.schema([(PARTITION, pa.string())]), flavor='hive')
+    # Files being written are hidden (see ParquetResultWriter); anything else unreadable is skipped too
+    dataset = ds.dataset(root, format='parquet', partitioning=partitioning,
+                         ignore_prefixes=['.', '_'], exclude_invalid_files=True)
+    expression = filter
+    for bound, op in ((start, pc.greater_equal), (end, pc.less_equal)):
+        if bound:
+            condition = op(pc.field(PARTITION), bound)
+            expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns, filter=expression)
+
+def summarize_results(start=None, end=None, by=(PARTITION,), filter=None, root=None):
+    """Per-group profile counts and follower/following/post statistics across partitions"""
+    by = list(by)
+    table = query_results(
+        start, end,
+        columns=by + ['username', 'followers', 'following', 'posts_count'],
+        filter=filter, root=root
+    )
+    return table.group_by(by).aggregate([
+        ('username', 'count'),
+        ('username', 'count_distinct'),
+        ('followers', 'mean'),
+        ('followers', 'max'),
+        ('following', 'mean'),
+        ('posts_count', 'mean'),
+        ('posts_count', 'sum')
+    ])
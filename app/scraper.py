@@ -1,22 +1,73 @@
-import requests
 from instascrape import Profile, Post
+from bs4 import BeautifulSoup
 from datetime import datetime
 import time
 import logging
 from flask import current_app
-from .utils.metrics import track_scrape
-from .utils.security import validate_username, validate_instagram_url
+from config import Config
+from utils.metrics import track_scrape
+from utils.security import validate_username, validate_instagram_url
+from utils.rate_limiter import parse_retry_after
+from app.transport import create_session, cookie_domain
+from app.fetch_strategy import strategy_router
+from app.profile_record import ProfileRecord, decode_web_profile_info, to_int, to_str
+from app.tracing import NETWORK, PARSE, RATE_LIMIT_WAIT, RETRY_BACKOFF, stage
 
 logger = logging.getLogger(__name__)
 
+def throttle_result(response, username):
+    """Error result for a 429, 401/403 or login redirect response, otherwise None.
+
+    401/403 mean the session itself is no longer valid: auth_failed takes it
+    out of rotation instead of retrying the profile on it. A login redirect
+    is often a soft throttle, so it only backs the session off; SessionPool
+    drops it after MAX_LOGIN_REDIRECTS of them in a row.
+    """
+    if response.status_code in (401, 403):
+        return {
+            'error': f'Instagram rejected the session while scraping {username} ({response.status_code}).',
+            'username': username,
+            'scraping_status': 'auth_failed'
+        }
+    if response.status_code == 429:
+        return {
+            'error': f'Instagram rate limit reached for {username}. Please try again later.',
+            'username': username,
+            'scraping_status': 'rate_limited',
+            'retry_after': parse_retry_after(response.headers.get('Retry-After'))
+        }
+    if 'accounts/login' in response.url or 'accounts/login' in response.headers.get('Location', ''):
+        return {
+            'error': f'Instagram redirected to login while scraping {username}.',
+            'username': username,
+            'scraping_status': 'login_redirect'
+        }
+    return None
+
+def not_found_result(username):
+    """Definitive answer for a profile that does not exist; not worth retrying"""
+    return {
+        'error': f'Instagram profile {username} not found.',
+        'username': username,
+        'scraping_status': 'not_found'
+    }
+
 class InstagramScraper:
-    def __init__(self):
-        self.session = requests.Session()
+    def __init__(self, base_url=None, min_request_interval=2, strategies=None):
+        self.base_url = (base_url or Config.INSTAGRAM_BASE_URL).rstrip('/')
+        # Keep-alive pool sized for the fetch concurrency, with connect/read timeouts
+        self.session = create_session()
+        self.cookie_domain = cookie_domain(self.base_url)
         self.authenticated = False
         self.session_id = None
         self.csrf_token = None
+        # Only read by instascrape to pick its field mapping; the request itself uses the cookie jar
+        self.parse_headers = None
         self.last_request_time = 0
-        self.min_request_interval = 2  # Minimum seconds between requests
+        # Minimum seconds between requests; 0 when a FetchEngine paces this session
+        self.min_request_interval = min_request_interval
+        # JSON API / profile HTML routing, shared by default so sessions learn from each other
+        self.strategies = strategies or strategy_router
         
         # Set default headers
         self.session.headers.update({
@@ -41,7 +92,8 @@ class InstagramScraper:
         
         if time_since_last_request < self.min_request_interval:
             sleep_time = self.min_request_interval - time_since_last_request
-            time.sleep(sleep_time)
+            with stage(RATE_LIMIT_WAIT):
+                time.sleep(sleep_time)
         
         self.last_request_time = time.time()
     
@@ -60,17 +112,17 @@ class InstagramScraper:
             self.session.cookies.clear()
             
             # Set the sessionid cookie
-            self.session.cookies.set('sessionid', sessionid, domain='.instagram.com', path='/')
+            self.session.cookies.set('sessionid', sessionid, domain=self.cookie_domain, path='/')
             
             # Set CSRF token if provided
             if csrf_token:
-                self.session.cookies.set('csrftoken', csrf_token, domain='.instagram.com', path='/')
+                self.session.cookies.set('csrftoken', csrf_token, domain=self.cookie_domain, path='/')
                 self.session.headers.update({'X-CSRFToken': csrf_token})
             
             # Add essential Instagram cookies
-            self.session.cookies.set('mid', 'aDSa3AALAAGieULhLm97NP5dqp_Z', domain='.instagram.com', path='/')
-            self.session.cookies.set('ig_did', '3B433670-1F70-4284-AAE8-6C2843AD70FA', domain='.instagram.com', path='/')
-            self.session.cookies.set('ig_nrcb', '1', domain='.instagram.com', path='/')
+            self.session.cookies.set('mid', 'aDSa3AALAAGieULhLm97NP5dqp_Z', domain=self.cookie_domain, path='/')
+            self.session.cookies.set('ig_did', '3B433670-1F70-4284-AAE8-6C2843AD70FA', domain=self.cookie_domain, path='/')
+            self.session.cookies.set('ig_nrcb', '1', domain=self.cookie_domain, path='/')
             
             # Extract user ID from sessionid
             try:
@@ -80,10 +132,11 @@ class InstagramScraper:
                     user_id = decoded_sessionid.split(':')[0]
                 else:
                     user_id = sessionid.split(':')[0]
-                self.session.cookies.set('ds_user_id', user_id, domain='.instagram.com', path='/')
+                self.session.cookies.set('ds_user_id', user_id, domain=self.cookie_domain, path='/')
             except:
                 logger.warning("Could not extract user ID from sessionid")
             
+            self.parse_headers = {'cookie': f'sessionid={sessionid}'}
             self.authenticated = True
             logger.info("Session setup complete")
             return True
@@ -101,7 +154,7 @@ class InstagramScraper:
             self._respect_rate_limit()
             
             # Test authentication
-            test_url = 'https://www.instagram.com/'
+            test_url = f'{self.base_url}/'
             response = self.session.get(test_url, allow_redirects=False)
             
             if response.status_code == 302:
@@ -112,7 +165,7 @@ class InstagramScraper:
                     return False
             
             if response.status_code in [200, 302]:
-                api_url = 'https://www.instagram.com/api/v1/users/web_profile_info/?username=instagram'
+                api_url = f'{self.base_url}/api/v1/users/web_profile_info/?username=instagram'
                 api_response = self.session.get(api_url)
                 
                 if api_response.status_code == 200:
@@ -136,7 +189,8 @@ class InstagramScraper:
             self.authenticated = False
             return False
     
-    def clean_username(self, username):
+    @staticmethod
+    def clean_username(username):
         """Clean and validate username"""
         try:
             # Remove @ symbol if present
@@ -178,62 +232,17 @@ class InstagramScraper:
             except ValueError as e:
                 return {'error': str(e)}
             
-            # Create profile URL
-            profile_url = f'https://www.instagram.com/{clean_user}/'
-            
             # Try to scrape with retry logic
             max_retries = current_app.config['MAX_RETRIES']
             retry_delay = current_app.config['RETRY_DELAY']
             
             for attempt in range(max_retries):
                 try:
-                    self._respect_rate_limit()
-                    
-                    # Create profile with proper session
-                    profile = Profile(profile_url)
-                    profile._session = self.session
-                    
-                    # Create headers with cookies
-                    scrape_headers = self.session.headers.copy()
-                    cookie_string = '; '.join([f'{cookie.name}={cookie.value}' for cookie in self.session.cookies])
-                    scrape_headers['Cookie'] = cookie_string
-                    
-                    # Scrape the profile
-                    profile.scrape(headers=scrape_headers, session=self.session)
-                    
-                    # Extract profile data
-                    profile_data = {
-                        'username': clean_user,
-                        'profile_url': profile_url,
-                        'full_name': getattr(profile, 'full_name', 'N/A'),
-                        'biography': getattr(profile, 'biography', 'N/A'),
-                        'followers': getattr(profile, 'followers', 'N/A'),
-                        'following': getattr(profile, 'following', 'N/A'),
-                        'posts_count': getattr(profile, 'posts', 'N/A'),
-                        'is_verified': getattr(profile, 'is_verified', False),
-                        'is_private': getattr(profile, 'is_private', False),
-                        'external_url': getattr(profile, 'external_url', 'N/A'),
-                        'profile_pic_url': getattr(profile, 'profile_pic_url', 'N/A'),
-                        'scraped_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'scraping_status': 'success',
-                        'authenticated': True,
-                        'method': 'insta-scrape'
-                    }
-                    
-                    # Get recent posts if profile is public
-                    if not profile_data.get('is_private', True):
-                        try:
-                            posts_data = self.get_basic_posts_info(profile)
-                            profile_data['recent_posts'] = posts_data
-                        except Exception as posts_error:
-                            logger.error(f"Error getting posts: {str(posts_error)}")
-                            profile_data['recent_posts'] = []
-                            profile_data['posts_error'] = str(posts_error)
-                    else:
-                        profile_data['recent_posts'] = []
-                        profile_data['note'] = 'Profile is private'
-                    
-                    return profile_data
+                    # Cheapest working strategy first (JSON API or profile HTML), the other as backup
+                    result = self.strategies.fetch(self, clean_user)
+                    if result:
+                        return result
+                    logger.error(f"Attempt {attempt + 1} failed for {clean_user}: no strategy returned profile data")
                     
                 except Exception as e:
                     error_msg = str(e)
@@ -247,31 +256,30 @@ class InstagramScraper:
                             'scraping_status': 'auth_failed'
                         }
                     
+                    # Rate limits and login redirects are reported straight back so the
+                    # session's adaptive pacing can back off and the engine can retry
                     if 'rate limit' in error_msg.lower() or '429' in error_msg:
-                        if attempt < max_retries - 1:
-                            logger.warning(f"Rate limited, waiting {retry_delay} seconds")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2
-                            continue
-                        else:
-                            return {
-                                'error': 'Rate limit reached',
-                                'username': clean_user,
-                                'scraping_status': 'rate_limited'
-                            }
+                        return {
+                            'error': 'Rate limit reached',
+                            'username': clean_user,
+                            'scraping_status': 'rate_limited'
+                        }
                     
-                    if attempt == max_retries - 1:
-                        logger.warning(f"Trying fallback method for {clean_user}")
-                        fallback_result = self.scrape_profile_fallback(clean_user)
-                        if fallback_result and 'error' not in fallback_result:
-                            return fallback_result
-                        
+                    if 'login' in error_msg.lower():
                         return {
-                            'error': f'Failed to scrape after {max_retries} attempts',
+                            'error': 'Redirected to login',
                             'username': clean_user,
-                            'scraping_status': 'failed'
+                            'scraping_status': 'login_redirect'
                         }
                     
+                if attempt == max_retries - 1:
+                    return {
+                        'error': f'Failed to scrape after {max_retries} attempts',
+                        'username': clean_user,
+                        'scraping_status': 'failed'
+                    }
+                
+                with stage(RETRY_BACKOFF, username=clean_user):
                     time.sleep(retry_delay)
             
         except Exception as e:
@@ -282,58 +290,75 @@ class InstagramScraper:
                 'scraping_status': 'error'
             }
     
-    def scrape_profile_fallback(self, username):
-        """Fallback method using Instagram's web API"""
-        try:
-            self._respect_rate_limit()
-            
-            api_url = f'https://www.instagram.com/api/v1/users/web_profile_info/?username={username}'
-            response = self.session.get(api_url)
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if 'data' in data and 'user' in data['data']:
-                    user_data = data['data']['user']
-                    
-                    return {
-                        'username': username,
-                        'profile_url': f'https://www.instagram.com/{username}/',
-                        'full_name': user_data.get('full_name', 'N/A'),
-                        'biography': user_data.get('biography', 'N/A'),
-                        'followers': user_data.get('edge_followed_by', {}).get('count', 'N/A'),
-                        'following': user_data.get('edge_follow', {}).get('count', 'N/A'),
-                        'posts_count': user_data.get('edge_owner_to_timeline_media', {}).get('count', 'N/A'),
-                        'is_verified': user_data.get('is_verified', False),
-                        'is_private': user_data.get('is_private', False),
-                        'external_url': user_data.get('external_url', 'N/A'),
-                        'profile_pic_url': user_data.get('profile_pic_url_hd', 'N/A'),
-                        'scraped_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'scraping_status': 'success',
-                        'authenticated': True,
-                        'method': 'api_fallback'
-                    }
-            
-            logger.warning(f"Fallback API request failed for {username}")
-            return None
-                
-        except Exception as e:
-            logger.error(f"Fallback scraping failed for {username}: {str(e)}")
-            return None
+    def scrape_profile_html(self, username):
+        """Profile page parsed by instascrape"""
+        self._respect_rate_limit()
+        
+        profile_url = f'{self.base_url}/{username}/'
+        # Fetch the page through our own session so base_url and throttle detection
+        # apply (instascrape rewrites non-https URLs to instagram.com); it only parses
+        with stage(NETWORK, strategy='html', username=username):
+            response = self.session.get(profile_url)
+        throttled = throttle_result(response, username)
+        if throttled:
+            if throttled['scraping_status'] == 'auth_failed':
+                self.authenticated = False
+            return throttled
+        if response.status_code == 404:
+            return not_found_result(username)
+        
+        with stage(PARSE, strategy='html', username=username):
+            profile = Profile(BeautifulSoup(response.text, 'html.parser'))
+            profile.scrape(headers=self.parse_headers)
+        
+        record = ProfileRecord(
+            username=username,
+            profile_url=profile_url,
+            full_name=to_str(getattr(profile, 'full_name', None)),
+            biography=to_str(getattr(profile, 'biography', None)),
+            followers=to_int(getattr(profile, 'followers', None)),
+            following=to_int(getattr(profile, 'following', None)),
+            posts_count=to_int(getattr(profile, 'posts', None)),
+            is_verified=bool(getattr(profile, 'is_verified', False)),
+            is_private=bool(getattr(profile, 'is_private', False)),
+            external_url=to_str(getattr(profile, 'external_url', None)),
+            profile_pic_url=to_str(getattr(profile, 'profile_pic_url', None)),
+            scraped_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            method='insta-scrape'
+        )
+        if record.is_private:
+            record.note = 'Profile is private'
+        return record
     
-    def get_basic_posts_info(self, profile):
-        """Get basic post information"""
-        posts_data = []
-        try:
-            self._respect_rate_limit()
-            
-            # This is a simplified approach since Instagram heavily restricts post data access
-            posts_data.append({
-                'note': 'Post details require Instagram authentication',
-                'suggestion': 'Use Instagram Business API for detailed post analytics'
-            })
-            
-        except Exception as e:
-            logger.error(f"Error getting posts info: {str(e)}")
+    def scrape_profile_api(self, username):
+        """Profile from Instagram's web_profile_info JSON API"""
+        self._respect_rate_limit()
+        
+        api_url = f'{self.base_url}/api/v1/users/web_profile_info/?username={username}'
+        with stage(NETWORK, strategy='json', username=username):
+            response = self.session.get(api_url)
+        
+        throttled = throttle_result(response, username)
+        if throttled:
+            if throttled['scraping_status'] == 'auth_failed':
+                self.authenticated = False
+            return throttled
+        if response.status_code == 404:
+            return not_found_result(username)
+        
+        if response.status_code == 200:
+            # Decodes only the exported fields, skipping the timeline media in the payload
+            try:
+                with stage(PARSE, strategy='json', username=username):
+                    record = decode_web_profile_info(response.content, username)
+            except ValueError as e:
+                logger.warning(f"Unexpected web_profile_info payload for {username}: {str(e)}")
+                return None
+            if record is None:
+                return not_found_result(username)
+            record.profile_url = f'{self.base_url}/{username}/'
+            record.method = 'web_profile_info'
+            return record
         
-        return posts_data 
\ No newline at end of file
+        logger.warning(f"web_profile_info request failed for {username} ({response.status_code})")
+        return None
@@ -0,0 +1,188 @@
+import re
+import json
+import logging
+from config import Config
+
+try:
+    import pyarrow.compute as pc
+except ImportError:  # optional: vectorized segmentation of the Parquet store needs pyarrow
+    pc = None
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_FIELDS = ('followers', 'following', 'posts_count')
+FLAG_FIELDS = ('is_verified', 'is_private')
+TEXT_FIELDS = ('username', 'full_name', 'biography', 'external_url')
+
+# Columns a vectorized pass reads from the result store
+SEGMENT_COLUMNS = ['status'] + list(NUMERIC_FIELDS + FLAG_FIELDS + TEXT_FIELDS)
+
+# The post-count groups every batch has always had
+DEFAULT_SEGMENTS = [
+    {
+        'name': 'profiles_under_5_posts',
+        'title': 'Instagram Profiles with 1-5 Posts',
+        'label': 'Profiles with 1-5 Posts',
+        'where': {'posts_count': {'min': 1, 'max': 5}}
+    },
+    {
+        'name': 'profiles_over_5_posts',
+        'title': 'Instagram Profiles with More than 5 Posts',
+        'label': 'Profiles with More than 5 Posts',
+        'where': {'posts_count': {'min': 6}}
+    }
+]
+
+# Segment names become file names: <name>_<stamp>.<ext>
+NAME_PATTERN = re.compile(r'^[a-z][a-z0-9_]*$')
+
+def _bound(field, spec, name):
+    """spec[name] as an int/float (or None when absent); anything else is a bad rule"""
+    value = spec.get(name)
+    if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        raise ValueError(f"{field}: {name} must be a number, got {value!r}")
+    return value
+
+class Condition:
+    """One field test of a segment rule.
+
+    Numeric fields take {'min': x, 'max': y} (either bound optional, both
+    inclusive) or an exact number; flags take true/false; text fields take
+    {'contains_any': [...]} (case-insensitive). None on any field matches
+    profiles where the value is missing, e.g. an unreadable post count.
+    """
+    def __init__(self, field, spec):
+        self.field = field
+        self.spec = spec
+        self.low = self.high = None
+        self.keywords = None
+        if spec is None:
+            self.op = 'missing'
+        elif field in NUMERIC_FIELDS:
+            if isinstance(spec, dict):
+                unknown = set(spec) - {'min', 'max'}
+                if unknown or not spec:
+                    raise ValueError(f"{field}: expected min and/or max, got {sorted(spec)}")
+                self.low, self.high = _bound(field, spec, 'min'), _bound(field, spec, 'max')
+                if self.low is not None and self.high is not None and self.low > self.high:
+                    raise ValueError(f"{field}: min {self.low} is greater than max {self.high}")
+            elif isinstance(spec, int) and not isinstance(spec, bool):
+                self.low = self.high = spec
+            else:
+                raise ValueError(f"{field}: expected a number or a min/max range")
+            self.op = 'range'
+        elif field in FLAG_FIELDS:
+            if not isinstance(spec, bool):
+                raise ValueError(f"{field}: expected true or false")
+            self.op = 'flag'
+        elif field in TEXT_FIELDS:
+            keywords = spec.get('contains_any') if isinstance(spec, dict) else None
+            if not keywords or not all(isinstance(k, str) and k for k in keywords):
+                raise ValueError(f"{field}: expected {{'contains_any': [keywords]}}")
+            self.keywords = [k.lower() for k in keywords]
+            self.op = 'contains'
+        else:
+            raise ValueError(f"Unknown segment field: {field}")
+
+    def test(self, record):
+        value = getattr(record, self.field)
+        if self.op == 'missing':
+            return value is None
+        if self.op == 'flag':
+            return bool(value) == self.spec
+        if value is None:
+            return False
+        if self.op == 'range':
+            return (self.low is None or value >= self.low) and (self.high is None or value <= self.high)
+        value = value.lower()
+        return any(keyword in value for keyword in self.keywords)
+
+    def expression(self):
+        """The same test as a pyarrow.compute expression over result store columns"""
+        field = pc.field(self.field)
+        if self.op == 'missing':
+            return field.is_null()
+        if self.op == 'flag':
+            return field == self.spec
+        if self.op == 'range':
+            bounds = []
+            if self.low is not None:
+                bounds.append(field >= self.low)
+            if self.high is not None:
+                bounds.append(field <= self.high)
+            return _all(bounds)
+        pattern = '|'.join(re.escape(keyword) for keyword in self.keywords)
+        return pc.match_substring_regex(field, pattern=pattern, ignore_case=True)
+
+def _all(expressions):
+    combined = expressions[0]
+    for expression in expressions[1:]:
+        combined = combined & expression
+    return combined
+
+class Segment:
+    """A named group of successfully scraped profiles, defined by field conditions that must all hold"""
+    def __init__(self, name, where, title=None, label=None):
+        if not isinstance(name, str) or not NAME_PATTERN.match(name) or name == 'all_profiles':
+            raise ValueError(f"Invalid segment name: {name!r}")
+        if not isinstance(where, dict) or not where:
+            raise ValueError(f"Segment {name} has no conditions")
+        self.name = name
+        self.where = where
+        self.title = title or name.replace('_', ' ').title()
+        self.label = label or self.title
+        self.conditions = [Condition(field, spec) for field, spec in where.items()]
+
+    def matches(self, result):
+        """Per-record test, used while files are written"""
+        if 'error' in result:
+            return False
+        return all(condition.test(result) for condition in self.conditions)
+
+    def expression(self):
+        """Vectorized test over a result store table"""
+        return _all([pc.field('status') == 'success'] + [c.expression() for c in self.conditions])
+
+    def to_dict(self):
+        return {'name': self.name, 'title': self.title, 'label': self.label, 'where': self.where}
+
+def load_segments(path=None):
+    """DEFAULT_SEGMENTS plus the rules in SEGMENTS_FILE, a JSON list of
+    {'name', 'where', 'title'?, 'label'?}; a rule reusing a name replaces it"""
+    path = path or Config.SEGMENTS_FILE
+    rules = {rule['name']: rule for rule in DEFAULT_SEGMENTS}
+    if path:
+        try:
+            with open(path, encoding='utf-8') as f:
+                custom = json.load(f)
+            if not isinstance(custom, list):
+                raise ValueError('expected a JSON list of segment rules')
+            for rule in custom:
+                Segment(**rule)  # validate before accepting any of them
+            rules.update((rule['name'], rule) for rule in custom)
+        except (OSError, TypeError, ValueError, KeyError) as e:
+            logger.error(f"Ignoring segment rules in {path}: {str(e)}")
+    return [Segment(**rule) for rule in rules.values()]
+
+def count_segments(table, segments=None):
+    """{segment name: matching rows} of a result store table, one vectorized filter per segment"""
+    segments = configured_segments if segments is None else segments
+    return {segment.name: table.filter(segment.expression()).num_rows for segment in segments}
+
+def split_segments(table, segments=None):
+    """{segment name: matching rows as a Table}; a profile can be in several segments"""
+    segments = configured_segments if segments is None else segments
+    return {segment.name: table.filter(segment.expression()) for segment in segments}
+
+def count_records(results, segments=None):
+    """count_segments over scrape results (ProfileRecords and error dicts), without pyarrow"""
+    segments = configured_segments if segments is None else segments
+    counts = dict.fromkeys((segment.name for segment in segments), 0)
+    for result in results:
+        for segment in segments:
+            if segment.matches(result):
+                counts[segment.name] += 1
+    return counts
+
+# Read once per process; export workers load the same file
+configured_segments = load_segments()
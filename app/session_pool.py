@@ -0,0 +1,186 @@
+import time
+import hashlib
+import logging
+from threading import Lock
+from config import Config
+from utils.rate_limiter import TokenBucket, AdaptiveRateController
+from utils.metrics import update_active_sessions, update_session_rate, remove_session_rate
+
+logger = logging.getLogger(__name__)
+
+# Result statuses that say something about the session rather than the profile
+AUTH_FAILURE_STATUSES = ('auth_required', 'auth_failed')
+THROTTLE_STATUSES = ('rate_limited', 'login_redirect')
+
+# Consecutive login redirects after which a session is treated as logged out
+MAX_LOGIN_REDIRECTS = 3
+
+class PooledSession:
+    """One authenticated Instagram session with its own cookie jar, budget and health"""
+    def __init__(self, key, scraper, requests_per_minute, burst, pause):
+        self.key = key
+        # Metric label and log name: a sessionid starts with the account's numeric user id,
+        # so only a digest of the key leaves the process
+        self.label = 'session-' + hashlib.sha256(str(key).encode()).hexdigest()[:10]
+        self.scraper = scraper
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self.controller = AdaptiveRateController(
+            self.bucket,
+            min_rate=Config.SESSION_MIN_REQUESTS_PER_MINUTE,
+            max_rate=max(Config.SESSION_MAX_REQUESTS_PER_MINUTE, requests_per_minute),
+            increase=Config.SESSION_RATE_INCREASE,
+            decrease=Config.SESSION_RATE_DECREASE,
+            pause=pause
+        )
+        self.in_flight = 0
+        self.healthy = True
+        self.cooldown_until = 0
+        self.requests = 0
+        self.failures = 0
+        self.login_redirects = 0
+
+    def available_in(self):
+        """Seconds until this session may send its next request"""
+        cooldown = max(0.0, self.cooldown_until - time.monotonic())
+        return max(cooldown, self.bucket.time_until_available())
+
+    def to_dict(self):
+        stats = getattr(getattr(self.scraper, 'session', None), 'transport_stats', None)
+        return {
+            'key': self.label,
+            'healthy': self.healthy,
+            'requests_per_minute': round(self.controller.rate, 2),
+            'cooling_down': self.cooldown_until > time.monotonic(),
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'failures': self.failures,
+            'transport': stats.to_dict() if stats else None
+        }
+
+class SessionPool:
+    """Pool of Instagram sessions handed out by soonest availability, then load.
+
+    Sessions failing authentication are taken out of rotation. Every other
+    response feeds the session's AIMD controller: clean responses speed it up,
+    429s and login redirects slow it down and pause it for Retry-After seconds
+    (SESSION_COOLDOWN when the server sent none).
+    """
+    def __init__(self, scraper_factory=None, requests_per_minute=None, burst=None, cooldown=None):
+        self.scraper_factory = scraper_factory
+        self.requests_per_minute = requests_per_minute or Config.SESSION_REQUESTS_PER_MINUTE
+        self.burst = burst or Config.SESSION_BURST
+        self.cooldown = cooldown if cooldown is not None else Config.SESSION_COOLDOWN
+        self.sessions = {}
+        self.lock = Lock()
+
+    @classmethod
+    def from_scrapers(cls, scrapers, **kwargs):
+        """Build a pool around already configured scraper instances"""
+        pool = cls(**kwargs)
+        for i, scraper in enumerate(scrapers):
+            pool.add_scraper(scraper, key=getattr(scraper, 'session_id', None) or f'session-{i}')
+        return pool
+
+    def add_scraper(self, scraper, key):
+        with self.lock:
+            pooled = PooledSession(key, scraper, self.requests_per_minute, self.burst, self.cooldown)
+            self.sessions[key] = pooled
+            self._update_gauge()
+        update_session_rate(pooled.label, pooled.controller.rate)
+        return pooled
+
+    def add(self, sessionid, csrf_token=None, verify=True):
+        """Create a scraper for sessionid and add it to the pool; returns None if it is not usable"""
+        with self.lock:
+            existing = self.sessions.get(sessionid)
+        if existing and existing.healthy:
+            return existing
+
+        scraper = self.scraper_factory()
+        if not scraper.set_instagram_session(sessionid, csrf_token):
+            return None
+        if verify and not scraper.verify_authentication():
+            return None
+        logger.info("Added Instagram session to pool")
+        return self.add_scraper(scraper, sessionid)
+
+    def remove(self, sessionid):
+        with self.lock:
+            removed = self.sessions.pop(sessionid, None)
+            self._update_gauge()
+        if removed is not None:
+            remove_session_rate(removed.label)
+        return removed is not None
+
+    def get(self, sessionid):
+        with self.lock:
+            return self.sessions.get(sessionid)
+
+    def healthy_count(self):
+        with self.lock:
+            return sum(1 for s in self.sessions.values() if s.healthy)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def reserve(self):
+        """Pick a healthy session and take one request from its budget.
+
+        Returns (session, delay) where delay is how long the caller must wait
+        before sending, or (None, 0) when no healthy session is left.
+        """
+        with self.lock:
+            candidates = [s for s in self.sessions.values() if s.healthy]
+            if not candidates:
+                return None, 0
+            pooled = min(candidates, key=lambda s: (s.available_in(), s.in_flight))
+            pooled.in_flight += 1
+            pooled.requests += 1
+            cooldown = max(0.0, pooled.cooldown_until - time.monotonic())
+        return pooled, max(cooldown, pooled.bucket.reserve())
+
+    def release(self, pooled, result):
+        """Return a session after a request and update its health from the result.
+
+        Returns True if the failure was caused by the session, so the caller can
+        retry the profile on another one.
+        """
+        result = result or {}
+        status = result.get('scraping_status')
+        with self.lock:
+            pooled.in_flight -= 1
+            if status == 'login_redirect':
+                pooled.login_redirects += 1
+                if pooled.login_redirects >= MAX_LOGIN_REDIRECTS:
+                    status = 'auth_failed'
+            else:
+                pooled.login_redirects = 0
+
+            if status in AUTH_FAILURE_STATUSES:
+                pooled.healthy = False
+                pooled.failures += 1
+                logger.warning(f"Session {pooled.label} failed authentication, removed from rotation")
+                self._update_gauge()
+                return True
+            if status in THROTTLE_STATUSES:
+                pooled.failures += 1
+                now = time.monotonic()
+                # Requests already in flight when the first 429 landed do not cut the rate again
+                if pooled.cooldown_until <= now:
+                    pause = pooled.controller.on_throttle(result.get('retry_after'))
+                    pooled.cooldown_until = now + pause
+                    logger.warning(f"Session {pooled.label} throttled ({status}), now "
+                                   f"{pooled.controller.rate:.1f} req/min after a {pause:.0f}s pause")
+            elif status == 'success':
+                # Only a profile actually served says the session can go faster; errors,
+                # not-found answers and empty results leave its rate alone
+                pooled.controller.on_success()
+        update_session_rate(pooled.label, pooled.controller.rate)
+        return status in THROTTLE_STATUSES
+
+    def status(self):
+        with self.lock:
+            return [s.to_dict() for s in self.sessions.values()]
+
+    def _update_gauge(self):
+        update_active_sessions(sum(1 for s in self.sessions.values() if s.healthy))
@@ -1,6 +1,20 @@
-from celery import Celery
-from app import create_app
-from app.utils.metrics import track_scrape
+import os
+from threading import Lock
+from flask import Flask
+from celery import Celery, chord
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_init, worker_process_init
+import sentry_sdk
+from sentry_sdk.integrations.celery import CeleryIntegration
+from config import Config
+from app.fetch_engine import FetchEngine
+from app.profile_cache import ProfileCache
+from app.session_pool import SessionPool
+from app.jobs import JobStore, run_chunk
+from app.export_stage import export_stage
+from app.render_cache import RenderCache
+from app.utils.file_index import FileIndex
+from utils.metrics import start_metrics_server, track_scrape
 from app.utils.file_manager import cleanup_old_files
 import logging
 
@@ -20,66 +34,210 @@ celery.conf.update(
     enable_utc=True,
     task_track_started=True,
     task_time_limit=3600,  # 1 hour
+    task_soft_time_limit=3300,  # lets a chunk stop cleanly; what it did not reach stays pending
     worker_max_tasks_per_child=100,
     worker_prefetch_multiplier=1
 )
 
+def split_chunks(pending, size):
+    """[start, stop) position ranges covering up to size pending usernames each"""
+    ranges = []
+    for i in range(0, len(pending), size):
+        part = pending[i:i + size]
+        ranges.append((part[0][0], part[-1][0] + 1))
+    return ranges
+
+def _scraper(sessionid=None):
+    from app.scraper import InstagramScraper
+    # The engine's per-session budget replaces the scraper's own fixed interval
+    scraper = InstagramScraper(min_request_interval=0)
+    if sessionid:
+        scraper.set_instagram_session(sessionid)
+    return scraper
+
+def _worker_app():
+    """The Flask app tasks run in: just the config the scraper and file manager read from
+    current_app, and Sentry when SENTRY_DSN is set; the web extensions are of no use here"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if os.environ.get('SENTRY_DSN'):
+        sentry_sdk.init(
+            dsn=os.environ.get('SENTRY_DSN'),
+            integrations=[CeleryIntegration()],
+            traces_sample_rate=1.0,
+            environment=os.environ.get('FLASK_ENV', 'production')
+        )
+    return app
+
+class WorkerState:
+    """What every task of a worker process shares, built once when the process starts.
+
+    The Flask app, the stores, the file index and render cache the job's
+    files are listed and rendered through, and one scraper per
+    INSTAGRAM_SESSION_IDS entry (anonymous when none are configured), so
+    cookies, keep-alive TLS connections and each session's pacing carry over
+    from one task to the next.
+    """
+    def __init__(self):
+        self.app = _worker_app()
+        self.store = JobStore()
+        self.cache = ProfileCache()
+        self.file_index = FileIndex()
+        self.render_cache = RenderCache(self.store, self.file_index, export_stage)
+        scrapers = [_scraper(sessionid) for sessionid in Config.INSTAGRAM_SESSION_IDS] or [_scraper()]
+        # One pool per session so a chunk pinned to it sees only that session's budget
+        self.pools = [SessionPool.from_scrapers([scraper]) for scraper in scrapers]
+
+    def pool(self, session_index):
+        """The pool of the session_index-th session, or the next one still healthy"""
+        for offset in range(len(self.pools)):
+            pool = self.pools[(session_index + offset) % len(self.pools)]
+            if pool.healthy_count():
+                return pool
+        return self.pools[session_index % len(self.pools)]
+
+_worker = None
+_worker_lock = Lock()
+
+def worker_state():
+    """This process's WorkerState, built on first use where the signal did not run (eager mode, solo pool)"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = WorkerState()
+        return _worker
+
+@worker_init.connect
+def serve_metrics(**kwargs):
+    # Once, in the parent; prefork children report through PROMETHEUS_MULTIPROC_DIR
+    if Config.ENABLE_METRICS:
+        start_metrics_server()
+
+@worker_process_init.connect
+def init_worker(**kwargs):
+    # After the fork, so no connection is shared with the parent
+    worker_state()
+    logger.info("Worker process initialized")
+
 @celery.task(bind=True, max_retries=3)
-def process_scraping(self, usernames):
-    """Process scraping in background"""
+def process_scraping(self, job_id):
+    """Fan a scrape job out as one scrape_chunk task per CELERY_CHUNK_SIZE pending usernames.
+
+    The chunks run on whichever workers are free; finalize_job runs once all
+    of them are done. Resuming a paused job dispatches only what is pending.
+    """
     try:
-        # Create Flask app context
-        app = create_app()
-        with app.app_context():
-            from app.scraper import InstagramScraper
-            scraper = InstagramScraper()
-            
-            # Clean up old files before starting
+        state = worker_state()
+        store = state.store
+        if not store.claim(job_id, owner=self.request.id):
+            logger.info(f"Job {job_id} is already running elsewhere")
+            return {'status': 'skipped', 'job_id': job_id}
+
+        # Clean up old files once per job rather than per chunk
+        with state.app.app_context():
             cleanup_old_files()
-            
-            # Process usernames
-            successful = 0
-            failed = 0
-            rate_limited = 0
-            
-            for username in usernames:
-                try:
-                    result = scraper.scrape_profile(username)
-                    if result.get('error'):
-                        if 'rate limit' in result['error'].lower():
-                            rate_limited += 1
-                            track_scrape('rate_limited')
-                        else:
-                            failed += 1
-                            track_scrape('failed')
-                    else:
-                        successful += 1
-                        track_scrape('success')
-                except Exception as e:
-                    logger.error(f"Error scraping {username}: {str(e)}")
-                    failed += 1
-                    track_scrape('error')
-            
-            return {
-                'status': 'completed',
-                'successful': successful,
-                'failed': failed,
-                'rate_limited': rate_limited,
-                'total': len(usernames)
-            }
-            
+
+        chunks = split_chunks(store.pending_items(job_id), Config.CELERY_CHUNK_SIZE)
+        header = [scrape_chunk.s(job_id, start, stop, i) for i, (start, stop) in enumerate(chunks)]
+        if header:
+            chord(header)(finalize_job.s(job_id))
+        else:
+            finalize_job.delay([], job_id)
+        # The cleanup above may have taken a while; the chunks take over the heartbeat from here
+        store.heartbeat(job_id)
+        logger.info(f"Job {job_id} split into {len(chunks)} chunk(s)")
+        return {'status': 'dispatched', 'job_id': job_id, 'chunks': len(chunks)}
+
     except Exception as e:
         logger.error(f"Error in process_scraping: {str(e)}")
         track_scrape('error')
         # Retry the task
         self.retry(exc=e, countdown=60)  # Retry after 1 minute
 
+@celery.task(bind=True, max_retries=3)
+def scrape_chunk(self, job_id, start, stop, session_index):
+    """Scrape the pending usernames at positions [start, stop) of a job on one pinned session.
+
+    Always returns its counts so the chord completes: a chunk that keeps
+    failing leaves its usernames pending and the job ends up paused.
+    """
+    counts = {'successful': 0, 'failed': 0, 'rate_limited': 0, 'pending': 0}
+
+    def record_result(index, username, result):
+        if result.get('error'):
+            if result.get('scraping_status') == 'error':
+                counts['failed'] += 1
+                track_scrape('error')
+            elif 'rate limit' in result['error'].lower():
+                counts['rate_limited'] += 1
+                track_scrape('rate_limited')
+            else:
+                counts['failed'] += 1
+                track_scrape('failed')
+        else:
+            counts['successful'] += 1
+            track_scrape('success')
+
+    state = worker_state()
+    store = state.store
+    # Accepted: the job is alive even if this chunk waited in the broker
+    store.heartbeat(job_id)
+    try:
+        job = store.get(job_id)
+        with state.app.app_context():
+            engine = FetchEngine(state.pool(session_index), cache=state.cache,
+                                 refresh=job['options'].get('refresh', False))
+            counts['pending'] = run_chunk(store, job_id, engine, start, stop, on_result=record_result,
+                                          profile=job['options'].get('profile', False))
+    except SoftTimeLimitExceeded:
+        logger.warning(f"Chunk {start}-{stop} of job {job_id} hit the time limit; the rest stays pending")
+    except Exception as e:
+        logger.error(f"Error in chunk {start}-{stop} of job {job_id}: {str(e)}")
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=60)
+        counts['error'] = str(e)
+    return counts
+
+@celery.task
+def finalize_job(chunk_results, job_id):
+    """Chord callback: close the job and export it from the checkpointed results.
+
+    Like main.process_scraping: the Parquet copy is written by an export
+    process and the TXT/XLSX files either with it or, with LAZY_EXPORTS,
+    declared in the file index and rendered on first download.
+    """
+    state = worker_state()
+    store = state.store
+    status = store.finish(job_id)
+    job = store.get(job_id)
+
+    if Config.LAZY_EXPORTS:
+        outputs = export_stage.open(job_id, job['stamp'], job['total'], job_store_path=store.path)
+        on_result = state.render_cache.declaring(job_id, job['stamp'], outputs.add)
+    else:
+        outputs = export_stage.open(job_id, job['stamp'], job['total'], Config.SCRAPED_DATA_DIR,
+                                    file_index=state.file_index, job_store_path=store.path)
+        on_result = outputs.add
+    try:
+        for position, username, result in store.completed_items(job_id):
+            on_result(position, username, result)
+    finally:
+        outputs.close()
+
+    summary = {'status': status, 'job_id': job_id, 'total': job['total'], 'chunks': len(chunk_results)}
+    for key in ('successful', 'failed', 'rate_limited'):
+        summary[key] = sum(result.get(key, 0) for result in chunk_results)
+    errors = [result['error'] for result in chunk_results if 'error' in result]
+    if errors:
+        summary['errors'] = errors
+    logger.info(f"Job {job_id} {status}: {summary}")
+    return summary
+
 @celery.task
 def cleanup_task():
     """Periodic cleanup task"""
     try:
-        app = create_app()
-        with app.app_context():
+        with worker_state().app.app_context():
             deleted = cleanup_old_files()
             logger.info(f"Cleanup task completed. Deleted {deleted} files.")
             return {'deleted': deleted}
@@ -93,4 +251,4 @@ celery.conf.beat_schedule = {
         'task': 'app.tasks.cleanup_task',
         'schedule': 86400.0,  # Run daily
     },
-} 
\ No newline at end of file
+}
@@ -0,0 +1,90 @@
+import time
+import logging
+import contextvars
+from contextlib import contextmanager, nullcontext
+from threading import Lock
+from utils.metrics import track_stage
+
+try:
+    from opentelemetry import trace
+except ImportError:  # optional: spans are only emitted when OpenTelemetry is installed
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+# Stages of the scrape pipeline, in the order a profile goes through them
+QUEUE_WAIT = 'queue_wait'  # job created until first picked up by a worker
+RATE_LIMIT_WAIT = 'rate_limit_wait'  # waiting for a session's request budget
+NETWORK = 'network'  # HTTP request and response body
+PARSE = 'parse'  # JSON decoding or HTML parsing into a ProfileRecord
+RETRY_BACKOFF = 'retry_backoff'  # sleeps between attempts of a failed fetch
+EXPORT = 'export'  # TXT/XLSX/Parquet serialization of the job's results
+RENDER = 'render'  # TXT/XLSX rendered on download (LAZY_EXPORTS)
+STAGES = (QUEUE_WAIT, RATE_LIMIT_WAIT, NETWORK, PARSE, RETRY_BACKOFF, EXPORT, RENDER)
+
+tracer = trace.get_tracer(__name__) if trace is not None else None
+
+class StageTimes:
+    """Seconds and passes per stage collected for one job, from any thread"""
+    def __init__(self):
+        self.totals = {}
+        self.lock = Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            total, count = self.totals.get(stage, (0.0, 0))
+            self.totals[stage] = (total + seconds, count + 1)
+
+    def drain(self):
+        """{stage: (seconds, count)} collected since the last drain"""
+        with self.lock:
+            totals, self.totals = self.totals, {}
+        return totals
+
+# The StageTimes of the job whose work runs in this context; FetchEngine copies the
+# context into its fetch threads, so the scraper's stages land on the right job
+_current = contextvars.ContextVar('stage_times', default=None)
+
+def record_stage(stage, seconds, times=None):
+    """Account seconds to a stage: the histogram and the current (or given) job's breakdown"""
+    track_stage(stage, seconds)
+    times = times or _current.get()
+    if times is not None:
+        times.add(stage, seconds)
+
+@contextmanager
+def stage(name, times=None, **attributes):
+    """Time the enclosed block as one pass through a pipeline stage, inside a trace span"""
+    span = tracer.start_as_current_span(f'scrape.{name}', attributes=attributes) if tracer else nullcontext()
+    started = time.perf_counter()
+    try:
+        with span:
+            yield
+    finally:
+        record_stage(name, time.perf_counter() - started, times)
+
+@contextmanager
+def job_timing(store, job_id):
+    """Collect the stage times of the enclosed work for job_id and add them to its breakdown in store.
+
+    Yields the StageTimes, so a long run can flush() it along the way (e.g.
+    from its heartbeat) and the breakdown fills in while the job runs.
+    """
+    times = StageTimes()
+    token = _current.set(times)
+    span = tracer.start_as_current_span('scrape.job', attributes={'job_id': job_id}) if tracer else nullcontext()
+    try:
+        with span:
+            yield times
+    finally:
+        _current.reset(token)
+        flush(store, job_id, times)
+
+def flush(store, job_id, times):
+    """Move what times collected so far into the job's breakdown in store"""
+    totals = times.drain()
+    if totals:
+        try:
+            store.add_stage_times(job_id, totals)
+        except Exception as e:
+            logger.warning(f"Could not save stage times of job {job_id}: {str(e)}")
@@ -0,0 +1,187 @@
+import logging
+from threading import Lock
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
+from requests.structures import CaseInsensitiveDict
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from config import Config
+from utils.metrics import track_transport
+
+try:
+    import httpx
+except ImportError:  # optional: only needed for HTTP_TRANSPORT=http2
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+class TransportStats:
+    """Requests sent vs. connections opened by one session, i.e. how well keep-alive is working"""
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.connections = 0
+        self.timeouts = 0
+        self.lock = Lock()
+
+    def request_sent(self):
+        with self.lock:
+            self.requests += 1
+        track_transport(self.name, 'request')
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections += 1
+        track_transport(self.name, 'connection')
+
+    def timed_out(self):
+        with self.lock:
+            self.timeouts += 1
+        track_transport(self.name, 'timeout')
+
+    def to_dict(self):
+        with self.lock:
+            reused = max(self.requests - self.connections, 0)
+            return {
+                'transport': self.name,
+                'requests': self.requests,
+                'connections': self.connections,
+                'reused': reused,
+                'reuse_ratio': round(reused / self.requests, 3) if self.requests else 0.0,
+                'timeouts': self.timeouts
+            }
+
+def default_timeout():
+    """(connect, read) seconds applied to every request that does not pass its own"""
+    return (Config.CONNECT_TIMEOUT, Config.REQUEST_TIMEOUT)
+
+def cookie_domain(base_url):
+    """Domain the session cookies are scoped to, so they also reach a non-Instagram base_url"""
+    host = urlparse(base_url).hostname or ''
+    return '.instagram.com' if host.endswith('instagram.com') else host
+
+def _counting_pool(base, stats):
+    class CountingConnectionPool(base):
+        def _new_conn(self):
+            stats.connection_opened()
+            return super()._new_conn()
+    return CountingConnectionPool
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter with a keep-alive pool sized for the fetch concurrency and default timeouts.
+
+    Without a timeout requests waits forever on a stalled socket, which pins a
+    fetch worker for the rest of the batch.
+    """
+    def __init__(self, stats, pool_size, timeout):
+        self.stats = stats
+        self.timeout = timeout
+        super().__init__(pool_connections=4, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.stats),
+            'https': _counting_pool(HTTPSConnectionPool, self.stats)
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        self.stats.request_sent()
+        try:
+            return super().send(request, timeout=timeout or self.timeout, **kwargs)
+        except requests.Timeout:
+            self.stats.timed_out()
+            raise
+
+class HttpxResponse:
+    """The parts of requests.Response the scrapers use, over an httpx response"""
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+
+    @property
+    def text(self):
+        return self._response.text
+
+    @property
+    def content(self):
+        return self._response.content
+
+    def json(self):
+        return self._response.json()
+
+class Http2Session:
+    """HTTP/2 client with the requests.Session surface the scrapers use (headers, cookies, get).
+
+    Every concurrent request to Instagram is multiplexed over one connection,
+    so only the first request of the session pays for the TLS handshake.
+    """
+    def __init__(self, stats, pool_size, timeout):
+        self.transport_stats = stats
+        self.headers = CaseInsensitiveDict()
+        # httpx wraps this jar by reference, so cookies.set()/clear() apply to the client
+        self.cookies = RequestsCookieJar()
+        connect, read = timeout
+        self.client = httpx.Client(
+            http2=True,
+            cookies=self.cookies,
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    def get(self, url, headers=None, allow_redirects=True, timeout=None):
+        merged = dict(self.headers)
+        merged.update(headers or {})
+        kwargs = {'headers': merged, 'follow_redirects': allow_redirects, 'extensions': {'trace': self._trace}}
+        if timeout is not None:
+            connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            kwargs['timeout'] = httpx.Timeout(read, connect=connect)
+
+        self.transport_stats.request_sent()
+        try:
+            response = self.client.get(url, **kwargs)
+        except httpx.TimeoutException as e:
+            self.transport_stats.timed_out()
+            raise requests.Timeout(str(e))
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(str(e))
+        return HttpxResponse(response)
+
+    def _trace(self, event_name, info):
+        # httpcore's trace extension reports each new TCP connection
+        if event_name == 'connection.connect_tcp.complete':
+            self.transport_stats.connection_opened()
+
+    def close(self):
+        self.client.close()
+
+def create_session(pool_size=None, transport=None, timeout=None):
+    """Build the HTTP session used by a scraper according to HTTP_TRANSPORT.
+
+    'requests' (default) is a requests.Session with a PooledHTTPAdapter;
+    'http2' needs httpx[http2] and falls back to 'requests' without it. The
+    returned session carries its TransportStats as .transport_stats.
+    """
+    transport = transport or Config.HTTP_TRANSPORT
+    pool_size = pool_size or Config.HTTP_POOL_SIZE or Config.SCRAPE_CONCURRENCY
+    timeout = timeout or default_timeout()
+
+    if transport == 'http2':
+        try:
+            if httpx is None:
+                raise ImportError('httpx')
+            return Http2Session(TransportStats('http2'), pool_size, timeout)
+        except ImportError:
+            # httpx itself, or the h2 package httpx needs for http2=True
+            logger.warning("httpx[http2] is not installed; using the requests transport instead of HTTP/2")
+
+    stats = TransportStats('requests')
+    session = requests.Session()
+    adapter = PooledHTTPAdapter(stats, pool_size, timeout)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.transport_stats = stats
+    return session
@@ -0,0 +1,18 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+def ensure_parent_dir(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+@contextmanager
+def connect(path):
+    """Short-lived SQLite connection that commits on success and always closes"""
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
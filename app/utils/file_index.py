@@ -0,0 +1,195 @@
+import os
+import re
+import time
+import logging
+from datetime import datetime
+from config import Config
+from app.utils.db import connect, ensure_parent_dir
+
+logger = logging.getLogger(__name__)
+
+SORT_COLUMNS = {'modified', 'created', 'name', 'size'}
+
+# File states: written by the export stage, rendered on download and evictable, or listed but not on disk yet
+WRITTEN = 'written'
+CACHED = 'cached'
+DECLARED = 'declared'
+
+# Result file names look like <kind>_<YYYYmmdd_HHMMSS>.<ext>
+FILENAME_PATTERN = re.compile(r'^(?P<kind>.+)_(?P<stamp>\d{8}_\d{6})\.(?P<ext>\w+)$')
+
+def file_type(filename):
+    return 'Excel' if filename.endswith('.xlsx') else 'Text'
+
+def file_kind(filename):
+    """'all_profiles', 'profiles_under_5_posts', ... or None for unrecognised names"""
+    match = FILENAME_PATTERN.match(filename)
+    return match.group('kind') if match else None
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+class FileIndex:
+    """Metadata for the result files in SCRAPED_DATA_DIR, kept in SQLite.
+
+    The export stage registers files as it writes them and delete/cleanup
+    remove them, so listings are answered from indexed queries without
+    listing or stat-ing the directory. Files that are only rendered on
+    download are declared up front and listed before they exist.
+    """
+    def __init__(self, path=None, data_dir=None):
+        self.path = path or Config.FILE_INDEX_PATH
+        self.data_dir = data_dir or Config.SCRAPED_DATA_DIR
+        ensure_parent_dir(self.path)
+        with connect(self.path) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    name TEXT PRIMARY KEY,
+                    job_id TEXT,
+                    kind TEXT,
+                    type TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    modified REAL NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'written',
+                    accessed REAL
+                )
+            ''')
+            # Indexes created before files could be declared or cached
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(files)')}
+            if 'state' not in columns:
+                conn.execute("ALTER TABLE files ADD COLUMN state TEXT NOT NULL DEFAULT 'written'")
+            if 'accessed' not in columns:
+                conn.execute('ALTER TABLE files ADD COLUMN accessed REAL')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_modified ON files (modified)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_job ON files (job_id, modified)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_type ON files (type, modified)')
+
+    def register(self, file_path, job_id=None, state=WRITTEN):
+        """Record (or refresh) a file just written by the export stage or rendered for a download"""
+        name = os.path.basename(file_path)
+        try:
+            stats = os.stat(file_path)
+        except OSError as e:
+            logger.error(f"Error indexing {name}: {str(e)}")
+            return
+        with connect(self.path) as conn:
+            conn.execute(
+                'INSERT INTO files (name, job_id, kind, type, size, created, modified, state) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET size = excluded.size, modified = excluded.modified, '
+                'state = excluded.state, job_id = COALESCE(excluded.job_id, files.job_id)',
+                (name, job_id, file_kind(name), file_type(name), stats.st_size, stats.st_ctime, stats.st_mtime, state)
+            )
+
+    def declare(self, names, job_id):
+        """List files of a job that will be rendered when first downloaded"""
+        now = time.time()
+        with connect(self.path) as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO files (name, job_id, kind, type, size, created, modified, state) '
+                'VALUES (?, ?, ?, ?, 0, ?, ?, ?)',
+                [(name, job_id, file_kind(name), file_type(name), now, now, DECLARED) for name in names]
+            )
+
+    def get(self, name):
+        """{'name', 'job_id', 'state', 'size'} of an indexed file, or None"""
+        with connect(self.path) as conn:
+            row = conn.execute('SELECT job_id, state, size FROM files WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        return {'name': name, 'job_id': row[0], 'state': row[1], 'size': row[2]}
+
+    def touch(self, name):
+        """Note a download, for least-recently-used eviction"""
+        with connect(self.path) as conn:
+            conn.execute('UPDATE files SET accessed = ? WHERE name = ?', (time.time(), name))
+
+    def cached_size(self):
+        with connect(self.path) as conn:
+            return conn.execute('SELECT COALESCE(SUM(size), 0) FROM files WHERE state = ?', (CACHED,)).fetchone()[0]
+
+    def least_recently_used(self):
+        """(name, size) of the cached files, least recently downloaded first"""
+        with connect(self.path) as conn:
+            return conn.execute(
+                'SELECT name, size FROM files WHERE state = ? ORDER BY COALESCE(accessed, modified)', (CACHED,)
+            ).fetchall()
+
+    def evicted(self, name):
+        """Keep listing a cached file whose copy on disk was removed; the next download renders it again"""
+        with connect(self.path) as conn:
+            conn.execute('UPDATE files SET state = ?, size = 0 WHERE name = ? AND state = ?', (DECLARED, name, CACHED))
+
+    def remove(self, name):
+        with connect(self.path) as conn:
+            conn.execute('DELETE FROM files WHERE name = ?', (name,))
+
+    def list(self, page=1, per_page=None, job_id=None, file_type=None, kind=None,
+             sort='modified', descending=True):
+        """One page of files plus the total number of matches"""
+        per_page = per_page or Config.FILES_PAGE_SIZE
+        if sort not in SORT_COLUMNS:
+            sort = 'modified'
+
+        conditions = []
+        params = []
+        for column, value in (('job_id', job_id), ('type', file_type), ('kind', kind)):
+            if value:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+        with connect(self.path) as conn:
+            total = conn.execute(f'SELECT COUNT(*) FROM files {where}', params).fetchone()[0]
+            rows = conn.execute(
+                f'SELECT name, job_id, kind, type, size, created, modified, state FROM files {where} '
+                f'ORDER BY {sort} {"DESC" if descending else "ASC"} LIMIT ? OFFSET ?',
+                params + [per_page, (max(page, 1) - 1) * per_page]
+            ).fetchall()
+
+        files = [{
+            'name': name,
+            'job_id': job,
+            'kind': kind,
+            'type': ftype,
+            'size': size,
+            'created': _format_time(created),
+            'modified': _format_time(modified),
+            'rendered': state != DECLARED
+        } for name, job, kind, ftype, size, created, modified, state in rows]
+        return files, total
+
+    def older_than(self, timestamp):
+        """Names of files last modified before timestamp"""
+        with connect(self.path) as conn:
+            rows = conn.execute('SELECT name FROM files WHERE modified < ?', (timestamp,)).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, file_type=None):
+        with connect(self.path) as conn:
+            if file_type:
+                return conn.execute('SELECT COUNT(*) FROM files WHERE type = ?', (file_type,)).fetchone()[0]
+            return conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def sync(self, extensions=None):
+        """Reconcile the index with the directory once, e.g. at startup or after manual edits"""
+        extensions = tuple(extensions or Config.ALLOWED_EXTENSIONS)
+        on_disk = set()
+        for filename in os.listdir(self.data_dir):
+            if filename.endswith(extensions):
+                on_disk.add(filename)
+        with connect(self.path) as conn:
+            states = dict(conn.execute('SELECT name, state FROM files'))
+            missing = [name for name in states.keys() - on_disk if states[name] != DECLARED]
+            # A missing cached file can be rendered again; a missing written file is gone
+            conn.executemany(
+                'UPDATE files SET state = ?, size = 0 WHERE name = ?',
+                [(DECLARED, n) for n in missing if states[n] == CACHED]
+            )
+            conn.executemany('DELETE FROM files WHERE name = ?', [(n,) for n in missing if states[n] == WRITTEN])
+        added = on_disk - states.keys()
+        for filename in added:
+            self.register(os.path.join(self.data_dir, filename))
+        logger.info(f"File index synced: {len(added)} added, {len(missing)} missing")
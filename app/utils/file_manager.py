@@ -2,11 +2,22 @@ import os
 import shutil
 from datetime import datetime
 from flask import current_app
-from .security import sanitize_filename
+from utils.security import sanitize_filename
+from app.utils.file_index import FileIndex
+from app.profiler import prune_profiles
 import logging
 
 logger = logging.getLogger(__name__)
 
+def get_file_index():
+    """The app's file metadata index, created on first use"""
+    index = current_app.extensions.get('file_index')
+    if index is None:
+        index = FileIndex(current_app.config['FILE_INDEX_PATH'], current_app.config['SCRAPED_DATA_DIR'])
+        index.sync(current_app.config['ALLOWED_EXTENSIONS'])
+        current_app.extensions['file_index'] = index
+    return index
+
 def get_file_path(filename):
     """Get the full path of a file"""
     try:
@@ -40,34 +51,17 @@ def validate_file_access(filename):
         logger.error(f"Error validating file access: {str(e)}")
         return False
 
-def get_file_list():
-    """Get list of files with metadata"""
+def get_file_list(page=1, per_page=None, job_id=None, file_type=None, kind=None,
+                  sort='modified', descending=True):
+    """Get one page of files with metadata, newest first, plus the total count"""
     try:
-        files = []
-        for filename in os.listdir(current_app.config['SCRAPED_DATA_DIR']):
-            if not filename.endswith(tuple(current_app.config['ALLOWED_EXTENSIONS'])):
-                continue
-            
-            file_path = os.path.join(current_app.config['SCRAPED_DATA_DIR'], filename)
-            try:
-                stats = os.stat(file_path)
-                files.append({
-                    'name': filename,
-                    'type': 'Excel' if filename.endswith('.xlsx') else 'Text',
-                    'size': stats.st_size,
-                    'created': datetime.fromtimestamp(stats.st_ctime).strftime('%Y-%m-%d %H:%M:%S'),
-                    'modified': datetime.fromtimestamp(stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                })
-            except Exception as e:
-                logger.error(f"Error getting stats for {filename}: {str(e)}")
-                continue
-        
-        # Sort by modified date, newest first
-        files.sort(key=lambda x: x['modified'], reverse=True)
-        return files
+        return get_file_index().list(
+            page=page, per_page=per_page, job_id=job_id, file_type=file_type, kind=kind,
+            sort=sort, descending=descending
+        )
     except Exception as e:
         logger.error(f"Error listing files: {str(e)}")
-        return []
+        return [], 0
 
 def delete_file(filename):
     """Delete a file"""
@@ -80,6 +74,7 @@ def delete_file(filename):
             return False, "File not found"
         
         os.remove(file_path)
+        get_file_index().remove(os.path.basename(file_path))
         logger.info(f"Deleted file: {filename}")
         return True, f"File {filename} deleted successfully"
     except Exception as e:
@@ -89,26 +84,22 @@ def delete_file(filename):
 def cleanup_old_files():
     """Remove files older than specified days"""
     try:
-        current_time = datetime.now()
-        max_age = current_app.config['MAX_FILE_AGE_DAYS']
+        index = get_file_index()
+        cutoff = datetime.now().timestamp() - current_app.config['MAX_FILE_AGE_DAYS'] * 86400
         deleted_count = 0
         
-        for filename in os.listdir(current_app.config['SCRAPED_DATA_DIR']):
+        for filename in index.older_than(cutoff):
             file_path = os.path.join(current_app.config['SCRAPED_DATA_DIR'], filename)
-            if not os.path.isfile(file_path):
-                continue
-            
-            file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-            age_days = (current_time - file_time).days
-            
-            if age_days > max_age:
-                try:
+            try:
+                if os.path.isfile(file_path):
                     os.remove(file_path)
                     deleted_count += 1
                     logger.info(f"Removed old file: {filename}")
-                except Exception as e:
-                    logger.error(f"Error removing old file {filename}: {str(e)}")
+                index.remove(filename)
+            except Exception as e:
+                logger.error(f"Error removing old file {filename}: {str(e)}")
         
+        prune_profiles(cutoff)
         return deleted_count
     except Exception as e:
         logger.error(f"Error during cleanup: {str(e)}")
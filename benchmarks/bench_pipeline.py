@@ -0,0 +1,181 @@
+"""End-to-end throughput benchmark: scrape -> checkpoint -> export, against mock_instagram.py.
+
+Starts the mock server in a subprocess, runs one job through main.process_scraping
+in a scratch directory and reports profiles/s, per-profile latency, peak RSS and
+bytes written. seconds includes waiting for the export workers to finish the
+files; scrape_seconds is when process_scraping returned.
+
+    python benchmarks/bench_pipeline.py --profiles 1000 --sessions 2 --concurrency 8
+    python benchmarks/bench_pipeline.py --latency-ms 150 --rate-429 0.05 --rpm 120 --json
+    python benchmarks/bench_pipeline.py --profile --keep   # flame graph input in the report's profile file
+
+Per-profile latency is the time spent inside scrape_profile (network + parsing,
+including retries on the same session); stages is the job's own breakdown, as
+returned by /jobs/<job_id>, including the waits for a session's rate budget.
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from mock_instagram import add_arguments
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def start_mock(args):
+    """Run the mock server in its own process so its memory stays out of the RSS figure"""
+    cmd = [
+        sys.executable, os.path.join(ROOT, 'benchmarks', 'mock_instagram.py'), '--port', '0',
+        '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+        '--rate-429', str(args.rate_429), '--retry-after', str(args.retry_after),
+        '--login-redirect-rate', str(args.login_redirect_rate),
+        '--payload-kb', str(args.payload_kb), '--seed', str(args.seed)
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    base_url = process.stdout.readline().strip()
+    if not base_url:
+        process.kill()
+        raise RuntimeError('mock server did not start')
+    return process, base_url
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+def timed(scrape_profile, latencies):
+    def wrapper(username):
+        started = time.perf_counter()
+        try:
+            return scrape_profile(username)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    return wrapper
+
+def profile_report(job_id):
+    from app.profiler import profile_files, read_profile
+    folded = read_profile(job_id)
+    if folded is None:
+        return None
+    lines = folded.splitlines()
+    return {
+        'files': profile_files(job_id),
+        'stacks': len(lines),
+        'samples': sum(int(line.rsplit(' ', 1)[1]) for line in lines)
+    }
+
+def run(args, base_url, workdir):
+    # Config reads these at import time
+    os.environ['INSTAGRAM_BASE_URL'] = base_url
+    os.environ['STATE_DIR'] = os.path.join(workdir, 'instance')
+    os.environ['RESULTS_DIR'] = os.path.join(workdir, 'results')
+    os.environ['SCRAPE_CONCURRENCY'] = str(args.concurrency)
+    os.environ['SESSION_REQUESTS_PER_MINUTE'] = str(args.rpm)
+    os.environ['SESSION_MAX_REQUESTS_PER_MINUTE'] = str(args.rpm)
+    os.chdir(workdir)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        import main
+
+        latencies = []
+        for i in range(args.sessions):
+            scraper = main.InstagramScraper()
+            scraper.set_instagram_session(f'{1000 + i}:bench:{i}')
+            scraper.scrape_profile = timed(scraper.scrape_profile, latencies)
+            main.session_pool.add_scraper(scraper, key=f'bench-{i}')
+
+        usernames = [f'bench_user_{i:06d}' for i in range(args.profiles)]
+        job_id = main.job_store.create(usernames, {'refresh': True, 'profile': args.profile})
+        main.job_store.claim(job_id)
+
+        started = time.perf_counter()
+        main.process_scraping(job_id)
+        scrape_elapsed = time.perf_counter() - started
+        # process_scraping hands the files to the export workers; wait for them
+        main.export_stage.shutdown(wait=True)
+        elapsed = time.perf_counter() - started
+
+    progress = main.job_store.progress(job_id)
+    return {
+        'profiles': args.profiles,
+        'sessions': args.sessions,
+        'concurrency': args.concurrency,
+        'requests_per_minute': args.rpm,
+        'status': progress['status'],
+        'processed': progress['processed'],
+        'done': progress['done'],
+        'failed': progress['failed'],
+        'rate_limited': progress['rate_limited'],
+        'pending': progress['pending'],
+        'seconds': round(elapsed, 3),
+        'scrape_seconds': round(scrape_elapsed, 3),
+        # Profiles the job actually got through; a paused job leaves the rest pending
+        'profiles_per_second': round(progress['processed'] / elapsed, 2) if elapsed else 0.0,
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'fetch_calls': len(latencies),
+        # ru_maxrss is in KiB on Linux; export workers are counted separately
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'export_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'bytes_written': {
+            'scraped_data': directory_size(os.path.join(workdir, 'scraped_data')),
+            'results': directory_size(os.path.join(workdir, 'results')),
+            'state': directory_size(os.path.join(workdir, 'instance'))
+        },
+        'stages': main.job_store.get(job_id)['stages'],
+        'profile': profile_report(job_id)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', type=int, default=500)
+    parser.add_argument('--sessions', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=4, help='SCRAPE_CONCURRENCY')
+    parser.add_argument('--rpm', type=int, default=600000,
+                        help='per-session requests/minute; the default effectively disables pacing')
+    parser.add_argument('--profile', action='store_true', help='run the job with the sampling profiler on')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    process, base_url = start_mock(args)
+    workdir = tempfile.mkdtemp(prefix='ig-bench-')
+    try:
+        report = run(args, base_url, workdir)
+    finally:
+        process.terminate()
+        process.wait()
+        if not args.keep:
+            import shutil
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f'{key:>22}: {value}')
+        if args.keep:
+            print(f'{"workdir":>22}: {workdir}')
+    return 0 if report['status'] == 'completed' else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Microbenchmark of RateLimiter.check with the in-process backend.
+
+Reports microseconds per check as the number of requests per key inside the
+window grows (the old timestamp-list limiter, kept here for reference,
+copies that list on every check) and as the number of distinct clients
+grows, plus the counters left in memory and multi-threaded throughput.
+
+    python benchmarks/bench_rate_limiter.py
+    python benchmarks/bench_rate_limiter.py --checks 200000 --threads 8 --json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.rate_limiter import MemoryWindowBackend, RateLimiter
+
+class ListRateLimiter:
+    """The timestamp-list limiter RateLimiter replaced"""
+    def __init__(self, max_requests, window):
+        self.max_requests = max_requests
+        self.window = window
+        self.requests = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def check(self, key):
+        with self.lock:
+            now = time.time()
+            self.requests[key] = [t for t in self.requests[key] if now - t < self.window]
+            if len(self.requests[key]) >= self.max_requests:
+                return False, 0, 0
+            self.requests[key].append(now)
+            return True, self.max_requests - len(self.requests[key]), 0
+
+def per_check_us(limiter, keys, checks):
+    started = time.perf_counter()
+    for i in range(checks):
+        limiter.check(keys[i % len(keys)])
+    return round((time.perf_counter() - started) / checks * 1e6, 3)
+
+def threaded_checks_per_second(limiter, threads, checks):
+    def work(n):
+        keys = [f'10.{n}.{i // 256 % 256}.{i % 256}' for i in range(1000)]
+        for i in range(checks):
+            limiter.check(keys[i % len(keys)])
+    workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return round(threads * checks / (time.perf_counter() - started))
+
+def run(args):
+    report = {'history': {}, 'clients': {}}
+
+    # One client with a growing number of requests already in the window
+    for history in (100, 1000, 10000):
+        row = {}
+        for name, limiter in (
+            ('sliding_window', RateLimiter(10 ** 9, 3600, backend=MemoryWindowBackend())),
+            ('timestamp_list', ListRateLimiter(10 ** 9, 3600))
+        ):
+            for _ in range(history):
+                limiter.check('client')
+            row[name] = per_check_us(limiter, ['client'], min(args.checks, 20000))
+        report['history'][history] = row
+
+    # Many distinct clients, each seen a few times
+    for clients in (1000, 100000, 1000000):
+        backend = MemoryWindowBackend(max_keys=args.max_keys)
+        limiter = RateLimiter(100, 3600, backend=backend)
+        keys = [f'client-{i}' for i in range(clients)]
+        report['clients'][clients] = {
+            'us_per_check': per_check_us(limiter, keys, max(args.checks, clients)),
+            'counters_kept': len(backend)
+        }
+
+    for stripes in (1, 64):
+        limiter = RateLimiter(10 ** 9, 3600, backend=MemoryWindowBackend(stripes=stripes))
+        report[f'threads_{args.threads}_stripes_{stripes}_checks_per_second'] = \
+            threaded_checks_per_second(limiter, args.threads, args.checks // args.threads)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checks', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--max-keys', type=int, default=100000, help='RATE_LIMIT_MAX_KEYS')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f'{key:>22}: {value}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Re-segmentation benchmark: segment rules over stored results, without scraping.
+
+Writes --profiles synthetic results to a scratch Parquet store, then times the
+vectorized pass (query_results + count_segments, what GET /segments does) and
+the per-record path used when pyarrow is missing (count_records).
+
+    python benchmarks/bench_segments.py --profiles 100000
+    python benchmarks/bench_segments.py --profiles 100000 --segments my_rules.json --json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# A few rules of each kind on top of the defaults
+EXAMPLE_SEGMENTS = [
+    {'name': 'micro_influencers', 'where': {'followers': {'min': 10000, 'max': 100000}, 'is_private': False}},
+    {'name': 'verified', 'where': {'is_verified': True}},
+    {'name': 'private_accounts', 'where': {'is_private': True}},
+    {'name': 'coaches', 'where': {'biography': {'contains_any': ['coach', 'trainer', 'fitness']}}},
+    {'name': 'unknown_posts', 'where': {'posts_count': None}}
+]
+
+BIO_WORDS = ['travel', 'food', 'Fitness', 'coach', 'art', 'music', 'photography', 'dad', 'founder', 'trainer']
+
+def synthetic_results(count, seed):
+    from app.profile_record import ProfileRecord
+    rng = random.Random(seed)
+    for i in range(count):
+        if rng.random() < 0.05:
+            yield {'username': f'user_{i}', 'error': 'Profile not found', 'scraping_status': 'not_found'}
+            continue
+        yield ProfileRecord(
+            username=f'user_{i}',
+            full_name=f'User {i}',
+            biography=' '.join(rng.sample(BIO_WORDS, 3)),
+            followers=int(rng.lognormvariate(7, 2)),
+            following=rng.randint(0, 5000),
+            posts_count=None if rng.random() < 0.02 else rng.randint(0, 500),
+            is_verified=rng.random() < 0.01,
+            is_private=rng.random() < 0.3,
+            scraped_at='2024-01-01 00:00:00'
+        )
+
+def run(args, workdir):
+    # Config reads these at import time
+    os.environ['RESULTS_DIR'] = os.path.join(workdir, 'results')
+    segments_file = args.segments
+    if segments_file is None:
+        segments_file = os.path.join(workdir, 'segments.json')
+        with open(segments_file, 'w') as f:
+            json.dump(EXAMPLE_SEGMENTS, f)
+    os.environ['SEGMENTS_FILE'] = segments_file
+
+    from app.result_store import ParquetResultWriter, query_results
+    from app.segments import SEGMENT_COLUMNS, configured_segments, count_records, count_segments
+
+    results = list(synthetic_results(args.profiles, args.seed))
+    writer = ParquetResultWriter('bench', '20240101_000000')
+    for i, result in enumerate(results):
+        writer.add(i, result.get('username'), result)
+    writer.close()
+
+    started = time.perf_counter()
+    table = query_results(columns=SEGMENT_COLUMNS)
+    read_elapsed = time.perf_counter() - started
+    vectorized = count_segments(table)
+    vectorized_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    per_record = count_records(results)
+    per_record_elapsed = time.perf_counter() - started
+
+    return {
+        'profiles': args.profiles,
+        'segments': len(configured_segments),
+        'read_seconds': round(read_elapsed, 3),
+        'vectorized_seconds': round(vectorized_elapsed, 3),
+        'per_record_seconds': round(per_record_elapsed, 3),
+        'counts_match': vectorized == per_record,
+        'counts': vectorized
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', type=int, default=100000)
+    parser.add_argument('--segments', help='SEGMENTS_FILE to use instead of the example rules')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ig-bench-')
+    try:
+        report = run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print(f'{key:>22}: {value}')
+    return 0 if report['counts_match'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""Local stand-in for the parts of instagram.com the scraper talks to.
+
+Serves /, /<username>/ (profile HTML with window._sharedData) and
+/api/v1/users/web_profile_info/?username=..., with configurable latency,
+429 injection, login redirects and payload size.
+
+    python benchmarks/mock_instagram.py --port 8800 --latency-ms 80 --rate-429 0.02
+
+Point the scraper at it with INSTAGRAM_BASE_URL=http://127.0.0.1:8800.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from urllib.parse import urlparse, parse_qs
+
+LOGIN_PATH = '/accounts/login/'
+
+class MockSettings:
+    def __init__(self, latency_ms=50, jitter_ms=10, rate_429=0.0, retry_after=1,
+                 login_redirect_rate=0.0, payload_kb=4, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.login_redirect_rate = login_redirect_rate
+        self.payload_kb = payload_kb
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.requests = 0
+
+    def roll(self):
+        """One random draw per request; shared RNG so runs with the same seed inject the same faults"""
+        with self.lock:
+            self.requests += 1
+            return self.random.random(), self.random.uniform(-1, 1)
+
+def build_user(username, payload_kb):
+    """Deterministic profile for username, padded to roughly payload_kb of biography"""
+    seed = zlib.crc32(username.encode())
+    rng = random.Random(seed)
+    posts = rng.choice([0, rng.randint(1, 5), rng.randint(6, 2000)])
+    return {
+        'id': str(seed),
+        'username': username,
+        'full_name': f'Bench {username.title()}',
+        'biography': ('lorem ipsum ' * (payload_kb * 1024 // 12 + 1))[:payload_kb * 1024],
+        'external_url': f'https://example.com/{username}',
+        'is_private': rng.random() < 0.2,
+        'is_verified': rng.random() < 0.05,
+        'profile_pic_url': f'https://cdn.example.com/{username}.jpg',
+        'profile_pic_url_hd': f'https://cdn.example.com/{username}_hd.jpg',
+        'edge_followed_by': {'count': rng.randint(0, 5_000_000)},
+        'edge_follow': {'count': rng.randint(0, 7500)},
+        'edge_owner_to_timeline_media': {'count': posts, 'edges': []}
+    }
+
+def profile_page(user):
+    # Like the real page, config.viewer (the logged-in account) precedes the profile, which is
+    # what makes instascrape's flattened keys come out as user_full_name, user_username, ...
+    viewer = {'full_name': 'Bench Viewer', 'username': 'bench_viewer',
+              'profile_pic_url': '', 'profile_pic_url_hd': ''}
+    shared = {
+        'config': {'csrf_token': 'bench', 'viewer': viewer},
+        'entry_data': {'ProfilePage': [{'graphql': {'user': user}}]}
+    }
+    return (
+        '<!DOCTYPE html><html><head><title>Instagram</title></head><body>'
+        f'<script type="text/javascript">window._sharedData = {json.dumps(shared)};</script>'
+        '</body></html>'
+    )
+
+def login_page():
+    shared = {'config': {'csrf_token': 'bench'}, 'entry_data': {'LoginAndSignupPage': [{}]}}
+    return f'<!DOCTYPE html><html><script>window._sharedData = {json.dumps(shared)};</script></html>'
+
+def make_handler(settings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, like the real site
+        # Headers and body go out as separate writes; without TCP_NODELAY, Nagle plus the
+        # client's delayed ACK would add ~40 ms to every response
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == LOGIN_PATH:
+                return self.send(200, login_page(), 'text/html')
+
+            chance, jitter = settings.roll()
+            delay = settings.latency_ms + jitter * settings.jitter_ms
+            if delay > 0:
+                time.sleep(delay / 1000.0)
+
+            if url.path == '/':
+                return self.send(200, '<!DOCTYPE html><html><body>home</body></html>', 'text/html')
+
+            if chance < settings.rate_429:
+                return self.send(429, '{"message": "Please wait a few minutes before you try again."}',
+                                 'application/json', {'Retry-After': str(settings.retry_after)})
+            if chance < settings.rate_429 + settings.login_redirect_rate:
+                return self.send(302, '', 'text/html', {'Location': f'{LOGIN_PATH}?next={url.path}'})
+
+            if url.path == '/api/v1/users/web_profile_info/':
+                username = parse_qs(url.query).get('username', [''])[0]
+                if not username:
+                    return self.send(400, '{"status": "fail"}', 'application/json')
+                body = json.dumps({'data': {'user': build_user(username, settings.payload_kb)}, 'status': 'ok'})
+                return self.send(200, body, 'application/json')
+
+            parts = url.path.strip('/').split('/')
+            if len(parts) == 1 and parts[0]:
+                return self.send(200, profile_page(build_user(parts[0], settings.payload_kb)), 'text/html')
+
+            return self.send(404, '<!DOCTYPE html><html><body>Not found</body></html>', 'text/html')
+
+        def send(self, status, body, content_type, headers=None):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+def serve(settings, host='127.0.0.1', port=0):
+    """Start the server; returns it bound and ready (call serve_forever on it)"""
+    server = ThreadingHTTPServer((host, port), make_handler(settings))
+    server.daemon_threads = True
+    return server
+
+def add_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=50, help='mean response latency')
+    parser.add_argument('--jitter-ms', type=float, default=10, help='+/- uniform latency jitter')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--login-redirect-rate', type=float, default=0.0,
+                        help='fraction of requests redirected to the login page')
+    parser.add_argument('--payload-kb', type=int, default=4, help='biography padding per profile')
+    parser.add_argument('--seed', type=int, default=0)
+
+def settings_from_args(args):
+    return MockSettings(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429,
+        retry_after=args.retry_after,
+        login_redirect_rate=args.login_redirect_rate,
+        payload_kb=args.payload_kb,
+        seed=args.seed
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800, help='0 picks a free port')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(settings_from_args(args), args.host, args.port)
+    # The first line is read by bench_pipeline.py to find the port
+    print(f'http://{server.server_address[0]}:{server.server_address[1]}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,14 +12,60 @@ class Config:
     # Instagram scraping settings
     MAX_RETRIES = 3
     RETRY_DELAY = 5
-    REQUEST_TIMEOUT = 30
+    REQUEST_TIMEOUT = 30  # read timeout per request
+    CONNECT_TIMEOUT = 5
     RATE_LIMIT_REQUESTS = 50  # requests per hour
     RATE_LIMIT_WINDOW = 3600  # 1 hour in seconds
+    # Where RateLimiter keeps its counters: redis://... to share limits across workers and nodes
+    RATE_LIMIT_STORAGE_URL = os.environ.get('RATE_LIMIT_STORAGE_URL', 'memory://')
+    RATE_LIMIT_STRIPES = 64  # independently locked shards of the in-process counters
+    RATE_LIMIT_MAX_KEYS = 100000  # in-process counters kept at most; least recently used go first
+    INSTAGRAM_BASE_URL = os.environ.get('INSTAGRAM_BASE_URL', 'https://www.instagram.com')
+    
+    # Fetch engine
+    SCRAPE_CONCURRENCY = int(os.environ.get('SCRAPE_CONCURRENCY', 4))
+    SESSION_REQUESTS_PER_MINUTE = int(os.environ.get('SESSION_REQUESTS_PER_MINUTE', 20))  # starting rate
+    SESSION_BURST = 3  # requests a session may fire back-to-back
+    SESSION_COOLDOWN = 60  # seconds a throttled session pauses when no Retry-After is sent
+    
+    # HTTP transport of each scraper session: 'requests' or 'http2' (needs httpx[http2])
+    HTTP_TRANSPORT = os.environ.get('HTTP_TRANSPORT', 'requests')
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 0))  # keep-alive connections per session; 0 = SCRAPE_CONCURRENCY
+    
+    # Profile fetch strategies: 'json-first', 'html-first' or 'adaptive' (cheapest working one first)
+    FETCH_STRATEGY = os.environ.get('FETCH_STRATEGY', 'adaptive')
+    FETCH_STRATEGY_PROBE_EVERY = 50  # adaptive: fetches between re-tries of the last-ranked strategy
+    
+    # Adaptive (AIMD) pacing per session, in requests per minute
+    SESSION_MIN_REQUESTS_PER_MINUTE = 2
+    SESSION_MAX_REQUESTS_PER_MINUTE = int(os.environ.get('SESSION_MAX_REQUESTS_PER_MINUTE', 60))
+    SESSION_RATE_INCREASE = 0.5  # added after every clean response
+    SESSION_RATE_DECREASE = 0.5  # multiplier after a 429 or login redirect
     
     # File management
     SCRAPED_DATA_DIR = 'scraped_data'
     MAX_FILE_AGE_DAYS = 7
     MAX_FILES_PER_USER = 100
+    FILES_PAGE_SIZE = 100  # default page size of the file listing
+    FILES_MAX_PAGE_SIZE = 500
+    
+    # Export stage: TXT/XLSX/Parquet rendering in worker processes (0 = inline in the scraping thread)
+    EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 1))
+    EXPORT_CHUNK_SIZE = 25  # results per message to the export worker
+    EXPORT_IDLE_TIMEOUT = 3600  # seconds without results before an export worker finalizes the job
+    
+    # TXT/XLSX files rendered from the job store on first download instead of written for every batch
+    LAZY_EXPORTS = os.environ.get('LAZY_EXPORTS', '1') != '0'
+    RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 1))  # processes rendering downloads (0 = inline)
+    
+    # Extra segment rules (JSON list, see app/segments.py); each segment gets its own TXT/XLSX pair
+    SEGMENTS_FILE = os.environ.get('SEGMENTS_FILE')
+    
+    # Columnar result store (Parquet, needs pyarrow), partitioned by scrape date
+    ENABLE_PARQUET_EXPORT = os.environ.get('ENABLE_PARQUET_EXPORT', '1') != '0'
+    RESULTS_DIR = os.environ.get('RESULTS_DIR', 'results')
+    RESULTS_ROW_GROUP_SIZE = 5000
     
     # Security
     ALLOWED_EXTENSIONS = {'.txt', '.xlsx'}
@@ -34,14 +80,42 @@ class Config:
     API_RATE_LIMIT = 100  # requests per hour
     API_TIMEOUT = 30  # seconds
     
+    # Celery fan-out: a job's pending usernames are scraped as chunks of this many, one task each,
+    # so a chunk finishes well inside the task time limit however large the batch
+    CELERY_CHUNK_SIZE = int(os.environ.get('CELERY_CHUNK_SIZE', 100))
+    # Comma-separated sessionids for the Celery workers; each chunk is pinned to one of them
+    INSTAGRAM_SESSION_IDS = [s.strip() for s in os.environ.get('INSTAGRAM_SESSION_IDS', '').split(',') if s.strip()]
+    
     # Cache settings
     CACHE_TYPE = 'simple'
     CACHE_DEFAULT_TIMEOUT = 300  # 5 minutes
     
+    # Local state shared by the web app and Celery workers (kept out of scraped_data cleanup)
+    STATE_DIR = os.environ.get('STATE_DIR', 'instance')
+    PROFILE_CACHE_PATH = os.path.join(STATE_DIR, 'profile_cache.sqlite3')
+    PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 6 * 3600))
+    PROFILE_CACHE_MAX_ENTRIES = 50000
+    JOB_STORE_PATH = os.path.join(STATE_DIR, 'jobs.sqlite3')
+    JOB_HEARTBEAT_INTERVAL = 30  # seconds between liveness updates of a running job
+    JOB_STALE_AFTER = 120  # a running job without a heartbeat this long may be resumed elsewhere
+    FILE_INDEX_PATH = os.path.join(STATE_DIR, 'files.sqlite3')
+    
+    # Job progress streaming (Server-Sent Events)
+    JOB_THROUGHPUT_WINDOW = 60  # seconds of recent checkpoints used for throughput and ETA
+    JOB_EVENTS_TIMEOUT = 5  # max seconds between progress events
+    JOB_EVENTS_MIN_INTERVAL = 0.5  # min seconds between progress events
+    
     # Monitoring
     ENABLE_METRICS = True
     METRICS_PORT = 9090
     
+    # Sampling profiler of job runs ({"profile": true} on /scrape, or this fraction of all jobs);
+    # folded stacks for flame graphs, served at /jobs/<job_id>/profile
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_INTERVAL = 0.01  # seconds between stack samples
+    PROFILE_MAX_DEPTH = 64  # innermost frames kept per sample
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(SCRAPED_DATA_DIR, 'profiles'))
+    
     @staticmethod
     def init_app(app):
         # Create necessary directories
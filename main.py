@@ -1,30 +1,59 @@
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, send_file, session, redirect, url_for
 from instascrape import Profile, Post
+from bs4 import BeautifulSoup
 import os
 import json
 from datetime import datetime
 import threading
 import time
-import requests
 from urllib.parse import urlparse
 import re
-import pandas as pd
 import io
+import shutil
+from config import Config
+from app.fetch_engine import FetchEngine
+from app.session_pool import SessionPool
+from app.export_stage import export_stage
+from app.render_cache import RenderCache
+from app.result_store import QUERY_ERRORS, query_results
+from app.segments import SEGMENT_COLUMNS, configured_segments, count_records, count_segments
+from app.profile_cache import ProfileCache
+from app.dedup import normalize_usernames
+from app.jobs import JobStore, run_job, progress_events
+from app.scraper import throttle_result, not_found_result
+from app.fetch_strategy import strategy_router
+from app.profile_record import ProfileRecord, decode_web_profile_info, to_int, to_str
+from app.transport import create_session, cookie_domain
+from app.tracing import NETWORK, PARSE, RETRY_BACKOFF, stage
+from app.profiler import prune_profiles, read_profile, wants_profile
+from app.utils.file_index import FileIndex
+from utils.metrics import init_metrics
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_change_this_in_production'
 
+# Request counts/latency by route and the /metrics endpoint
+if Config.ENABLE_METRICS:
+    init_metrics(app)
+
 # Create directories for storing data
 os.makedirs('scraped_data', exist_ok=True)
 os.makedirs('templates', exist_ok=True)
 
 class InstagramScraper:
-    def __init__(self):
+    def __init__(self, base_url=None, strategies=None):
         # Instagram session cookies and headers
-        self.session = requests.Session()
+        self.base_url = (base_url or Config.INSTAGRAM_BASE_URL).rstrip('/')
+        # Keep-alive pool sized for the fetch concurrency, with connect/read timeouts
+        self.session = create_session()
+        self.cookie_domain = cookie_domain(self.base_url)
         self.authenticated = False
         self.session_id = None
         self.csrf_token = None
+        # Only read by instascrape to pick its field mapping; the request itself uses the cookie jar
+        self.parse_headers = None
+        # JSON API / profile HTML routing, shared by default so sessions learn from each other
+        self.strategies = strategies or strategy_router
         
         # Basic headers to mimic a real browser
         self.session.headers.update({
@@ -48,24 +77,24 @@ class InstagramScraper:
             self.session.cookies.clear()
             
             # Set the sessionid cookie - use original format
-            self.session.cookies.set('sessionid', sessionid, domain='.instagram.com', path='/')
+            self.session.cookies.set('sessionid', sessionid, domain=self.cookie_domain, path='/')
             
             # Set CSRF token if provided
             if csrf_token:
-                self.session.cookies.set('csrftoken', csrf_token, domain='.instagram.com', path='/')
+                self.session.cookies.set('csrftoken', csrf_token, domain=self.cookie_domain, path='/')
                 self.session.headers.update({'X-CSRFToken': csrf_token})
             else:
                 # Set a basic CSRF token
-                self.session.cookies.set('csrftoken', 'GeBa58zESybAaWM8YDzOF5', domain='.instagram.com', path='/')
+                self.session.cookies.set('csrftoken', 'GeBa58zESybAaWM8YDzOF5', domain=self.cookie_domain, path='/')
             
             # Add essential Instagram cookies
-            self.session.cookies.set('mid', 'aDSa3AALAAGieULhLm97NP5dqp_Z', domain='.instagram.com', path='/')
-            self.session.cookies.set('ig_did', '3B433670-1F70-4284-AAE8-6C2843AD70FA', domain='.instagram.com', path='/')
-            self.session.cookies.set('ig_nrcb', '1', domain='.instagram.com', path='/')
-            self.session.cookies.set('datr', '3Jo0aG_zLBi8BQ1nckRuwUuI', domain='.instagram.com', path='/')
-            self.session.cookies.set('rur', 'CLN', domain='.instagram.com', path='/')
-            self.session.cookies.set('ps_l', '1', domain='.instagram.com', path='/')
-            self.session.cookies.set('ps_n', '1', domain='.instagram.com', path='/')
+            self.session.cookies.set('mid', 'aDSa3AALAAGieULhLm97NP5dqp_Z', domain=self.cookie_domain, path='/')
+            self.session.cookies.set('ig_did', '3B433670-1F70-4284-AAE8-6C2843AD70FA', domain=self.cookie_domain, path='/')
+            self.session.cookies.set('ig_nrcb', '1', domain=self.cookie_domain, path='/')
+            self.session.cookies.set('datr', '3Jo0aG_zLBi8BQ1nckRuwUuI', domain=self.cookie_domain, path='/')
+            self.session.cookies.set('rur', 'CLN', domain=self.cookie_domain, path='/')
+            self.session.cookies.set('ps_l', '1', domain=self.cookie_domain, path='/')
+            self.session.cookies.set('ps_n', '1', domain=self.cookie_domain, path='/')
             
             # Extract user ID from sessionid for ds_user_id
             try:
@@ -76,7 +105,7 @@ class InstagramScraper:
                     user_id = decoded_sessionid.split(':')[0]
                 else:
                     user_id = sessionid.split(':')[0]
-                self.session.cookies.set('ds_user_id', user_id, domain='.instagram.com', path='/')
+                self.session.cookies.set('ds_user_id', user_id, domain=self.cookie_domain, path='/')
                 print(f"Set ds_user_id to: {user_id}")
             except:
                 print("Could not extract user ID from sessionid")
@@ -97,6 +126,7 @@ class InstagramScraper:
                 'Referer': 'https://www.instagram.com/',
             })
             
+            self.parse_headers = {'cookie': f'sessionid={sessionid}'}
             self.authenticated = True
             print(f"Session setup complete with {len(self.session.cookies)} cookies")
             return True
@@ -111,7 +141,7 @@ class InstagramScraper:
                 return False
             
             # Test authentication by trying to access Instagram's main page first
-            test_url = 'https://www.instagram.com/'
+            test_url = f'{self.base_url}/'
             response = self.session.get(test_url, allow_redirects=False)
             
             # Check if we're redirected to login (indicates invalid session)
@@ -125,7 +155,7 @@ class InstagramScraper:
             # If we get 200 or other success codes, try a simple API call
             if response.status_code in [200, 302]:
                 # Try to access a simple endpoint
-                api_url = 'https://www.instagram.com/api/v1/users/web_profile_info/?username=instagram'
+                api_url = f'{self.base_url}/api/v1/users/web_profile_info/?username=instagram'
                 api_response = self.session.get(api_url)
                 
                 if api_response.status_code == 200:
@@ -150,7 +180,8 @@ class InstagramScraper:
             self.authenticated = False
             return False
     
-    def clean_username(self, username):
+    @staticmethod
+    def clean_username(username):
         """Clean and validate username"""
         # Remove @ symbol if present
         username = username.strip().lstrip('@')
@@ -186,71 +217,25 @@ class InstagramScraper:
             if not clean_user or len(clean_user) < 1:
                 return {'error': f'Invalid username: {username}'}
             
-            # Create profile URL
-            profile_url = f'https://www.instagram.com/{clean_user}/'
-            
-            # Try to create and scrape profile with retry logic
+            # Try to scrape the profile with retry logic
             max_retries = 3
             retry_delay = 5
+            error_msg = 'no fetch strategy returned profile data'
             
             for attempt in range(max_retries):
                 try:
-                    # Create profile with proper session handling
-                    profile = Profile(profile_url)
-                    
-                    # Properly inject our authenticated session into the profile
-                    profile._session = self.session
-                    
-                    # Create headers with cookies for instascrape
-                    scrape_headers = self.session.headers.copy()
-                    
-                    # Get cookies as a string for the Cookie header
-                    cookie_string = '; '.join([f'{cookie.name}={cookie.value}' for cookie in self.session.cookies])
-                    scrape_headers['Cookie'] = cookie_string
-                    
-                    # Scrape the profile data with proper headers and session
-                    profile.scrape(headers=scrape_headers, session=self.session)
-                    
-                    # Extract basic profile information
-                    profile_data = {
-                        'username': clean_user,
-                        'profile_url': profile_url,
-                        'full_name': getattr(profile, 'full_name', 'N/A'),
-                        'biography': getattr(profile, 'biography', 'N/A'),
-                        'followers': getattr(profile, 'followers', 'N/A'),
-                        'following': getattr(profile, 'following', 'N/A'),
-                        'posts_count': getattr(profile, 'posts', 'N/A'),
-                        'is_verified': getattr(profile, 'is_verified', False),
-                        'is_private': getattr(profile, 'is_private', False),
-                        'external_url': getattr(profile, 'external_url', 'N/A'),
-                        'profile_pic_url': getattr(profile, 'profile_pic_url', 'N/A'),
-                        'scraped_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'scraping_status': 'success',
-                        'authenticated': True,
-                        'method': 'insta-scrape'
-                    }
-                    
-                    # Try to get basic post count information
-                    try:
-                        # Attempt to get recent posts if available and profile is public
-                        if not profile_data.get('is_private', True):
-                            posts_data = self.get_basic_posts_info(profile)
-                            profile_data['recent_posts'] = posts_data
-                        else:
-                            profile_data['recent_posts'] = []
-                            profile_data['note'] = 'Profile is private - limited data available'
-                    except Exception as posts_error:
-                        profile_data['recent_posts'] = []
-                        profile_data['posts_error'] = f'Could not retrieve posts: {str(posts_error)}'
-                    
-                    return profile_data
+                    # Cheapest working strategy first (JSON API or profile HTML), the other as backup
+                    result = self.strategies.fetch(self, clean_user)
+                    if result:
+                        return result
+                    print(f"Attempt {attempt + 1} failed for {clean_user}: {error_msg}")
                     
                 except Exception as e:
                     error_msg = str(e)
                     print(f"Attempt {attempt + 1} failed for {clean_user}: {error_msg}")
                     
                     # Check if it's an authentication error
-                    if 'unauthorized' in error_msg.lower() or '401' in error_msg or 'login' in error_msg.lower():
+                    if 'unauthorized' in error_msg.lower() or '401' in error_msg:
                         self.authenticated = False
                         return {
                             'error': f'Instagram authentication failed for {clean_user}. Please check your session credentials.',
@@ -258,34 +243,31 @@ class InstagramScraper:
                             'scraping_status': 'auth_failed'
                         }
                     
-                    # Check if it's a rate limit error
+                    # Rate limits and login redirects are reported straight back so the
+                    # session's adaptive pacing can back off and the engine can retry
                     if 'rate limit' in error_msg.lower() or '429' in error_msg:
-                        if attempt < max_retries - 1:
-                            print(f"Rate limited, waiting {retry_delay} seconds before retry...")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                            continue
-                        else:
-                            return {
-                                'error': f'Instagram rate limit reached for {clean_user}. Please try again later.',
-                                'username': clean_user,
-                                'scraping_status': 'rate_limited'
-                            }
+                        return {
+                            'error': f'Instagram rate limit reached for {clean_user}. Please try again later.',
+                            'username': clean_user,
+                            'scraping_status': 'rate_limited'
+                        }
                     
-                    # If it's the last attempt, try the fallback method
-                    if attempt == max_retries - 1:
-                        print(f"Trying fallback method for {clean_user}")
-                        fallback_result = self.scrape_profile_fallback(clean_user)
-                        if fallback_result and 'error' not in fallback_result:
-                            return fallback_result
-                        
+                    if 'login' in error_msg.lower():
                         return {
-                            'error': f'Failed to scrape {clean_user} after {max_retries} attempts: {error_msg}',
+                            'error': f'Instagram redirected to login while scraping {clean_user}.',
                             'username': clean_user,
-                            'scraping_status': 'failed'
+                            'scraping_status': 'login_redirect'
                         }
                     
-                    # Wait before retry
+                if attempt == max_retries - 1:
+                    return {
+                        'error': f'Failed to scrape {clean_user} after {max_retries} attempts: {error_msg}',
+                        'username': clean_user,
+                        'scraping_status': 'failed'
+                    }
+                
+                # Wait before retry
+                with stage(RETRY_BACKOFF, username=clean_user):
                     time.sleep(retry_delay)
             
         except Exception as e:
@@ -295,62 +277,92 @@ class InstagramScraper:
                 'scraping_status': 'error'
             }
     
-    def scrape_profile_fallback(self, username):
-        """Fallback method using Instagram's web API directly"""
-        try:
-            api_url = f'https://www.instagram.com/api/v1/users/web_profile_info/?username={username}'
-            
+    def scrape_profile_html(self, username):
+        """Profile page parsed by instascrape"""
+        profile_url = f'{self.base_url}/{username}/'
+        
+        # Fetch the page through our own session so base_url and throttle detection
+        # apply (instascrape rewrites non-https URLs to instagram.com); it only parses
+        with stage(NETWORK, strategy='html', username=username):
+            response = self.session.get(profile_url)
+        throttled = throttle_result(response, username)
+        if throttled:
+            if throttled['scraping_status'] == 'auth_failed':
+                self.authenticated = False
+            return throttled
+        if response.status_code == 404:
+            return not_found_result(username)
+        
+        with stage(PARSE, strategy='html', username=username):
+            profile = Profile(BeautifulSoup(response.text, 'html.parser'))
+            profile.scrape(headers=self.parse_headers)
+        
+        record = ProfileRecord(
+            username=username,
+            profile_url=profile_url,
+            full_name=to_str(getattr(profile, 'full_name', None)),
+            biography=to_str(getattr(profile, 'biography', None)),
+            followers=to_int(getattr(profile, 'followers', None)),
+            following=to_int(getattr(profile, 'following', None)),
+            posts_count=to_int(getattr(profile, 'posts', None)),
+            is_verified=bool(getattr(profile, 'is_verified', False)),
+            is_private=bool(getattr(profile, 'is_private', False)),
+            external_url=to_str(getattr(profile, 'external_url', None)),
+            profile_pic_url=to_str(getattr(profile, 'profile_pic_url', None)),
+            scraped_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            method='insta-scrape'
+        )
+        if record.is_private:
+            record.note = 'Profile is private - limited data available'
+        return record
+    
+    def scrape_profile_api(self, username):
+        """Profile from Instagram's web_profile_info JSON API"""
+        api_url = f'{self.base_url}/api/v1/users/web_profile_info/?username={username}'
+        
+        with stage(NETWORK, strategy='json', username=username):
             response = self.session.get(api_url)
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if 'data' in data and 'user' in data['data']:
-                    user_data = data['data']['user']
-                    
-                    return {
-                        'username': username,
-                        'profile_url': f'https://www.instagram.com/{username}/',
-                        'full_name': user_data.get('full_name', 'N/A'),
-                        'biography': user_data.get('biography', 'N/A'),
-                        'followers': user_data.get('edge_followed_by', {}).get('count', 'N/A'),
-                        'following': user_data.get('edge_follow', {}).get('count', 'N/A'),
-                        'posts_count': user_data.get('edge_owner_to_timeline_media', {}).get('count', 'N/A'),
-                        'is_verified': user_data.get('is_verified', False),
-                        'is_private': user_data.get('is_private', False),
-                        'external_url': user_data.get('external_url', 'N/A'),
-                        'profile_pic_url': user_data.get('profile_pic_url_hd', 'N/A'),
-                        'scraped_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'scraping_status': 'success',
-                        'authenticated': True,
-                        'method': 'api_fallback'
-                    }
-                else:
-                    print(f"No user data found in API response for {username}")
-                    return None
-            else:
-                print(f"API request failed with status {response.status_code}")
+        
+        throttled = throttle_result(response, username)
+        if throttled:
+            if throttled['scraping_status'] == 'auth_failed':
+                self.authenticated = False
+            return throttled
+        if response.status_code == 404:
+            return not_found_result(username)
+        
+        if response.status_code == 200:
+            # Decodes only the exported fields, skipping the timeline media in the payload
+            try:
+                with stage(PARSE, strategy='json', username=username):
+                    record = decode_web_profile_info(response.content, username)
+            except ValueError as e:
+                print(f"No user data found in API response for {username}: {e}")
                 return None
-                
-        except Exception as e:
-            print(f"Fallback scraping failed for {username}: {e}")
+            if record is None:
+                return not_found_result(username)
+            record.profile_url = f'{self.base_url}/{username}/'
+            record.method = 'web_profile_info'
+            return record
+        else:
+            print(f"API request failed with status {response.status_code}")
             return None
-    
-    def get_basic_posts_info(self, profile):
-        """Try to get basic post information"""
-        posts_data = []
-        try:
-            # This is a simplified approach since Instagram heavily restricts post data access
-            posts_data.append({
-                'note': 'Post details require Instagram authentication',
-                'suggestion': 'Use Instagram Business API for detailed post analytics'
-            })
-        except Exception as e:
-            print(f"Error getting posts info: {e}")
-        
-        return posts_data
 
-scraper = InstagramScraper()
+# Every logged-in sessionid gets its own scraper, cookie jar and request budget
+session_pool = SessionPool(InstagramScraper)
+
+# Recently scraped profiles, shared with the Celery workers through Config.PROFILE_CACHE_PATH
+profile_cache = ProfileCache()
+
+# Durable batch state so a restart resumes jobs instead of losing them
+job_store = JobStore()
+
+# Metadata of everything in scraped_data; the listing is served from here instead of the directory
+file_index = FileIndex(data_dir='scraped_data')
+file_index.sync()
+
+# TXT/XLSX files are rendered from the job store when first downloaded (LAZY_EXPORTS)
+render_cache = RenderCache(job_store, file_index, export_stage)
 
 @app.route('/')
 def index():
@@ -372,10 +384,13 @@ def login():
         print(f"Attempting login with sessionid length: {len(sessionid)}")
         print(f"CSRF token provided: {'Yes' if csrf_token else 'No'}")
         
-        # Set Instagram session
+        # Set Instagram session on a fresh scraper so running batches are not disturbed
+        scraper = InstagramScraper()
         if scraper.set_instagram_session(sessionid, csrf_token):
             print("Session cookies set successfully")
             if scraper.verify_authentication():
+                session_pool.add_scraper(scraper, sessionid)
+                resume_unfinished_jobs()
                 session['instagram_authenticated'] = True
                 session['instagram_sessionid'] = sessionid
                 if csrf_token:
@@ -395,229 +410,166 @@ def login():
 
 @app.route('/logout')
 def logout():
+    if session.get('instagram_sessionid'):
+        session_pool.remove(session['instagram_sessionid'])
     session.clear()
-    scraper.authenticated = False
-    scraper.session_id = None
-    scraper.csrf_token = None
     return redirect(url_for('index'))
 
 @app.route('/auth_status')
 def auth_status():
     is_authenticated = session.get('instagram_authenticated', False)
+    pooled = None
     if is_authenticated and session.get('instagram_sessionid'):
-        # Restore session if it exists
-        scraper.set_instagram_session(session.get('instagram_sessionid'))
+        # Restore session into the pool if it is missing (e.g. after a restart)
+        pooled = session_pool.get(session['instagram_sessionid'])
+        if pooled is None:
+            pooled = session_pool.add(
+                session['instagram_sessionid'], session.get('instagram_csrf'), verify=False
+            )
+            if pooled:
+                resume_unfinished_jobs()
     
     return jsonify({
         'authenticated': is_authenticated,
-        'scraper_authenticated': scraper.authenticated
+        'scraper_authenticated': bool(pooled and pooled.healthy),
+        'healthy_sessions': session_pool.healthy_count(),
+        'total_sessions': len(session_pool)
     })
 
 @app.route('/scrape', methods=['POST'])
 def scrape_usernames():
     # Check authentication first
-    if not session.get('instagram_authenticated') or not scraper.authenticated:
+    if not session.get('instagram_authenticated') or not session_pool.healthy_count():
         return jsonify({'error': 'Instagram authentication required. Please login first.'}), 401
     
     data = request.get_json()
     usernames = data.get('usernames', [])
+    refresh = bool(data.get('refresh', False))
+    profile = wants_profile(data.get('profile', False))
     
     if not usernames:
         return jsonify({'error': 'No usernames provided'}), 400
     
-    # Clean usernames
-    cleaned_usernames = []
-    for username in usernames:
-        clean_user = scraper.clean_username(username)
-        if clean_user:
-            cleaned_usernames.append(clean_user)
+    # Clean usernames and collapse near-duplicates ("@Foo", "foo", profile URLs)
+    cleaned_usernames, duplicates = normalize_usernames(usernames, InstagramScraper.clean_username)
     
     if not cleaned_usernames:
         return jsonify({'error': 'No valid usernames provided'}), 400
     
-    # Process usernames in background thread
-    thread = threading.Thread(target=process_scraping, args=(cleaned_usernames,))
-    thread.start()
+    # Record the batch durably, then process it in a background thread
+    job_id = job_store.create(cleaned_usernames, {'refresh': refresh, 'profile': profile})
+    start_job(job_id)
     
     return jsonify({
         'message': f'Started scraping {len(cleaned_usernames)} username(s)', 
         'status': 'processing',
-        'usernames': cleaned_usernames
+        'job_id': job_id,
+        'usernames': cleaned_usernames,
+        'duplicates_removed': duplicates
     })
 
-def process_scraping(usernames):
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events')
+def job_events_stream(job_id):
+    """Push job progress (done, failed, rate limited, throughput, ETA) as Server-Sent Events"""
+    if not job_store.get(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    return Response(
+        progress_events(job_store, job_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/jobs/<job_id>/profile')
+def job_profile(job_id):
+    """Sampled stacks of a profiled job as folded text, for flamegraph.pl or speedscope"""
+    if not job_store.get(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    folded = read_profile(job_id)
+    if folded is None:
+        return jsonify({'error': 'Job was not profiled'}), 404
+    return Response(folded, mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=profile_{job_id}.folded'})
+
+@app.route('/jobs/<job_id>/segments', methods=['POST'])
+def resegment_job(job_id):
+    """Regenerate a finished job's segment files under the current rules from its stored results"""
+    try:
+        counts = render_cache.resegment(job_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    if counts is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, 'segments': counts})
+
+@app.route('/segments')
+def list_segments():
+    """Segment rules, with profile counts over the stored results between ?start= and ?end= (YYYY-MM-DD)"""
+    segments = [segment.to_dict() for segment in configured_segments]
+    start, end = request.args.get('start'), request.args.get('end')
+    try:
+        table = query_results(start, end, columns=SEGMENT_COLUMNS)
+        counts, results = count_segments(table), table.num_rows
+    except QUERY_ERRORS as e:
+        # Without a readable Parquet store, count the checkpointed results one by one
+        print(f"Counting segments from the job store: {e}")
+        results = 0
+        def checkpointed():
+            nonlocal results
+            for result in job_store.results_between(start, end):
+                results += 1
+                yield result
+        counts = count_records(checkpointed())
+    for segment in segments:
+        segment['profiles'] = counts[segment['name']]
+    return jsonify({'segments': segments, 'results': results})
+
+def start_job(job_id):
+    """Run a job in a background thread unless another worker already owns it"""
+    if not job_store.claim(job_id):
+        return False
+    thread = threading.Thread(target=process_scraping, args=(job_id,), daemon=True)
+    thread.start()
+    return True
+
+def resume_unfinished_jobs():
+    """Pick up jobs interrupted by a restart or paused for lack of sessions"""
+    for job_id in job_store.unfinished():
+        if start_job(job_id):
+            print(f"Resuming job {job_id}")
+
+def process_scraping(job_id):
     # Clean up old files before starting new scraping
     cleanup_old_files()
     
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    job = job_store.get(job_id)
     
-    # Create more descriptive filenames
-    main_txt = f'scraped_data/all_profiles_{timestamp}.txt'
-    main_excel = f'scraped_data/all_profiles_{timestamp}.xlsx'
-    
-    # Separate files for different post count groups with clear names
-    low_posts_txt = f'scraped_data/profiles_under_5_posts_{timestamp}.txt'
-    high_posts_txt = f'scraped_data/profiles_over_5_posts_{timestamp}.txt'
-    low_posts_excel = f'scraped_data/profiles_under_5_posts_{timestamp}.xlsx'
-    high_posts_excel = f'scraped_data/profiles_over_5_posts_{timestamp}.xlsx'
-    
-    successful_scrapes = 0
-    failed_scrapes = 0
-    rate_limited = 0
-    
-    # Lists to store profile data for different groups
-    low_posts_data = []  # 1-5 posts
-    high_posts_data = []  # >5 posts
-    
-    with open(main_txt, 'w', encoding='utf-8') as f:
-        f.write(f"Instagram Profile Data Scraping Results\n")
-        f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"Powered by: insta-scrape \n")
-        f.write("=" * 80 + "\n\n")
-        
-        f.write("IMPORTANT NOTES:\n")
-        f.write("- Instagram heavily restricts automated data access\n")
-        f.write("- This tool provides basic public profile information only\n")
-        f.write("- For detailed analytics, use Instagram Business API\n")
-        f.write("- Respect Instagram's Terms of Service and rate limits\n")
-        f.write("=" * 80 + "\n\n")
-        
-        for i, username in enumerate(usernames, 1):
-            f.write(f"PROFILE {i}/{len(usernames)}: @{username}\n")
-            f.write("-" * 50 + "\n")
-            
-            profile_data = scraper.scrape_profile(username)
-            
-            if 'error' in profile_data:
-                f.write(f"❌ ERROR: {profile_data['error']}\n")
-                
-                if profile_data.get('scraping_status') == 'rate_limited':
-                    rate_limited += 1
-                    f.write("💡 TIP: Try again later when rate limits reset\n")
-                else:
-                    failed_scrapes += 1
-                
-                f.write("\n")
-                continue
-            
-            successful_scrapes += 1
-            
-            # Write profile information
-            f.write(f"✅ Successfully scraped: @{profile_data.get('username', username)}\n")
-            f.write(f"📁 Profile URL: {profile_data.get('profile_url', 'N/A')}\n")
-            f.write(f"👤 Full Name: {profile_data.get('full_name', 'N/A')}\n")
-            f.write(f"📝 Biography: {profile_data.get('biography', 'N/A')}\n")
-            f.write(f"👥 Followers: {profile_data.get('followers', 'N/A')}\n")
-            f.write(f"➡️ Following: {profile_data.get('following', 'N/A')}\n")
-            f.write(f"📸 Posts Count: {profile_data.get('posts_count', 'N/A')}\n")
-            f.write(f"✔️ Verified: {'Yes' if profile_data.get('is_verified') else 'No'}\n")
-            f.write(f"🔒 Private: {'Yes' if profile_data.get('is_private') else 'No'}\n")
-            f.write(f"🔗 External URL: {profile_data.get('external_url', 'N/A')}\n")
-            f.write(f"🖼️ Profile Picture: {profile_data.get('profile_pic_url', 'N/A')}\n")
-            f.write(f"⏰ Scraped At: {profile_data.get('scraped_at')}\n")
-            
-            # Add notes if any
-            if profile_data.get('note'):
-                f.write(f"📋 Note: {profile_data['note']}\n")
-            
-            if profile_data.get('posts_error'):
-                f.write(f"⚠️ Posts Info: {profile_data['posts_error']}\n")
-            
-            # Prepare data for Excel
-            excel_data = {
-                'Username': profile_data.get('username', username),
-                'Full Name': profile_data.get('full_name', 'N/A'),
-                'Biography': profile_data.get('biography', 'N/A'),
-                'Followers': profile_data.get('followers', 'N/A'),
-                'Following': profile_data.get('following', 'N/A'),
-                'Posts Count': profile_data.get('posts_count', 'N/A'),
-                'Verified': 'Yes' if profile_data.get('is_verified') else 'No',
-                'Private': 'Yes' if profile_data.get('is_private') else 'No',
-                'External URL': profile_data.get('external_url', 'N/A'),
-                'Profile Picture URL': profile_data.get('profile_pic_url', 'N/A'),
-                'Scraped At': profile_data.get('scraped_at', 'N/A'),
-                'Status': 'Success',
-                'Note': profile_data.get('note', ''),
-                'Posts Error': profile_data.get('posts_error', '')
-            }
-            
-            # Sort into appropriate group based on post count
-            try:
-                posts_count = int(profile_data.get('posts_count', 0))
-                if posts_count == 0:
-                    # Skip profiles with 0 posts
-                    continue
-                elif 1 <= posts_count <= 5:
-                    low_posts_data.append(excel_data)
-                else:
-                    high_posts_data.append(excel_data)
-            except (ValueError, TypeError):
-                # If posts count is not a valid number, skip the profile
-                continue
-            
-            f.write("\n" + "=" * 80 + "\n\n")
-            
-            # Add delay between requests to be respectful
-            if i < len(usernames):  # Don't sleep after the last username
-                time.sleep(3)
-        
-        # Write summary
-        f.write("SCRAPING SUMMARY:\n")
-        f.write("-" * 30 + "\n")
-        f.write(f"✅ Successful: {successful_scrapes}\n")
-        f.write(f"❌ Failed: {failed_scrapes}\n")
-        f.write(f"⏱️ Rate Limited: {rate_limited}\n")
-        f.write(f"📊 Total Processed: {len(usernames)}\n")
-        f.write(f"👥 Profiles with 1-5 Posts: {len(low_posts_data)}\n")
-        f.write(f"👥 Profiles with More than 5 Posts: {len(high_posts_data)}\n")
-        f.write(f"⏰ Completed At: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    # Results stream to an export worker process that writes the Parquet copy and, unless they
+    # are rendered on download, the TXT/XLSX files; on resume they are rebuilt from the
+    # checkpointed results first
+    if Config.LAZY_EXPORTS:
+        outputs = export_stage.open(job_id, job['stamp'], job['total'], job_store_path=job_store.path)
+        on_result = render_cache.declaring(job_id, job['stamp'], outputs.add)
+    else:
+        outputs = export_stage.open(job_id, job['stamp'], job['total'], 'scraped_data', file_index=file_index,
+                                    job_store_path=job_store.path)
+        on_result = outputs.add
     
-    # Create separate Excel files for each group
     try:
-        if low_posts_data:
-            df_low = pd.DataFrame(low_posts_data)
-            df_low.to_excel(low_posts_excel, index=False, engine='openpyxl')
-            
-            # Write low posts text file
-            with open(low_posts_txt, 'w', encoding='utf-8') as f:
-                f.write("Instagram Profiles with 1-5 Posts\n")
-                f.write("=" * 50 + "\n\n")
-                f.write(f"Total Profiles: {len(low_posts_data)}\n")
-                f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-                f.write("-" * 50 + "\n\n")
-                for profile in low_posts_data:
-                    f.write(f"Username: {profile['Username']}\n")
-                    f.write(f"Posts Count: {profile['Posts Count']}\n")
-                    f.write(f"Full Name: {profile['Full Name']}\n")
-                    f.write(f"Followers: {profile['Followers']}\n")
-                    f.write(f"Following: {profile['Following']}\n")
-                    f.write("-" * 30 + "\n")
-        
-        if high_posts_data:
-            df_high = pd.DataFrame(high_posts_data)
-            df_high.to_excel(high_posts_excel, index=False, engine='openpyxl')
-            
-            # Write high posts text file
-            with open(high_posts_txt, 'w', encoding='utf-8') as f:
-                f.write("Instagram Profiles with More than 5 Posts\n")
-                f.write("=" * 50 + "\n\n")
-                f.write(f"Total Profiles: {len(high_posts_data)}\n")
-                f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-                f.write("-" * 50 + "\n\n")
-                for profile in high_posts_data:
-                    f.write(f"Username: {profile['Username']}\n")
-                    f.write(f"Posts Count: {profile['Posts Count']}\n")
-                    f.write(f"Full Name: {profile['Full Name']}\n")
-                    f.write(f"Followers: {profile['Followers']}\n")
-                    f.write(f"Following: {profile['Following']}\n")
-                    f.write("-" * 30 + "\n")
-        
-        # Create main Excel file with all data
-        df = pd.DataFrame(low_posts_data + high_posts_data)
-        df.to_excel(main_excel, index=False, engine='openpyxl')
-        
-    except Exception as e:
-        print(f"Error creating Excel files: {e}")
+        # Profiles are fetched concurrently; pacing comes from the per-session budget
+        engine = FetchEngine(session_pool, cache=profile_cache, refresh=job['options'].get('refresh', False))
+        status = run_job(job_store, job_id, engine, on_result=on_result, on_replay=on_result,
+                         profile=job['options'].get('profile', False))
+        print(f"Job {job_id} {status}")
+    finally:
+        # Returns without waiting for the files; this thread is free for the next job
+        outputs.close()
 
 @app.route('/delete/<filename>')
 def delete_file(filename):
@@ -628,7 +580,8 @@ def delete_file(filename):
         # Check if file exists in scraped_data directory
         file_path = os.path.join('scraped_data', safe_filename)
         
-        if not os.path.exists(file_path):
+        # Files rendered on download are listed before they exist on disk
+        if not os.path.exists(file_path) and file_index.get(safe_filename) is None:
             return jsonify({
                 'success': False, 
                 'error': f'File {safe_filename} not found'
@@ -643,7 +596,9 @@ def delete_file(filename):
         
         # Try to delete the file
         try:
-            os.remove(file_path)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            file_index.remove(safe_filename)
             return jsonify({
                 'success': True,
                 'message': f'File {safe_filename} deleted successfully'
@@ -668,25 +623,24 @@ def delete_file(filename):
 @app.route('/files')
 def list_files():
     try:
-        files = []
-        for f in os.listdir('scraped_data'):
-            if f.endswith(('.txt', '.xlsx')):
-                file_path = os.path.join('scraped_data', f)
-                try:
-                    file_stats = os.stat(file_path)
-                    files.append({
-                        'name': f,
-                        'type': 'Excel' if f.endswith('.xlsx') else 'Text',
-                        'size': file_stats.st_size,
-                        'created': datetime.fromtimestamp(file_stats.st_ctime).strftime('%Y-%m-%d %H:%M:%S'),
-                        'modified': datetime.fromtimestamp(file_stats.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
-                    })
-                except Exception as e:
-                    print(f"Error getting stats for {f}: {e}")
-                    continue
-                    
-        files.sort(key=lambda x: x['modified'], reverse=True)  # Most recent first
-        return jsonify({'files': files})
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = request.args.get('per_page', Config.FILES_PAGE_SIZE, type=int)
+        per_page = min(max(per_page, 1), Config.FILES_MAX_PAGE_SIZE)
+        files, total = file_index.list(
+            page=page,
+            per_page=per_page,
+            job_id=request.args.get('job'),
+            file_type=request.args.get('type'),
+            kind=request.args.get('kind'),
+            sort=request.args.get('sort', 'modified'),
+            descending=request.args.get('order', 'desc') != 'asc'
+        )  # Most recent first by default
+        return jsonify({
+            'files': files,
+            'total': total,
+            'page': page,
+            'per_page': per_page
+        })
     except Exception as e:
         return jsonify({
             'files': [], 
@@ -696,16 +650,22 @@ def list_files():
 @app.route('/download/<filename>')
 def download_file(filename):
     try:
-        file_path = os.path.join('scraped_data', filename)
-        if os.path.exists(file_path):
-            return send_file(
-                file_path,
-                as_attachment=True,
-                download_name=filename,
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' if filename.endswith('.xlsx') else 'text/plain'
-            )
-        else:
+        filename = os.path.basename(filename)
+        # Rendered from the job store on first download if it is not on disk yet
+        rendered = render_cache.open(filename)
+        if rendered is None:
             return jsonify({'error': 'File not found'}), 404
+        file_path, scratch = rendered
+        response = send_file(
+            file_path,
+            as_attachment=True,
+            download_name=filename,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' if filename.endswith('.xlsx') else 'text/plain'
+        )
+        if scratch:
+            # One-off render of a job still running
+            response.call_on_close(lambda: shutil.rmtree(scratch, ignore_errors=True))
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -714,21 +674,22 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'scraped_files': len([f for f in os.listdir('scraped_data') if f.endswith('.txt')])
+        'scraped_files': file_index.count('Text'),
+        'fetch_strategies': strategy_router.status()
     })
 
 # Add cleanup function to remove old files
 def cleanup_old_files(days=7):
     """Remove files older than specified days"""
     try:
-        current_time = time.time()
-        for filename in os.listdir('scraped_data'):
+        cutoff = time.time() - days * 86400  # 86400 seconds in a day
+        for filename in file_index.older_than(cutoff):
             file_path = os.path.join('scraped_data', filename)
             if os.path.isfile(file_path):
-                file_time = os.path.getmtime(file_path)
-                if (current_time - file_time) > (days * 86400):  # 86400 seconds in a day
-                    os.remove(file_path)
-                    print(f"Removed old file: {filename}")
+                os.remove(file_path)
+                print(f"Removed old file: {filename}")
+            file_index.remove(filename)
+        prune_profiles(cutoff)
     except Exception as e:
         print(f"Error during cleanup: {e}")
 
@@ -1,10 +1,21 @@
+import os
 import time
-from functools import wraps
-from prometheus_client import Counter, Histogram, Gauge
+from flask import Response, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+    start_http_server
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+# With PROMETHEUS_MULTIPROC_DIR set (gunicorn, Celery prefork) every process writes its samples
+# there and a scrape aggregates them; otherwise the default registry of this process is served
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+# Anything else would let clients mint label values
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
 # Define metrics
 REQUEST_COUNT = Counter(
     'instagram_scraper_requests_total',
@@ -26,7 +37,35 @@ SCRAPE_COUNT = Counter(
 
 ACTIVE_SESSIONS = Gauge(
     'instagram_scraper_active_sessions',
-    'Number of active Instagram sessions'
+    'Number of active Instagram sessions',
+    multiprocess_mode='livesum'
+)
+
+SESSION_REQUEST_RATE = Gauge(
+    'instagram_scraper_session_request_rate',
+    'Current adaptive request rate per Instagram session (requests per minute)',
+    ['session'],
+    multiprocess_mode='liveall'
+)
+
+TRANSPORT_EVENTS = Counter(
+    'instagram_scraper_transport_events_total',
+    'Outgoing HTTP requests, new connections and timeouts of the scraper sessions',
+    ['transport', 'event']
+)
+
+FETCH_STRATEGY_LATENCY = Histogram(
+    'instagram_scraper_fetch_strategy_seconds',
+    'Time spent per profile fetch strategy attempt',
+    ['strategy', 'outcome']
+)
+
+# Queue and rate-limit waits run to minutes, so the buckets go well past the default 10s
+PIPELINE_STAGE_LATENCY = Histogram(
+    'instagram_scraper_pipeline_stage_seconds',
+    'Time spent per stage of the scrape pipeline (queue wait, rate-limit wait, network, parse, retry backoff, export)',
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf'))
 )
 
 FILE_OPERATIONS = Counter(
@@ -36,32 +75,9 @@ FILE_OPERATIONS = Counter(
 )
 
 def track_metrics(endpoint=None):
+    """Kept for the routes that use it; requests are recorded once by init_metrics"""
     def decorator(f):
-        @wraps(f)
-        def wrapped(*args, **kwargs):
-            start_time = time.time()
-            
-            try:
-                response = f(*args, **kwargs)
-                status = 'success'
-            except Exception as e:
-                status = 'error'
-                logger.error(f"Error in {endpoint}: {str(e)}")
-                raise
-            
-            # Record metrics
-            REQUEST_COUNT.labels(
-                endpoint=endpoint or f.__name__,
-                method=request.method,
-                status=status
-            ).inc()
-            
-            REQUEST_LATENCY.labels(
-                endpoint=endpoint or f.__name__
-            ).observe(time.time() - start_time)
-            
-            return response
-        return wrapped
+        return f
     return decorator
 
 def track_scrape(status):
@@ -75,29 +91,83 @@ def track_file_operation(operation, file_type):
         file_type=file_type
     ).inc()
 
+def track_transport(transport, event):
+    """Track an outgoing request, new connection or timeout"""
+    TRANSPORT_EVENTS.labels(transport=transport, event=event).inc()
+
+def track_fetch_strategy(strategy, outcome, seconds):
+    """Track one attempt of a profile fetch strategy (json, html)"""
+    FETCH_STRATEGY_LATENCY.labels(strategy=strategy, outcome=outcome).observe(seconds)
+
+def track_stage(stage, seconds):
+    """Track the time of one pass through a scrape pipeline stage"""
+    PIPELINE_STAGE_LATENCY.labels(stage=stage).observe(seconds)
+
 def update_active_sessions(count):
     """Update active sessions gauge"""
     ACTIVE_SESSIONS.set(count)
 
-class MetricsMiddleware:
-    def __init__(self, app):
-        self.app = app
-    
-    def __call__(self, environ, start_response):
-        start_time = time.time()
-        
-        def custom_start_response(status, headers, exc_info=None):
-            # Record request metrics
-            REQUEST_COUNT.labels(
-                endpoint=environ.get('PATH_INFO', 'unknown'),
-                method=environ.get('REQUEST_METHOD', 'unknown'),
-                status=status.split()[0]
-            ).inc()
-            
-            REQUEST_LATENCY.labels(
-                endpoint=environ.get('PATH_INFO', 'unknown')
-            ).observe(time.time() - start_time)
-            
-            return start_response(status, headers, exc_info)
-        
-        return self.app(environ, custom_start_response) 
\ No newline at end of file
+def update_session_rate(session, rate):
+    """Update the adaptive request rate gauge for a session"""
+    SESSION_REQUEST_RATE.labels(session=session).set(rate)
+
+def remove_session_rate(session):
+    """Drop the rate series of a session that left the pool"""
+    try:
+        SESSION_REQUEST_RATE.remove(session)
+    except KeyError:
+        pass
+
+def _route_label():
+    # The matched rule ('/download/<filename>'), never the raw path, so series stay bounded
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def init_metrics(app, endpoint='/metrics'):
+    """Record every request of app once, labelled by route template, and serve the registry at endpoint"""
+    @app.before_request
+    def start_timer():
+        request.environ['metrics.start'] = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = request.environ.get('metrics.start')
+        if started is not None:
+            route = _route_label()
+            method = request.method if request.method in METHODS else 'other'
+            REQUEST_COUNT.labels(endpoint=route, method=method, status=response.status_code).inc()
+            REQUEST_LATENCY.labels(endpoint=route).observe(time.perf_counter() - started)
+        return response
+
+    if endpoint and endpoint not in {rule.rule for rule in app.url_map.iter_rules()}:
+        app.add_url_rule(endpoint, 'metrics', metrics_view)
+
+def collect():
+    """Exposition text of this process's metrics, or of every process in multiprocess mode"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+def metrics_view():
+    return Response(collect(), mimetype=CONTENT_TYPE_LATEST)
+
+def start_metrics_server(port=None):
+    """Serve /metrics on METRICS_PORT from a process without a web app (e.g. a Celery worker)"""
+    from config import Config
+    port = port or Config.METRICS_PORT
+    try:
+        if MULTIPROCESS:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            start_http_server(port, registry=registry)
+        else:
+            start_http_server(port)
+        logger.info(f"Serving metrics on port {port}")
+    except OSError as e:
+        logger.error(f"Could not serve metrics on port {port}: {str(e)}")
+
+def mark_process_dead(pid):
+    """Drop a dead worker's live gauges; call from gunicorn's child_exit hook in multiprocess mode"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
@@ -1,60 +1,293 @@
 import time
-from collections import defaultdict
+from collections import OrderedDict
 from threading import Lock
 from functools import wraps
 from flask import request, jsonify
+from config import Config
 import logging
 
+try:
+    import redis
+except ImportError:  # optional: limits are per process without it
+    redis = None
+
 logger = logging.getLogger(__name__)
 
+# Sliding-window counter: the current fixed window's count plus the previous window's count
+# weighted by how much of it still overlaps the sliding window. O(1) state and work per key.
+def _estimate(previous, current, elapsed, window):
+    return previous * (window - elapsed) / window + current
+
+def _retry_after(previous, current, elapsed, window, limit):
+    """Seconds until one more request fits under limit"""
+    target = limit - 1
+    if current <= target:
+        if previous > 0:
+            # The previous window's share drains linearly until the window ends
+            wait = (_estimate(previous, current, elapsed, window) - target) * window / previous
+            if wait <= window - elapsed:
+                return max(0.0, wait)
+        return window - elapsed
+    # Only after the rollover, once the current count has drained enough as the previous window
+    return (window - elapsed) + window * (1 - target / current)
+
+class _Stripe:
+    __slots__ = ('lock', 'counters')
+
+    def __init__(self):
+        self.lock = Lock()
+        # key -> [window index, previous count, current count, time both counts have expired],
+        # least recently used first
+        self.counters = OrderedDict()
+
+class MemoryWindowBackend:
+    """Sliding-window counters in this process; each gunicorn worker counts on its own.
+
+    Keys are spread over `stripes` independently locked shards, so checks for
+    different clients rarely wait on each other. A key is dropped once both
+    of its windows have passed, checked from the least recently used end on
+    every hit, and each shard keeps at most max_keys / stripes keys, so
+    memory stays bounded however many clients call.
+    """
+    def __init__(self, stripes=None, max_keys=None):
+        stripes = stripes or Config.RATE_LIMIT_STRIPES
+        self.stripes = [_Stripe() for _ in range(stripes)]
+        self.max_keys_per_stripe = max(1, (max_keys or Config.RATE_LIMIT_MAX_KEYS) // stripes)
+
+    def __len__(self):
+        return sum(len(stripe.counters) for stripe in self.stripes)
+
+    def hit(self, key, limit, window, cost=1):
+        """(allowed, previous, current, elapsed) after trying to add cost requests for key"""
+        now = time.time()
+        index, elapsed = divmod(now, window)
+        stripe = self.stripes[hash(key) % len(self.stripes)]
+        with stripe.lock:
+            counters = stripe.counters
+            counter = counters.get(key)
+            if counter is None:
+                counter = counters[key] = [index, 0, 0, 0.0]
+            else:
+                counters.move_to_end(key)
+                if counter[0] != index:
+                    # Roll over; a gap of more than one window leaves nothing to carry
+                    counter[1] = counter[2] if counter[0] == index - 1 else 0
+                    counter[2] = 0
+                    counter[0] = index
+            allowed = cost > 0 and _estimate(counter[1], counter[2], elapsed, window) + cost <= limit
+            if allowed:
+                counter[2] += cost
+            counter[3] = (index + 2) * window
+            result = allowed, counter[1], counter[2], elapsed
+            self._evict(counters, now)
+        return result
+
+    def _evict(self, counters, now):
+        # Idle keys sit at the front; stop at the first one still counting
+        while counters:
+            key, counter = next(iter(counters.items()))
+            if counter[3] > now and len(counters) <= self.max_keys_per_stripe:
+                break
+            del counters[key]
+
+# KEYS: current and previous window counters. ARGV: limit, window, elapsed seconds, cost.
+# Read, decide and increment in one atomic step on the server.
+_HIT_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local elapsed = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local allowed = 0
+if cost > 0 and previous * (window - elapsed) / window + current + cost <= limit then
+    current = redis.call('INCRBY', KEYS[1], cost)
+    redis.call('EXPIRE', KEYS[1], math.ceil(window * 2))
+    allowed = 1
+end
+return {allowed, previous, current}
+"""
+
+class RedisWindowBackend:
+    """Sliding-window counters in Redis, shared by every worker and node.
+
+    Each check is one script call on two integer keys that expire after two
+    windows. If Redis is unreachable the check falls back to local counters
+    rather than failing the request.
+    """
+    def __init__(self, url, prefix='ratelimit'):
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self.script = self.client.register_script(_HIT_SCRIPT)
+        self.prefix = prefix
+        self.fallback = MemoryWindowBackend()
+        self.failing = False
+
+    def hit(self, key, limit, window, cost=1):
+        now = time.time()
+        index, elapsed = divmod(now, window)
+        index = int(index)
+        keys = [f'{self.prefix}:{key}:{index}', f'{self.prefix}:{key}:{index - 1}']
+        try:
+            allowed, previous, current = self.script(keys=keys, args=[limit, window, elapsed, cost])
+        except redis.RedisError as e:
+            if not self.failing:
+                logger.error(f"Rate limit storage unavailable, limiting per process: {str(e)}")
+                self.failing = True
+            return self.fallback.hit(key, limit, window, cost)
+        if self.failing:
+            logger.info("Rate limit storage reachable again")
+            self.failing = False
+        return bool(allowed), int(previous), int(current), elapsed
+
+def create_backend(url=None):
+    """Backend for RATE_LIMIT_STORAGE_URL: redis://... when the redis package is installed, memory otherwise"""
+    url = url or Config.RATE_LIMIT_STORAGE_URL
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        if redis is not None:
+            return RedisWindowBackend(url)
+        logger.warning("redis is not installed; rate limits are per process")
+    return MemoryWindowBackend()
+
+_default_backend = None
+
+def default_backend():
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = create_backend()
+    return _default_backend
+
 class RateLimiter:
-    def __init__(self, max_requests, window):
+    """At most max_requests per sliding window of `window` seconds for each key.
+
+    name separates the counters of different limiters sharing a backend.
+    """
+    def __init__(self, max_requests, window, name=None, backend=None):
         self.max_requests = max_requests
         self.window = window
-        self.requests = defaultdict(list)
+        self.name = name or f'{max_requests}:{window}'
+        self.backend = backend
+
+    def _hit(self, key, cost):
+        backend = self.backend if self.backend is not None else default_backend()
+        return backend.hit(f'{self.name}:{key}', self.max_requests, self.window, cost)
+
+    def check(self, key):
+        """Count one request for key; returns (allowed, remaining, retry_after seconds)"""
+        allowed, previous, current, elapsed = self._hit(key, 1)
+        remaining = max(0, int(self.max_requests - _estimate(previous, current, elapsed, self.window)))
+        retry_after = 0.0 if allowed else _retry_after(previous, current, elapsed, self.window, self.max_requests)
+        return allowed, remaining, retry_after
+
+    def is_rate_limited(self, key):
+        return not self.check(key)[0]
+
+    def get_remaining_requests(self, key):
+        _, previous, current, elapsed = self._hit(key, 0)
+        return max(0, int(self.max_requests - _estimate(previous, current, elapsed, self.window)))
+
+class TokenBucket:
+    """Token bucket that hands out request slots at a steady rate"""
+    def __init__(self, rate, capacity=1):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
         self.lock = Lock()
     
-    def is_rate_limited(self, key):
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def reserve(self, tokens=1):
+        """Take tokens now and return how many seconds the caller must wait before using them"""
         with self.lock:
-            now = time.time()
-            # Remove old requests
-            self.requests[key] = [req_time for req_time in self.requests[key] 
-                                if now - req_time < self.window]
-            
-            # Check if rate limit exceeded
-            if len(self.requests[key]) >= self.max_requests:
-                return True
-            
-            # Add new request
-            self.requests[key].append(now)
-            return False
+            self._refill(time.monotonic())
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
     
-    def get_remaining_requests(self, key):
+    def time_until_available(self, tokens=1):
+        """Seconds until the given number of tokens could be taken without waiting"""
         with self.lock:
-            now = time.time()
-            self.requests[key] = [req_time for req_time in self.requests[key] 
-                                if now - req_time < self.window]
-            return max(0, self.max_requests - len(self.requests[key]))
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                return 0.0
+            return (tokens - self.tokens) / self.rate
 
-def rate_limit(max_requests, window):
-    limiter = RateLimiter(max_requests, window)
+class AdaptiveRateController:
+    """AIMD pacing for a TokenBucket, in requests per minute.
+
+    Each clean response adds `increase` to the rate up to max_rate; a throttling
+    response multiplies it by `decrease` down to min_rate and pauses the caller,
+    for Retry-After seconds when the server sent one.
+    """
+    def __init__(self, bucket, min_rate, max_rate, increase=0.5, decrease=0.5, pause=60):
+        self.bucket = bucket
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.pause = pause
+        self.lock = Lock()
+    
+    @property
+    def rate(self):
+        """Current rate in requests per minute"""
+        return self.bucket.rate * 60.0
+    
+    def _set_rate(self, per_minute):
+        self.bucket.rate = min(self.max_rate, max(self.min_rate, per_minute)) / 60.0
+    
+    def on_success(self):
+        with self.lock:
+            self._set_rate(self.rate + self.increase)
+        return self.rate
     
+    def on_throttle(self, retry_after=None):
+        """Back off after a 429 or login redirect; returns how long to pause in seconds"""
+        with self.lock:
+            self._set_rate(self.rate * self.decrease)
+            with self.bucket.lock:
+                # Drop any saved-up burst so requests resume at the new rate
+                self.bucket.tokens = min(self.bucket.tokens, 0)
+        try:
+            return max(0.0, float(retry_after)) if retry_after is not None else self.pause
+        except (TypeError, ValueError):
+            return self.pause
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def rate_limit(max_requests, window):
     def decorator(f):
+        limiter = RateLimiter(max_requests, window, name=f'{f.__module__}.{f.__qualname__}')
+        
         @wraps(f)
         def wrapped(*args, **kwargs):
             # Get client IP or use a default key
             key = request.remote_addr or 'default'
             
-            if limiter.is_rate_limited(key):
-                remaining_time = window - (time.time() - limiter.requests[key][0])
+            allowed, remaining, retry_after = limiter.check(key)
+            if not allowed:
                 logger.warning(f"Rate limit exceeded for {key}")
                 return jsonify({
                     'error': 'Rate limit exceeded',
-                    'retry_after': int(remaining_time),
+                    'retry_after': int(retry_after) + 1,
                     'remaining_requests': 0
                 }), 429
             
-            remaining = limiter.get_remaining_requests(key)
             response = f(*args, **kwargs)
             
             # Add rate limit headers
@@ -69,5 +302,5 @@ def rate_limit(max_requests, window):
     return decorator
 
 # Create global rate limiters
-api_limiter = RateLimiter(100, 3600)  # 100 requests per hour
-scrape_limiter = RateLimiter(50, 3600)  # 50 scrapes per hour 
\ No newline at end of file
+api_limiter = RateLimiter(100, 3600, name='api')  # 100 requests per hour
+scrape_limiter = RateLimiter(50, 3600, name='scrape')  # 50 scrapes per hour 
\ No newline at end of file